@@ -21,13 +21,29 @@ import os
 import sys
 import struct
 import time
+import errno
+import select
 import socket
+import re
+import array
+import hashlib
+import threading
+import subprocess
+import collections
 
-try:
-    import xml.etree.cElementTree as ET
-except ImportError:
-    import xml.etree.ElementTree as ET
+import OwlParser as packetShapes
+from OwlParser import OwlParser, PacketType, decodeWatts, decodeFloat, decodeInt
+from OwlPipeline import OwlPipeline, ShardedPipeline
+from OwlReactor import OwlReactor, OwlDatagramProtocol, TimerQueue
+from OwlMetrics import formatKeyValues
+from OwlStats import StageTimer
 
+try:
+    # Python 2: expat & re accept the old-style read-only buffer but not memoryview
+    _readOnlyView = buffer
+except NameError:
+    def _readOnlyView(buf, offset, size):
+        return memoryview(buf)[offset:offset + size]
 
 ########################################
 ########################################
@@ -44,25 +60,58 @@ class NetworkOwl():
     adapt the associatePacket method to interface to the surrounding framework.
     
    Instance variables:
-        plugin  - represents the object containing an instance of this class.
+        plugin          - represents the object containing an instance of this class.
+        ring            - preallocated receive buffers shared by every datagram.
+        packetCount     - number of datagrams received.
+        truncatedCount  - number of datagrams discarded as too big for a ring slot.
+        pipeline        - OwlPipeline or ShardedPipeline parsing & publishing off the
+                          socket thread, or None.
+        timers          - TimerQueue of housekeeping tasks run from the receive loop.
+        parser          - OwlParser extracting the fields from each datagram.
+        duplicates      - DuplicateFilter spotting repeats of recent datagrams.
+        acks            - AckSender acknowledging datagrams to the Owls.
         
     Constants:
         MULTICAST_GROUP - defined by NetworkOwl hardware: group IP address.
         MULTICAST_PORT  - defined by NetworkOwl hardware: port number.
+        MAX_DATAGRAM    - largest datagram accepted from the socket.
+        RING_SLOTS      - receive buffers in the ring: most datagrams drained per wakeup.
+        DUPLICATE_SLOTS - recent datagrams remembered to spot repeats.
+        SELECT_TIMEOUT  - seconds to wait for data before re-checking the stop flag.
      
     """   
     # constants for NetworkOwl
     MULTICAST_GROUP = '224.192.32.19'
     MULTICAST_PORT = 22600
+    MAX_DATAGRAM = 4096
+    RING_SLOTS = 32
+    DUPLICATE_SLOTS = 64
+    SELECT_TIMEOUT = 1.0
+    DROP_CHECK_INTERVAL = 60.0
+    IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)
 
     ########################################    
     def __init__(self, plugin):
-        """Store the reference to the containing object."""
+        """Store the reference to the containing object & allocate the receive ring."""
         self.plugin = plugin
+        self.ring = DatagramRing(NetworkOwl.RING_SLOTS, NetworkOwl.MAX_DATAGRAM)
+        self.packetCount = 0
+        self.truncatedCount = 0
+        self.pipeline = None
+        self.timers = TimerQueue(plugin.mylogger)
+        self.parser = OwlParser(PACKET_TYPES)
+        self.duplicates = DuplicateFilter(NetworkOwl.DUPLICATE_SLOTS)
+        self.acks = AckSender(plugin.mylogger, self.timers)
+        self.knownTags = set(tag for tag, ver in PACKET_TYPES)
+        self.gaps = GapDetector()
+        self.listeners = collections.OrderedDict()
+        self.hostDrops = HostDrops() if HostDrops.SUPPORTED else None
+        self.reportedDrops = 0
+        self.reportedLost = 0
 
     ########################################
-    def startProtocol(self):
-        """Joins the multicast group."""
+    def startProtocol(self, interface=None):
+        """Joins the multicast group, on the given interface address or on all interfaces."""
         self.plugin.mylogger.log(4, "Intuition: startProtocol called")
         sock = None
         
@@ -70,125 +119,867 @@ class NetworkOwl():
             # Create the socket
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.setReceiveBuffer(sock, self.plugin.receiveBuffer)
 
             # Bind to the server address
             sock.bind(('', NetworkOwl.MULTICAST_PORT))
 
             # Tell the operating system to add the socket to the multicast group
-            # on all interfaces.
+            # on all interfaces, unless we've been given a specific one.
             group = socket.inet_aton(NetworkOwl.MULTICAST_GROUP)
-            mreq = struct.pack('4sL', group, socket.INADDR_ANY)
+            if interface:
+                mreq = struct.pack('4s4s', group, socket.inet_aton(interface))
+                if sys.platform.startswith('linux'):
+                    # Linux otherwise hands each socket the groups joined by every
+                    # socket, so each interface's datagrams would arrive on all of them
+                    sock.setsockopt(socket.IPPROTO_IP, NetworkOwl.IP_MULTICAST_ALL, 0)
+            else:
+                mreq = struct.pack('4sL', group, socket.INADDR_ANY)
             sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
         except socket.error, msg:
-            self.mylogger.logError("Intuition: socket error, closing")
-            sock.close()
+            self.plugin.mylogger.logError("Intuition: socket error on %s, closing: %s" % (interface or "all interfaces", msg))
+            if sock != None:
+                sock.close()
+            sock = None
         
+        if sock != None:
+            self.addListener(sock, interface)
         return sock
 
     ########################################
-    def runProtocol(self, sock):      
+    def startProtocols(self, interfaces=None):
+        """Joins the multicast group with one socket per interface address, or
+        with a single socket on all interfaces if none are given.
+        
+        Returns the sockets that joined - interfaces that failed are logged & skipped.
+        
+        """
+        socks = []
+        for interface in (interfaces or [None]):
+            sock = self.startProtocol(interface)
+            if sock != None:
+                socks.append(sock)
+        return socks
+
+    ########################################
+    @staticmethod
+    def parseInterfaces(text):
+        """Interface addresses from a comma separated list such as '192.168.1.10, 10.0.20.5'.
+        
+        Raises ValueError unless each is a dotted quad IPv4 address.
+        
+        """
+        interfaces = []
+        for item in (text or "").split(","):
+            item = item.strip()
+            if item:
+                if item.count(".") != 3:
+                    raise ValueError("%s is not an IPv4 address" % item)
+                try:
+                    socket.inet_aton(item)
+                except socket.error:
+                    raise ValueError("%s is not an IPv4 address" % item)
+                if item not in interfaces:
+                    interfaces.append(item)
+        return interfaces
+
+    ########################################
+    def addListener(self, sock, interface=None):
+        """Start keeping the counters of a socket receiving on interface (None for all)."""
+        self.listeners[sock] = ListenSocket(sock, interface)
+
+    ########################################
+    def setReceiveBuffer(self, sock, size):
+        """Ask for a receive buffer of size bytes on the socket, if size isn't 0.
+        
+        The kernel may round the size or cap it (kern.ipc.maxsockbuf on OS X,
+        net.core.rmem_max on Linux), so the size it settled on is logged, kept
+        with the socket's counters & returned.
+        
+        """
+        if size:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+            except socket.error, e:
+                self.plugin.mylogger.logError("Intuition: can't set the receive buffer to %d bytes: %s" % (size, e))
+        bufferSize = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.plugin.mylogger.log(3, "Intuition: receive buffer is %d bytes", bufferSize)
+        listener = self.listeners.get(sock)
+        if listener != None:
+            listener.bufferSize = bufferSize
+        return bufferSize
+
+    ########################################
+    def configureReceiveBuffer(self, size):
+        """Resize the receive buffer of every listening socket."""
+        for sock in self.listeners:
+            self.setReceiveBuffer(sock, size)
+
+    ########################################
+    def kernelDropCount(self):
+        """Datagrams the kernel has dropped from the listening sockets, or None if unknown.
+        
+        On OS X this is the host-wide figure from the last time checkDrops
+        refreshed it, so it never waits for netstat.
+        
+        """
+        total = None
+        counters = [listener.drops for listener in self.listeners.itervalues()]
+        if self.hostDrops != None:
+            counters.append(self.hostDrops)
+        for counter in counters:
+            count = counter.count()
+            if count != None:
+                total = (total or 0) + count
+        return total
+
+    ########################################
+    def checkDrops(self):
+        """Timer callback: log datagrams lost since the last check, in the kernel
+        or on the way from the Owls."""
+        if self.hostDrops != None:
+            # read by the next check
+            self.hostDrops.refresh()
+        drops = self.kernelDropCount()
+        if drops != None and drops > self.reportedDrops:
+            self.plugin.mylogger.log(1, "NetworkOwl: kernel dropped %d datagrams in the last %d seconds: "
+                                        "try a bigger receive buffer", drops - self.reportedDrops, NetworkOwl.DROP_CHECK_INTERVAL)
+            self.reportedDrops = drops
+        lost = self.gaps.missedCount
+        if lost > self.reportedLost:
+            self.plugin.mylogger.log(1, "NetworkOwl: %d V2 packets lost in the last %d seconds",
+                                     lost - self.reportedLost, NetworkOwl.DROP_CHECK_INTERVAL)
+            self.reportedLost = lost
+
+    ########################################
+    def dropSummary(self):
+        """One line description of the receive buffers & datagrams lost, for the log."""
+        sizes = ", ".join("%d" % listener.bufferSize for listener in self.listeners.itervalues())
+        drops = self.kernelDropCount()
+        return "receive buffer %s bytes, %s dropped by the kernel%s; %s" % (
+            sizes or "-", "unknown" if drops == None else "%d" % drops,
+            " (whole host)" if self.hostDrops != None else "", self.gaps.summary())
+
+    ########################################
+    def interfaceSummary(self):
+        """One line per listening socket describing what has arrived on it, for the log."""
+        return [listener.summary() for listener in self.listeners.itervalues()]
+
+    ########################################
+    def startPipeline(self, depth, policy, shards=0):
+        """Start parsing & publishing off the socket thread so it only receives:
+        on a parser & a publisher thread, or on shards worker threads each
+        handling its share of the Owls if shards is given."""
+        if shards > 0:
+            self.pipeline = ShardedPipeline(self, shards, depth, policy)
+            self.pipeline.rebalance(self.plugin.contextDict.keys())
+        else:
+            self.pipeline = OwlPipeline(self, depth, policy)
+        self.pipeline.start()
+        
+    ########################################
+    def stopPipeline(self):
+        """Stop the parser & publisher stages, if running."""
+        if self.pipeline != None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    ########################################
+    def runProtocol(self, *socks):      
         """
-            wait loop for retrieving multicast packets from socket.
+            wait loop for retrieving multicast packets from the sockets - one
+            per interface, all served by this one thread.
             assumes is being run in a separate thread so is OK to block waiting
-            sends ACK back to sending station
-            then processes the received packet
+            blocks in select() until a socket is readable (or the timeout
+            expires, so the stop flag is still honoured when the Owls are quiet)
+            then drains every datagram queued on each readable socket before waiting again
             loop until the main Indigo plugin thread variable is reset
         """
+        for sock in socks:
+            sock.setblocking(0)
+        
         while self.plugin.stopThread == False:
         
-            # check config hasn't changed
+            # pick up any config change flagged since the last wakeup
             self.plugin.checkConfig()
             
+            # run any housekeeping timers that have come due
+            self.timers.runDue()
+            
             self.plugin.mylogger.log(4, "Intuition: waiting to receive message")
 
-            data, address = sock.recvfrom(1024)
-            num_bytes = len(data)
+            try:
+                readable, writable, errored = select.select(socks, [], [], self.timers.timeout(NetworkOwl.SELECT_TIMEOUT))
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for sock in readable:
+                self.drainSocket(sock)
+                
+    ########################################
+    def runEventLoop(self, interfaces=None):
+        """
+            alternative to runProtocol: serve one listening socket per interface
+            (or a single socket on all interfaces) from a single-threaded event loop
+            with the ack, parse & publish steps of each datagram scheduled on the loop
+            loop until the main Indigo plugin thread variable is reset
+            returns False if no socket could join the multicast group
+        """
+        reactor = OwlReactor(self.plugin, self.timers)
+        
+        for sock in self.startProtocols(interfaces):
+            reactor.addProtocol(OwlDatagramProtocol(self, sock))
+                
+        if not reactor.protocols:
+            return False
+            
+        reactor.run(NetworkOwl.SELECT_TIMEOUT)
+        return True
+        
+    ########################################
+    def drainSocket(self, sock, handler=None):
+        """
+            read the datagrams currently queued on the non-blocking socket
+            straight into the preallocated ring, at most one ring's worth per call
+            hands each one to handler (handleDatagram by default) as a read-only
+            view of its slot - only valid until the ring wraps
+            returns the number of datagrams handled
+        """
+        if handler == None:
+            handler = self.handleDatagram
+        count = 0
+        timer = self.plugin.stageTimer
+        listener = self.listeners.get(sock)
+        
+        while count < self.ring.slots:
+            if timer != None:
+                began = time.time()
+            try:
+                num_bytes, address, view = self.ring.recvFrom(sock)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.plugin.mylogger.logError("Intuition: socket error on receive: %s" % (e,))
+                break
+            if timer != None:
+                timer.record('receive', StageTimer.ANY, time.time() - began)
+                
+            count += 1
+            self.packetCount += 1
+            if listener != None:
+                listener.packetCount += 1
+
+            self.plugin.mylogger.log(4, 'received %s bytes from %s', num_bytes, address)
+            
+            if view == None:
+                # datagram overflowed its slot: parsing what's left would give a broken packet
+                self.truncatedCount += 1
+                self.plugin.mylogger.logError("Intuition: discarded truncated datagram from %s (more than %d bytes)" % (address[0], self.ring.slotSize))
+                self.sendAck(sock, address)
+                continue
+            
+            if self.plugin.mylogger.isEnabledFor(4):
+                self.plugin.mylogger.log(4, str(view))
 
-            self.plugin.mylogger.log(4, 'received %s bytes from %s' % (num_bytes, address))
-            self.plugin.mylogger.log(4, data)
-            self.plugin.mylogger.log(4, 'sending acknowledgement to %s' % repr(address))
+            capture = self.plugin.capture
+            if capture != None:
+                capture.write(time.time(), address, view)
 
-            # Rather than replying to the group multicast address, we send the
-            # reply directly (unicast) to the originating port:
-            sock.sendto('ack', address)
+            handler(sock, view, address)
+            
+        return count
+        
+    ########################################
+    def handleDatagram(self, sock, view, address):
+        """Acknowledge a datagram & process it, or pass it to the pipeline to process."""
+        self.sendAck(sock, address)
+        
+        tag, mac = self.parser.header(view)
+        self.countArrival(sock, mac)
+        if self.isDuplicate(view, tag, mac):
+            self.plugin.mylogger.log(4, "NetworkOwl: duplicate %s packet skipped", tag)
+            return
 
-            # process the data just received from the Network Owl
-            self.processDataPacket(data)
+        # process the data just received from the Network Owl
+        if self.pipeline != None:
+            self.pipeline.submit(view, tag, mac)
+        else:
+            self.processDataPacket(view)
             
-            self.plugin.sleep(1)
+    ########################################
+    def countArrival(self, sock, mac):
+        """Count a datagram from a known Owl against the interface of the socket it arrived on."""
+        listener = self.listeners.get(sock)
+        if listener != None and mac in self.plugin.contextDict:
+            listener.owls[mac] = listener.owls.get(mac, 0) + 1
+        
+    ########################################
+    def isDuplicate(self, datagram, tag, mac):
+        """Is the datagram, with this root tag & MAC address from its header, an
+        exact repeat of one received recently from the same Owl?
+        
+        Repeats have already been published so need neither parsing nor associating.
+        
+        """
+        return self.duplicates.seen(mac, tag, datagram)
+        
+    ########################################
+    def sendAck(self, sock, address):
+        """Acknowledge a datagram, as the ack mode allows."""
+        self.acks.ack(sock, address)
         
     ########################################
     def processDataPacket(self, datagram):
-        """Parse the datagram & create appropriate data packet instance."""
+        """Parse the datagram & update the server with the resulting packet.
+        
+        datagram may be a string or a read-only view of a ring slot.
+        
+        """
+        packet = self.parseDataPacket(datagram)
+        if packet != None:
+            packet.associate()
+        
+    ########################################
+    def parseDataPacket(self, datagram):
+        """Parse the datagram & create appropriate data packet instance.
+        
+        Returns the packet if it's valid & from a known NetworkOwl, otherwise None.
+        
+        """
     
-        #Create an Element Tree instance to hold the data received from the Network Owl
-        root = ET.fromstring(datagram)
-        dev = None
-                
-        self.plugin.mylogger.log(3, "NetworkOwl: " + root.tag + " packet received")
+        timer = self.plugin.stageTimer
+        if timer != None:
+            began = time.time()
         
-        packet = None
+        # pull out the fields we use, with a full Element Tree parse only if needed
+        tag, packetAddress, packetType, fields = self.parser.parse(datagram)
+        
+        if timer != None:
+            timer.record('parse', tag, time.time() - began)
+                
+        self.plugin.mylogger.log(3, "NetworkOwl: %s packet received", tag)
         
         # get device associated with the MAC address of packet received
-        packetAddress = root.get('id')
-        self.plugin.mylogger.log(4, "NetworkOwl: packet address: %s" % packetAddress)
+        self.plugin.mylogger.log(4, "NetworkOwl: packet address: %s", packetAddress)
         
         # check if we recognise the MAC address, if not ignore the datagram
-        if packetAddress not in self.plugin.deviceDict:
-            self.mylogger.logError("Received packet from unknown NetworkOwl %s: create NetworkOwl device in Indigo" % packetAddress)
-        else:            
-            # Solar data packet
-            if root.tag == 'solar':
-                packet = SolarPacket(self.plugin, packetAddress, root)
-                if packet.isValid():
-                    packet.associate()
-                       
-            # Electricity data packet 
-            elif root.tag == 'electricity':
-                packet = ElectricityPacket(self.plugin, packetAddress, root)
-                if packet.isValid():
-                    packet.associate()
+        context = self.plugin.contextDict.get(packetAddress)
+        if context == None:
+            self.plugin.mylogger.logError("Received packet from unknown NetworkOwl %s: create NetworkOwl device in Indigo" % packetAddress)
+            return None
+            
+        if packetType == None:
+            if tag in self.knownTags:
+                # unknown XML format for a packet we know - log error
+                self.plugin.mylogger.logError(u"unrecognised %s packet received" % tag.replace('_', ' '))
+            else:
+                # no idea what to do with this type of packet, just log an error
+                self.plugin.mylogger.logError("Unknown '%s' packet received" % tag)
+            return None
+            
+        timestamp = fields.get('timestamp')
+        if timestamp != None:
+            lost = self.gaps.check(packetAddress, tag, timestamp)
+            if lost:
+                self.plugin.mylogger.log(3, "NetworkOwl: %d %s packets from %s lost before this one", lost, tag, packetAddress)
+            
+        if timer == None:
+            return packetType.packetClass(self.plugin, context, packetType, fields)
+            
+        began = time.time()
+        packet = packetType.packetClass(self.plugin, context, packetType, fields)
+        timer.record('construct', tag, time.time() - began)
+        return packet
+        
+
+
+########################################
+########################################
+
+
+class DatagramRing(object):
+    """Preallocated receive buffers reused for every datagram.
+    
+    Each slot is one byte bigger than the largest datagram accepted, so a
+    datagram that fills the whole slot must have been cut short by the kernel
+    & is reported as truncated rather than handed on to be parsed.
+    Views handed out point into the ring, so they are only valid until the
+    ring wraps back round to the same slot.
+    
+    Instance variables:
+        slots       - number of slots in the ring.
+        slotSize    - largest datagram accepted into a slot.
+        buf         - the preallocated bytearray holding every slot.
+        views       - writable memoryview onto each slot, for recvfrom_into.
+        nextSlot    - index of the slot the next datagram is read into.
+    
+    """
+    ########################################
+    def __init__(self, slots, slotSize):
+        """Allocate the ring."""
+        self.slots = slots
+        self.slotSize = slotSize
+        stride = slotSize + 1
+        self.buf = bytearray(slots * stride)
+        whole = memoryview(self.buf)
+        self.views = [whole[i * stride:(i + 1) * stride] for i in range(slots)]
+        self.nextSlot = 0
+        
+    ########################################
+    def recvFrom(self, sock):
+        """Receive one datagram into the next slot.
+        
+        Returns (size, address, view) - view is None if the datagram was truncated.
+        Raises socket.error as recvfrom would, including EAGAIN when no datagram is waiting.
+        
+        """
+        slot = self.nextSlot
+        num_bytes, address = sock.recvfrom_into(self.views[slot])
+        self.nextSlot = (slot + 1) % self.slots
+        
+        if num_bytes > self.slotSize:
+            return (num_bytes, address, None)
+        return (num_bytes, address, _readOnlyView(self.buf, slot * (self.slotSize + 1), num_bytes))
+        
+########################################
+########################################
+
+
+class DuplicateFilter(object):
+    """Remembers the most recent datagrams so exact repeats can be skipped.
+    
+    The Owl gateway resends packets & often sends identical weather & solar
+    packets back to back. A datagram is a repeat if one with the same content
+    came from the same MAC address with the same root tag within ttl seconds
+    of it first being seen - repeats don't extend that, so an Owl resending
+    the same values more often than ttl still has them published every ttl
+    seconds. Entries are kept in least recently seen order, oldest dropped first.
+    
+    Instance variables:
+        slots       - most datagrams remembered.
+        ttl         - seconds a datagram is remembered for, 0 to never report repeats.
+        entries     - (MAC address, tag, digest) / time first seen, least recently seen first.
+        hitCount    - number of repeats spotted.
+        missCount   - number of datagrams not seen recently.
+    
+    """
+    ########################################
+    def __init__(self, slots, ttl=0):
+        self.slots = slots
+        self.entries = collections.OrderedDict()
+        self.hitCount = 0
+        self.missCount = 0
+        self.configure(ttl)
+        
+    ########################################
+    def configure(self, ttl):
+        self.ttl = max(0.0, ttl)
+        if not self.ttl:
+            self.entries.clear()
+        
+    ########################################
+    def seen(self, mac, tag, datagram):
+        """Record the datagram, returning True if it repeats one seen within ttl seconds."""
+        if not self.ttl or tag == None:
+            return False
+            
+        key = (mac, tag, hashlib.sha1(datagram).digest())
+        now = time.time()
+        first = self.entries.pop(key, None)
+        if first != None and now - first < self.ttl:
+            # move it to the recent end, keeping the time it was first seen
+            self.entries[key] = first
+            self.hitCount += 1
+            return True
+            
+        self.entries[key] = now
+        self.missCount += 1
+        while len(self.entries) > self.slots:
+            self.entries.popitem(last=False)
+        return False
+        
+    ########################################
+    def summary(self):
+        """One line description of the counters, for the log."""
+        total = self.hitCount + self.missCount
+        return "%d of %d datagrams skipped as duplicates (%.1f%%)" % (
+            self.hitCount, total, 100.0 * self.hitCount / total if total else 0.0)
+        
+########################################
+########################################
+
+
+class GapDetector(object):
+    """Counts the V2 packets lost on the way from each Owl, from gaps in their timestamps.
+    
+    An Owl sends each kind of packet at a steady interval, learnt here as the
+    shortest gap seen between consecutive timestamps. A gap of n intervals
+    means n - 1 packets were lost - dropped by the network, the gateway or the
+    kernel. Gaps over MAX_GAP seconds are counted as outages instead, & packets
+    that go back in time (an Owl restart or a replay) start the count afresh.
+    
+    Instance variables:
+        last            - (MAC address, tag) / last timestamp.
+        intervals       - (MAC address, tag) / shortest gap seen.
+        missed          - MAC address / number of packets lost.
+        missedCount     - number of packets lost, from every Owl.
+        gapCount        - number of gaps found.
+        outageCount     - number of gaps over MAX_GAP seconds.
+    
+    """
+    MIN_INTERVAL = 1
+    MAX_GAP = 3600
+    
+    ########################################
+    def __init__(self):
+        self.last = {}
+        self.intervals = {}
+        self.missed = {}
+        self.lock = threading.Lock()
+        self.missedCount = 0
+        self.gapCount = 0
+        self.outageCount = 0
+        
+    ########################################
+    def check(self, mac, tag, timestamp):
+        """Record a packet's timestamp, returning the number of packets lost before it."""
+        try:
+            timestamp = int(timestamp)
+        except (TypeError, ValueError):
+            return 0
+            
+        key = (mac, tag)
+        with self.lock:
+            last = self.last.get(key)
+            self.last[key] = timestamp
+            if last == None or timestamp <= last:
+                return 0
                 
-            # weather data packet
-            elif root.tag == 'weather':
-                packet = WeatherPacket(self.plugin, packetAddress, root)
-                if packet.isValid():
-                    packet.associate()
+            gap = timestamp - last
+            if gap > GapDetector.MAX_GAP:
+                self.outageCount += 1
+                return 0
+            interval = self.intervals.get(key)
+            if interval == None or gap < interval:
+                self.intervals[key] = max(gap, GapDetector.MIN_INTERVAL)
+                return 0
                 
-            # heating data packet
-            elif root.tag == 'heating':
-                packet = HeatingPacket(self.plugin, packetAddress, root)
-                if packet.isValid():
-                    packet.associate()
-                                        
-            # hot water data packet
-            elif root.tag == 'hot_water':
-                packet = HotWaterPacket(self.plugin, packetAddress, root)
-                if packet.isValid():
-                    packet.associate()
-                             
-            # if we've received a packet we know how to deal with, 
-            # we've processed it by now  
-            if packet == None:
-                # having created a packet from the multicast stream, 
-                # now associate the packet with the server
-                #dev = self.plugin.deviceDict[packetAddress]
-                #self.associatePacket(packet, dev)
-            #else:
-                # no idea what to do with this type of packet, just log an error
-                self.mylogger.logError("Unknown '%s' packet received" % root.tag)
+            lost = int(round(float(gap) / interval)) - 1
+            if lost > 0:
+                self.gapCount += 1
+                self.missedCount += lost
+                self.missed[mac] = self.missed.get(mac, 0) + lost
+            return lost
+            
+    ########################################
+    def forget(self, mac):
+        """Drop what's known about an Owl that is no longer used."""
+        with self.lock:
+            for key in [key for key in self.last if key[0] == mac]:
+                del self.last[key]
+                self.intervals.pop(key, None)
+            self.missed.pop(mac, None)
+            
+    ########################################
+    def summary(self):
+        """One line description of the counters, for the log."""
+        return "%d V2 packets lost in %d gaps, %d outages of over %d seconds" % (
+            self.missedCount, self.gapCount, self.outageCount, GapDetector.MAX_GAP)
         
+########################################
+########################################
+
+
+class ListenSocket(object):
+    """A socket joined to the multicast group & the counters of what has arrived on it.
+    
+    Instance variables:
+        sock        - the socket.
+        interface   - address of the interface it joined the group on, None for all.
+        packetCount - number of datagrams received.
+        owls        - MAC address / number of datagrams received from that Owl, for
+                      the Owls with devices.
+        drops       - KernelDrops of the socket.
+        bufferSize  - size of its receive buffer in bytes, kept for after it closes.
+    
+    """
     ########################################
-    def stripDecimals(self, inParam):
-        """Remove '.00' from the end of value passed in"""
-        outParam = inParam
-        if inParam.endswith('.00'):
-            outParam = inParam[:-3]
-        return outParam
+    def __init__(self, sock, interface=None):
+        self.sock = sock
+        self.interface = interface
+        self.packetCount = 0
+        self.owls = {}
+        self.drops = KernelDrops(sock)
+        self.bufferSize = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
         
+    ########################################
+    def summary(self):
+        """One line description of the counters, for the log."""
+        owls = ", ".join("%s %d" % (mac, count) for mac, count in sorted(self.owls.items()))
+        return "%s: %d datagrams, from %s" % (self.interface or "all interfaces", self.packetCount, owls or "no Owls")
         
+########################################
+########################################
 
+
+class KernelDrops(object):
+    """Datagrams the kernel has dropped because a socket's receive buffer was full.
+    
+    On Linux, the drops column of the socket's own line in /proc/net/udp.
+    Elsewhere the count is None - OS X only counts them for the whole host,
+    see HostDrops.
+    
+    Instance variables:
+        inode       - inode of the socket, identifying its line in /proc/net/udp.
+        start       - count when the socket was opened, None if it can't be read.
+        last        - count since then when last read, kept once the socket has closed.
+    
+    """
+    PROC_FILES = ('/proc/net/udp', '/proc/net/udp6')
+    
+    ########################################
+    def __init__(self, sock):
+        self.inode = str(os.fstat(sock.fileno()).st_ino)
+        self.start = self.read()
+        self.last = 0 if self.start != None else None
+        
+    ########################################
+    def read(self):
+        """The kernel's count of datagrams dropped, or None if it can't be read."""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            for path in KernelDrops.PROC_FILES:
+                if os.path.exists(path):
+                    with open(path) as procFile:
+                        for line in procFile:
+                            fields = line.split()
+                            if len(fields) > 12 and fields[9] == self.inode:
+                                return int(fields[-1])
+        except (IOError, ValueError):
+            pass
+        return None
+        
+    ########################################
+    def count(self):
+        """Datagrams dropped since the socket was opened, or None if unknown."""
+        if self.start == None:
+            return None
+        now = self.read()
+        if now != None:
+            self.last = now - self.start
+        return self.last
+        
+########################################
+########################################
+
+
+class HostDrops(object):
+    """UDP datagrams the kernel has dropped due to full socket buffers, for the
+    whole host - all OS X counts.
+    
+    The count comes from running netstat, far too slow for the receive thread,
+    so refresh() runs it on a thread of its own & count() returns the count
+    from the last run that finished.
+    
+    Instance variables:
+        start       - count from the first run, None until that has finished.
+        last        - count from the latest run.
+        thread      - thread running netstat, or None.
+    
+    """
+    SUPPORTED = sys.platform == 'darwin'
+    NETSTAT = ['netstat', '-s', '-p', 'udp']
+    NETSTAT_DROPS = re.compile(r"(\d+) dropped due to full socket buffers")
+    
+    ########################################
+    def __init__(self):
+        self.start = None
+        self.last = None
+        self.thread = None
+        self.refresh()
+        
+    ########################################
+    def refresh(self):
+        """Start netstat reading the count, unless it's still running from the last refresh."""
+        if self.thread != None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.read, name="NetworkOwl-netstat")
+        self.thread.daemon = True
+        self.thread.start()
+        
+    ########################################
+    def read(self):
+        try:
+            match = HostDrops.NETSTAT_DROPS.search(subprocess.check_output(HostDrops.NETSTAT))
+        except (OSError, subprocess.CalledProcessError):
+            return
+        if match != None:
+            count = int(match.group(1))
+            if self.start == None:
+                self.start = count
+            self.last = count
+        
+    ########################################
+    def count(self):
+        """Datagrams dropped since the plugin started, or None if unknown."""
+        if self.start == None:
+            return None
+        return self.last - self.start
+        
+########################################
+########################################
+
+
+class AckSender(object):
+    """Acknowledges datagrams without holding up receiving or parsing.
+    
+    Acks are sent from the listening socket, which is non-blocking: a send
+    that would block or fails is counted & logged rather than retried.
+    The ack mode sets when they are sent:
+        packet      - one ack as each datagram is received.
+        coalesced   - one ack per sender for all the datagrams it sends within
+                      window seconds, sent from a timer when the window closes.
+        off         - no acks.
+    
+    Instance variables:
+        logger          - plugin logger.
+        timers          - TimerQueue running the coalesced ack flushes.
+        mode            - one of MODES.
+        window          - seconds acks are coalesced over.
+        pending         - sender address / socket still to be acked in coalesced mode.
+        sentCount       - number of acks sent.
+        coalescedCount  - number of acks saved by coalescing.
+        failedCount     - number of acks that couldn't be sent.
+    
+    """
+    MODES = ('packet', 'coalesced', 'off')
+    
+    ########################################
+    def __init__(self, logger, timers, mode='packet', window=0.5):
+        self.logger = logger
+        self.timers = timers
+        self.pending = {}
+        self.flushTimer = None
+        self.sentCount = 0
+        self.coalescedCount = 0
+        self.failedCount = 0
+        self.configure(mode, window)
+        
+    ########################################
+    def configure(self, mode, window):
+        """Change the mode & window - acks already waiting go with the next flush."""
+        if mode not in AckSender.MODES:
+            mode = 'packet'
+        self.mode = mode
+        self.window = max(0.0, window)
+        
+    ########################################
+    def ack(self, sock, address):
+        """Acknowledge a datagram from address received on sock."""
+        if self.mode == 'off':
+            return
+        if self.mode == 'packet':
+            self.send(sock, address)
+            return
+            
+        if address in self.pending:
+            self.coalescedCount += 1
+        self.pending[address] = sock
+        if self.flushTimer == None:
+            self.flushTimer = self.timers.callLater(self.window, self.flush)
+        
+    ########################################
+    def flush(self):
+        """Send one ack to each sender waiting for one."""
+        self.flushTimer = None
+        pending, self.pending = self.pending, {}
+        for address, sock in pending.iteritems():
+            self.send(sock, address)
+        
+    ########################################
+    def send(self, sock, address):
+        self.logger.log(4, 'sending acknowledgement to %r', address)
+
+        # Rather than replying to the group multicast address, we send the
+        # reply directly (unicast) to the originating port:
+        try:
+            sock.sendto('ack', address)
+        except socket.error, e:
+            self.failedCount += 1
+            self.logger.log(3, "NetworkOwl: failed to acknowledge %s: %s", address[0], e)
+            return False
+        self.sentCount += 1
+        return True
+        
+    ########################################
+    def summary(self):
+        """One line description of the counters, for the log."""
+        return "%d acks sent, %d coalesced, %d failed" % (self.sentCount, self.coalescedCount, self.failedCount)
+
+########################################
+########################################
+
+
+class DeviceContext(object):
+    """Everything the packets from one NetworkOwl need, built once in deviceStartComm.
+    
+    Instance variables:
+        mac_address     - MAC address of the Owl.
+        device          - the Indigo device for the Owl.
+        owlType         - kind of Owl device, from the device's props.
+        publisher       - StatePublisher sending the device's changed states to the server.
+        stateMaps       - PacketType / (state id, value getter) tuples to publish for this owlType.
+        history         - DeviceHistory keeping rolling statistics of the readings, or None.
+        packetCount     - number of packets associated with the device.
+    
+    """
+    __slots__ = ('mac_address', 'device', 'owlType', 'publisher', 'stateMaps', 'history', 'packetCount')
+    
+    ########################################
+    def __init__(self, mac_address, device, owlType, publisher, history=None):
+        self.mac_address = mac_address
+        self.device = device
+        self.owlType = owlType
+        self.publisher = publisher
+        self.stateMaps = dict((packetType, packetType.stateMap(owlType)) for packetType in PACKET_TYPES.itervalues())
+        self.history = history
+        self.packetCount = 0
+        
+    ########################################
+    @staticmethod
+    def stateIds(owlType):
+        """Ids of every state the registered packet types publish for this kind of Owl."""
+        return set(stateId for packetType in PACKET_TYPES.itervalues() for stateId, getter in packetType.stateMap(owlType))
+        
+        
+########################################
+########################################
+
+
+class ReadingClock(object):
+    """Formats reading times, formatting each second only once however many
+    packets arrive within it."""
+    ########################################
+    def __init__(self, format):
+        self.format = format
+        self.last = (None, None)
+        
+    ########################################
+    def now(self):
+        second = int(time.time())
+        # swap the (second, text) pair as a whole: safe to share between threads
+        last = self.last
+        if last[0] != second:
+            last = (second, time.strftime(self.format, time.localtime(second)))
+            self.last = last
+        return last[1]
+        
+_readingClock = ReadingClock('%Y/%m/%d %H:%M:%S')
+
+        
 ########################################
 ########################################
 
@@ -196,51 +987,150 @@ class NetworkOwl():
 class NetworkOwlPacket(object):
     """Base class for all NetworkOwl data packets.
     
+    Packets hold their fields in __slots__: each subclass lists the instance
+    variables its extract() sets.
+    
     Instance variables:
         reading_time    - time packet was read
         mac_address     - MAC address of packet
         packet_type     - type of packet as a single word
         plugin          - reference to the containing plugin context
-        device          - reference to the device once associated
-        owlType         - kind of Owl device that sent the packet
+        context         - DeviceContext of the Owl that sent the packet, giving
+                          its device, publisher & owlType
+        states          - (state id, value getter) tuples to publish for this owlType
+        metrics         - (field, value) readings exported as one record by associate
         valid           - is the packet a valid one?
             
+    Class variables:
+        STATE_MAP       - states the packet updates, keyed by owlType (None for the
+                          states updated whatever the kind of Owl). Each is a tuple of
+                          Indigo state id & instance variable, plus a list index for
+                          instance variables holding a value per channel. Compiled
+                          once, by registerPacketType.
+        READINGS        - numeric readings recorded by the history sinks, whatever
+                          the kind of Owl, as metric name & instance variable (plus
+                          list index) tuples. Compiled by registerPacketType.
+            
     """
+    __slots__ = ('reading_time', 'mac_address', 'xml_version', 'plugin', 'context', 'states', 'readingMap',
+                 'metrics', 'valid')
+    STATE_MAP = {}
+    READINGS = ()
+    SIGNAL_READINGS = (("rssi", "signal_strength"), ("lqi", "signal_quality"), ("battery", "battery_level"))
+    
     ########################################
-    def __init__(self, plugin, addr):
-        """Record time & MAC address."""
-        self.reading_time = time.strftime('%Y/%m/%d %H:%M:%S')
-        self.mac_address = addr
-        self.packet_type = ""
-        self.xml_version = None
+    def __init__(self, plugin, context, packetType, fields):
+        """Record time & MAC address, then the fields extracted by OwlParser."""
+        self.reading_time = _readingClock.now()
+        self.mac_address = context.mac_address
+        self.xml_version = packetType.ver
         self.plugin = plugin
-        self.device = plugin.deviceDict[addr]
-        self.owlType = str(self.device.states["networkOwlType"])
-        self.valid = False
+        self.context = context
+        self.states = context.stateMaps.get(packetType) or packetType.stateMap(context.owlType)
+        self.readingMap = packetType.readings
+        self.valid = True
+        self.extract(fields)
 
-        
     ########################################
-    def stripDecimals(self, inParam):
-        """Remove '.00' from the end of value passed in"""
-        outParam = inParam
-        if inParam.endswith('.00'):
-            outParam = inParam[:-3]
-        return outParam
+    @property
+    def device(self):
+        return self.context.device
+        
+    @property
+    def publisher(self):
+        return self.context.publisher
+        
+    @property
+    def owlType(self):
+        return self.context.owlType
 
+    ########################################
+    def extract(self, fields):
+        """Set the instance variables from the fields extracted by OwlParser."""
+        pass
+        
+    ########################################
+    def readings(self):
+        """(metric, value) pairs of the numeric readings in the packet, for the history sinks."""
+        result = []
+        for metric, getter in self.readingMap:
+            value = getter(self)
+            if value != None:
+                result.append((metric, value))
+        return result
+        
     ########################################        
     def isValid(self):
         return self.valid
         
     ########################################        
     def associate(self):
-        """Associate the packet with Indigo"""
-        self.device.updateStateOnServer("lastUpdated", self.reading_time)
+        """Associate the packet with Indigo, sending the states mapped for this owlType
+        that have changed since the last packet in a single server call"""
+        now = time.time()
+        self.context.packetCount += 1
+        
+        states = [("lastUpdated", self.reading_time)]
+        for stateId, getter in self.states:
+            value = getter(self)
+            # readings missing from the packet leave the state as it was
+            if value != None:
+                states.append((stateId, value))
+        
+        history = self.context.history
+        if history != None:
+            states.extend(history.add(states, now))
+        
+        self.publisher.publish(states)
+        
+        timer = self.plugin.stageTimer
+        if timer != None:
+            published = time.time()
+        
+        archive = self.plugin.archive
+        if archive != None:
+            archive.append(self, now)
+        database = self.plugin.database
+        rollups = self.plugin.rollups
+        if database != None or rollups != None:
+            readings = self.readings()
+            if database != None:
+                database.append(self.mac_address, now, readings)
+            if rollups != None:
+                rollups.add(self.mac_address, now, readings)
+        
+        if timer != None:
+            stored = time.time()
+        
+        self.metrics = []
+        self.logReadings()
+        self.exportMetrics()
+        
+        if timer != None:
+            timer.recordAssociate(self.packet_type, now, published, stored, time.time())
+        
+    ########################################
+    def logReadings(self):
+        """Log the readings just published & splunk the ones worth exporting."""
+        pass
         
     ########################################
     
     def splunk(self, field, value):
-        """Log packet data in a Splunk-friendly format"""
-        self.plugin.mylogger.log(2, "NetworkOwl: %s=%s" % (field, value))
+        """Add a reading to the packet's metrics record"""
+        self.metrics.append((field, value))
+        
+    ########################################
+    def exportMetrics(self):
+        """Send the packet's metrics as one record to the metrics file if there is
+        one, otherwise log them in a Splunk-friendly format"""
+        if not self.metrics:
+            return
+        sink = self.plugin.metricsSink
+        if sink != None:
+            sink.record(self.mac_address, self.packet_type, self.metrics)
+        elif self.plugin.mylogger.isEnabledFor(2):
+            self.plugin.mylogger.log(2, "NetworkOwl: %s", formatKeyValues(self.metrics))
 
 
 
@@ -269,56 +1159,40 @@ class SolarPacket(NetworkOwlPacket):
         
     
     """
+    __slots__ = ('gen_watts', 'exp_watts', 'gen_watts_today', 'exp_watts_today')
+    packet_type = "solar"
+    READINGS = (("solar_gen_watts", "gen_watts"),
+                ("solar_exp_watts", "exp_watts"),
+                ("solar_gen_wh", "gen_watts_today"),
+                ("solar_exp_wh", "exp_watts_today"))
+    STATE_MAP = {
+        None: (("genWattsNow", "gen_watts"),
+               ("expWattsNow", "exp_watts"),
+               ("genWattsToday", "gen_watts_today"),
+               ("expWattsToday", "exp_watts_today")),
+    }
+    
     ########################################
-    def __init__(self, plugin, addr, root):
-        """Initialise solar instance variables."""
-        NetworkOwlPacket.__init__(self, plugin, addr)
-        self.packet_type = "solar"
-        self.gen_watts = 0
-        self.exp_watts = 0
-        self.gen_watts_today = 0
-        self.exp_watts_today = 0
-        
-        # work out which version of XML we're dealing with & behave accordingly
-        self.xml_version = root.get('ver')
-         
-        if self.xml_version == None:
-            # original version of the packet with no version number
-            # extract & process current readings
-            self.valid = True
-            currSolar = root.find('current')
-            gen_watts = currSolar.find('generating').text
-            exp_watts = currSolar.find('exporting').text
-         
-            # remove the decimal points
-            self.gen_watts = self.stripDecimals(gen_watts)
-            self.exp_watts = self.stripDecimals(exp_watts)
-            
-            # extract & process whole day readings
-            daySolar = root.find('day')
-            self.gen_watts_today = daySolar.find('generated').text
-            self.exp_watts_today = daySolar.find('exported').text
-            
-        else:
-            # unknown XML format - log error
-            self.plugin.mylogger.logError(u"unrecognised solar packet received")
+    def extract(self, fields):
+        """Initialise solar instance variables from the fields extracted by OwlParser."""
+        # current readings in whole watts
+        self.gen_watts = decodeWatts(fields['gen_watts'])
+        self.exp_watts = decodeWatts(fields['exp_watts'])
+        
+        # whole day readings in Wh
+        self.gen_watts_today = decodeFloat(fields['gen_watts_today'])
+        self.exp_watts_today = decodeFloat(fields['exp_watts_today'])
 
 
     ########################################
-    def associate(self):
-        """Update Indigo with solar packet data"""
-        NetworkOwlPacket.associate(self)
+    def logReadings(self):
+        """Log solar packet data"""
         
-        self.device.updateStateOnServer("genWattsNow", self.gen_watts)
-        self.device.updateStateOnServer("expWattsNow", self.exp_watts)
-        self.device.updateStateOnServer("genWattsToday", self.gen_watts_today)
-        self.device.updateStateOnServer("expWattsToday", self.exp_watts_today)
+        self.plugin.mylogger.log(3, "NetworkOwl: generating watts: %s", self.gen_watts)
+        self.plugin.mylogger.log(3, "NetworkOwl: exporting watts: %s", self.exp_watts)
         
-        self.plugin.mylogger.log(3, "NetworkOwl: generating watts: " + self.gen_watts)
-        self.plugin.mylogger.log(3, "NetworkOwl: exporting watts: " + self.exp_watts)
-        
-        NetworkOwlPacket.splunk(self, "solar_gen_watts", self.gen_watts)
-        NetworkOwlPacket.splunk(self, "solar_exp_watts", self.exp_watts)
+        self.splunk("solar_gen_watts", self.gen_watts)
+        self.splunk("solar_exp_watts", self.exp_watts)
             
           
 ########################################
@@ -328,8 +1202,8 @@ class ElectricityPacket(NetworkOwlPacket):
     """NetworkOwl electricity packet - upto 6 channels.
     
     Instance variables:
-        curr_watts[]        - list of current readings for each channel.
-        watts_today[]       - list of daily totals for each channel.
+        curr_watts[]        - array of current readings in watts for each channel.
+        watts_today[]       - array of daily totals in Wh for each channel.
         
         
     XML V1
@@ -405,106 +1279,84 @@ class ElectricityPacket(NetworkOwlPacket):
     
         
     """
+    __slots__ = ('signal_strength', 'signal_quality', 'battery_level', 'curr_watts', 'watts_today')
+    packet_type = "electricity"
+    READINGS = NetworkOwlPacket.SIGNAL_READINGS + (("elec_watts_ch0", "curr_watts", 0),
+                                                   ("elec_wh_ch0", "watts_today", 0),
+                                                   ("elec_watts_ch1", "curr_watts", 1),
+                                                   ("elec_wh_ch1", "watts_today", 1),
+                                                   ("elec_watts_ch2", "curr_watts", 2),
+                                                   ("elec_wh_ch2", "watts_today", 2),
+                                                   ("elec_watts_ch3", "curr_watts", 3),
+                                                   ("elec_wh_ch3", "watts_today", 3),
+                                                   ("elec_watts_ch4", "curr_watts", 4),
+                                                   ("elec_wh_ch4", "watts_today", 4),
+                                                   ("elec_watts_ch5", "curr_watts", 5),
+                                                   ("elec_wh_ch5", "watts_today", 5))
+    CHANNELS = 6
+    NO_WATTS = [0] * CHANNELS
+    NO_WATTS_TODAY = [0.0] * CHANNELS
+    
+    STATE_MAP = {
+        None: (("signalStrength", "signal_strength"),
+               ("signalQuality", "signal_quality"),
+               ("batteryLevel", "battery_level")),
+        # single phase usage figures in channel 0
+        'pv': (("usedWattsNow", "curr_watts", 0),
+               ("usedWattsToday", "watts_today", 0)),
+        # 3 phase usage in channels 0-2: ignores channels 3 - 5
+        'lc': (("usedWattsNowPh1", "curr_watts", 0),
+               ("usedWattsTodayPh1", "watts_today", 0),
+               ("usedWattsNowPh2", "curr_watts", 1),
+               ("usedWattsTodayPh2", "watts_today", 1),
+               ("usedWattsNowPh3", "curr_watts", 2),
+               ("usedWattsTodayPh3", "watts_today", 2)),
+    }
+    
     ########################################
-    def __init__(self, plugin, addr, root):
-        """Initialise electricity instance variables."""
-        NetworkOwlPacket.__init__(self, plugin, addr)
-        self.packet_type = "electricity"
-        self.curr_watts = [0, 0, 0, 0, 0, 0]
-        self.watts_today = [0, 0, 0, 0, 0, 0]
-        
-        # work out which version of XML we're dealing with & behave accordingly
-        self.xml_version = root.get('ver')
-         
-        if self.xml_version == None:
-            # original version of the packet with no version number
-            self.plugin.mylogger.log(4, "NetworkOwl: Original XML version")  
-            self.valid = True
-            
-            # get the signal characteristics & battery level      
-            sig = root.find('signal')
-            self.signal_strength = sig.get('rssi')
-            self.signal_quality = sig.get('lqi')
-            self.battery_level = root.find('battery').get('level')
-                      
-            # step through each of the channels - repeats the data for each of the
-            # channels supported by the transmitter
-            for elem in root.getiterator('chan'):
-                channel = int(elem.get('id'))
-                curr_watts = elem.find('curr').text
-                watts_day = elem.find('day').text
-            
-                # remove the decimal points
-                curr_watts = self.stripDecimals(curr_watts)
-            
-                self.curr_watts[channel] = curr_watts
-                self.watts_today[channel] = watts_day
-            
-        elif self.xml_version == '2.0':
-            # Version 2 of packet
-            self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s" % self.xml_version)
-            self.valid = True
-            
-            # get the signal characteristics & battery level      
-            sig = root.find('signal')
-            self.signal_strength = sig.get('rssi')
-            self.signal_quality = sig.get('lqi')
-            self.battery_level = root.find('battery').get('level')
+    def extract(self, fields):
+        """Initialise electricity instance variables from the fields extracted by OwlParser."""
+        self.curr_watts = array.array('l', ElectricityPacket.NO_WATTS)
+        self.watts_today = array.array('d', ElectricityPacket.NO_WATTS_TODAY)
+        self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s", self.xml_version)
+        
+        # get the signal characteristics & battery level      
+        self.signal_strength = decodeInt(fields['signal_strength'])
+        self.signal_quality = decodeInt(fields['signal_quality'])
+        self.battery_level = decodeInt(fields['battery_level'])
                   
-            # step through each of the channels - repeats the data for each of the
-            # channels supported by the transmitter
-            for elem in root.getiterator('chan'):
-                channel = int(elem.get('id'))
-                curr_watts = elem.find('curr').text
-                watts_day = elem.find('day').text
-        
-                # remove the decimal points
-                curr_watts = self.stripDecimals(curr_watts)
-        
-                self.curr_watts[channel] = curr_watts
-                self.watts_today[channel] = watts_day
-            
-        else:
-            # unknown XML format - log error
-            self.plugin.mylogger.logError(u"unrecognised electricity packet received")
+        # step through each of the channels - repeats the data for each of the
+        # channels supported by the transmitter
+        for chan_id, curr_watts, watts_day in fields['chans']:
+            channel = decodeInt(chan_id)
+            if channel == None or not 0 <= channel < ElectricityPacket.CHANNELS:
+                continue
+        
+            # whole watts now, Wh today - a channel with a bad reading stays at 0
+            self.curr_watts[channel] = decodeWatts(curr_watts) or 0
+            self.watts_today[channel] = decodeFloat(watts_day) or 0.0
 
                 
     ########################################
     
-    def associate(self):
-        """Update Indigo with electricity packet data"""
-        NetworkOwlPacket.associate(self)
-        self.device.updateStateOnServer("signalStrength", self.signal_strength)
-        self.device.updateStateOnServer("signalQuality", self.signal_quality)
-        self.device.updateStateOnServer("batteryLevel", self.battery_level)
+    def logReadings(self):
+        """Log electricity packet data"""
         
-        self.plugin.mylogger.log(4, "ElectricityPacket:associate: Owl Type = %s" % self.owlType)
+        self.plugin.mylogger.log(4, "ElectricityPacket:logReadings: Owl Type = %s", self.owlType)
 
         if self.owlType == 'pv':
-            # single phase usage figures in channel 0
-            self.device.updateStateOnServer("usedWattsNow", self.curr_watts[0])
-            self.device.updateStateOnServer("usedWattsToday", self.watts_today[0])
-            
-            self.plugin.mylogger.log(3, "NetworkOwl: using watts: " + self.curr_watts[0])
-            
-            NetworkOwlPacket.splunk(self, "elec_using_watts", self.curr_watts[0])
-
-        elif owlType == 'lc':
-            # 3 phase usage in channels 0-2: ignores channels 3 - 5
-            self.device.updateStateOnServer("usedWattsNowPh1", self.curr_watts[0])
-            self.device.updateStateOnServer("usedWattsTodayPh1", self.watts_today[0])
-            self.device.updateStateOnServer("usedWattsNowPh2", self.curr_watts[1])
-            self.device.updateStateOnServer("usedWattsTodayPh2", self.watts_today[1])
-            self.device.updateStateOnServer("usedWattsNowPh3", self.curr_watts[2])
-            self.device.updateStateOnServer("usedWattsTodayPh3", self.watts_today[2])
+            self.plugin.mylogger.log(3, "NetworkOwl: using watts: %s", self.curr_watts[0])
             
-            self.plugin.mylogger.log(3, "NetworkOwl: Ph1 using watts: " + self.curr_watts[0])
-            self.plugin.mylogger.log(3, "NetworkOwl: Ph2 using watts: " + self.curr_watts[1])
-            self.plugin.mylogger.log(3, "NetworkOwl: Ph3 using watts: " + self.curr_watts[2])
+            self.splunk("elec_using_watts", self.curr_watts[0])
+
+        elif self.owlType == 'lc':
+            self.plugin.mylogger.log(3, "NetworkOwl: Ph1 using watts: %s", self.curr_watts[0])
+            self.plugin.mylogger.log(3, "NetworkOwl: Ph2 using watts: %s", self.curr_watts[1])
+            self.plugin.mylogger.log(3, "NetworkOwl: Ph3 using watts: %s", self.curr_watts[2])
             
-            NetworkOwlPacket.splunk(self, "elec_using_watts_ph1", self.curr_watts[0])
-            NetworkOwlPacket.splunk(self, "elec_using_watts_ph2", self.curr_watts[1])
-            NetworkOwlPacket.splunk(self, "elec_using_watts_ph3", self.curr_watts[2])
+            self.splunk("elec_using_watts_ph1", self.curr_watts[0])
+            self.splunk("elec_using_watts_ph2", self.curr_watts[1])
+            self.splunk("elec_using_watts_ph3", self.curr_watts[2])
 
 
 ########################################
@@ -527,43 +1379,32 @@ class WeatherPacket(NetworkOwlPacket):
     </weather>
 
     """
+    __slots__ = ('weather_code', 'temperature', 'weather_text')
+    packet_type = "weather"
+    READINGS = (("weather_temp", "temperature"),
+                ("weather_code", "weather_code"))
+    STATE_MAP = {
+        None: (("weatherCode", "weather_code"),
+               ("temperature", "temperature"),
+               ("weatherText", "weather_text")),
+    }
+    
     ########################################
-    def __init__(self, plugin, addr, root):
-        """Initialise weather instance variables."""
-        NetworkOwlPacket.__init__(self, plugin, addr)
-        self.packet_type = "weather"
-        self.weather_code = 0
-        self.weather_text = ""
-        self.temperature = 0
-        
-        # work out which version of XML we're dealing with & behave accordingly
-        self.xml_version = root.get('ver')
-         
-        if self.xml_version == None:
-            # original version of the packet with no version number
-            self.valid = True
-  
-            self.weather_code = root.get('code')
-            self.temperature = root.find('temperature').text
-            self.weather_text = root.find('text').text
-            
-        else:
-            # unknown XML format - log error
-            self.plugin.mylogger.logError(u"unrecognised weather packet received")
+    def extract(self, fields):
+        """Initialise weather instance variables from the fields extracted by OwlParser."""
+        self.weather_code = decodeInt(fields['weather_code'])
+        self.temperature = decodeFloat(fields['temperature'])
+        self.weather_text = fields['weather_text']
 
             
     ########################################
-    def associate(self):
-        """Update Indigo with weather packet data"""
-        NetworkOwlPacket.associate(self)
-        self.device.updateStateOnServer("weatherCode", self.weather_code)
-        self.device.updateStateOnServer("temperature", self.temperature)
-        self.device.updateStateOnServer("weatherText", self.weather_text)
+    def logReadings(self):
+        """Log weather packet data"""
             
-        self.plugin.mylogger.log(3, "NetworkOwl: weather: " + self.weather_text)  
+        self.plugin.mylogger.log(3, "NetworkOwl: weather: %s", self.weather_text)  
         
-        NetworkOwlPacket.splunk(self, "weather_temp", self.temperature)
-        NetworkOwlPacket.splunk(self, "weather_code", self.weather_code)       
+        self.splunk("weather_temp", self.temperature)
+        self.splunk("weather_code", self.weather_code)       
             
 
 ########################################
@@ -615,77 +1456,45 @@ class HeatingPacket(NetworkOwlPacket):
    
 
     """
+    __slots__ = ('signal_strength', 'signal_quality', 'battery_level', 'temperature', 'temp_set_point')
+    packet_type = "heating"
+    READINGS = NetworkOwlPacket.SIGNAL_READINGS + (("heat_temp", "temperature"),
+                                                   ("heat_set_point", "temp_set_point"))
+    STATE_MAP = {
+        None: (("heatingTemp", "temperature"),
+               ("heatingTempSetPoint", "temp_set_point")),
+    }
+    
     ########################################
-    def __init__(self, plugin, addr, root):
-        """Initialise heating instance variables."""
-        NetworkOwlPacket.__init__(self, plugin, addr)
-        self.packet_type = "heating"
-        self.zone = '0'
-        self.temperature = 0
-        self.temp_set_point = 0
-        self.valid_until = 0
-        
-        # work out which version of XML we're dealing with & behave accordingly
-        self.xml_version = root.get('ver')
-         
-        if self.xml_version == None:
-            # original version of the packet with no version number
-            self.plugin.mylogger.log(4, "NetworkOwl: Original XML version")  
-            self.valid = True
-           
-            # get the signal characteristics & battery level      
-            sig = root.find('signal')
-            self.signal_strength = sig.get('rssi')
-            self.signal_quality = sig.get('lqi')
-            self.battery_level = root.find('battery').get('level')
-        
-            # ignoring zone & valid_until for now
-
-            # get the current & required temperatures
-            currTemp = root.find('temperature')
-            self.temperature = currTemp.find('current').text
-            self.temp_set_point = currTemp.find('required').text
-
-        elif self.xml_version == '2':
-            # Version 2 of packet
-            self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s" % self.xml_version)
-            self.valid = True
-        
-            # Firmware 2.6 introduces support for multiple zones
-            # this version only handles a single zone
-        
-            # step through each of the zones
-            for elem in root.getiterator('zone'):
-                zone = elem.get('id')
-                # get the signal characteristics & battery level      
-                sig = elem.find('signal')
-                self.signal_strength = sig.get('rssi')
-                self.signal_quality = sig.get('lqi')
-                self.battery_level = elem.find('battery').get('level')
-            
-                # get the current & required temperatures                
-                currTemp = elem.find('temperature')
-                self.temperature = currTemp.find('current').text
-                self.temp_set_point = currTemp.find('required').text
-            
-        else:
-            # unknown XML format - log error
-            self.plugin.mylogger.logError(u"unrecognised heating packet received")
-          
+    def extract(self, fields):
+        """Initialise heating instance variables from the fields extracted by OwlParser.
+        
+        Firmware 2.6 introduces support for multiple zones: the parser only hands
+        us a single zone, ignoring zone & valid_until for now.
+        
+        """
+        self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s", self.xml_version)
+       
+        # get the signal characteristics & battery level      
+        self.signal_strength = decodeInt(fields['signal_strength'])
+        self.signal_quality = decodeInt(fields['signal_quality'])
+        self.battery_level = decodeInt(fields['battery_level'])
+
+        # get the current & required temperatures
+        self.temperature = decodeFloat(fields['temperature'])
+        self.temp_set_point = decodeFloat(fields['temp_set_point'])
+      
 
     ########################################
-    def associate(self):
+    def logReadings(self):
         """
-        Update Indigo with heating packet data
+        Log heating packet data
         Ignore zones in this version
         """
-        NetworkOwlPacket.associate(self)
-        self.device.updateStateOnServer("heatingTemp", self.temperature)
-        self.device.updateStateOnServer("heatingTempSetPoint", self.temp_set_point)
         
-        self.plugin.mylogger.log(3, "NetworkOwl: heating at %s, desired %s" % (self.temperature, self.temp_set_point))
+        self.plugin.mylogger.log(3, "NetworkOwl: heating at %s, desired %s", self.temperature, self.temp_set_point)
         
-        NetworkOwlPacket.splunk(self, "heat_temp", self.temperature)
+        self.splunk("heat_temp", self.temperature)
 
       
 ########################################
@@ -732,73 +1541,63 @@ class HotWaterPacket(NetworkOwlPacket):
 
 
     """
+    __slots__ = ('signal_strength', 'signal_quality', 'battery_level', 'temperature', 'temp_set_point')
+    packet_type = "hot_water"
+    READINGS = NetworkOwlPacket.SIGNAL_READINGS + (("water_temp", "temperature"),
+                                                   ("water_set_point", "temp_set_point"))
+    STATE_MAP = {
+        None: (("hotWaterTemp", "temperature"),
+               ("hotWaterTempSetPoint", "temp_set_point")),
+    }
+    
     ########################################
-    def __init__(self, plugin, addr, root):
-        """Initialise hot water instance variables."""
-        NetworkOwlPacket.__init__(self, plugin, addr)
-        self.packet_type = "hot_water"
-        self.temperature = 0
-        self.temp_set_point = 0
-        self.valid_until = 0
-        
-        # work out which version of XML we're dealing with & behave accordingly
-        self.xml_version = root.get('ver')
-         
-        if self.xml_version == None:
-            # original version of the packet with no version number
-            self.plugin.mylogger.log(4, "NetworkOwl: Original XML version")  
-            self.valid = True
-            
-            # get the signal characteristics & battery level      
-            sig = root.find('signal')
-            self.signal_strength = sig.get('rssi')
-            self.signal_quality = sig.get('lqi')
-            self.battery_level = root.find('battery').get('level')
-        
-            #ignoring valid_until for now
-
-            # get the current & required temperatures                
-            currTemp = root.find('temperature')
-            self.temperature = currTemp.find('current').text
-            self.temp_set_point = currTemp.find('required').text
-
-        elif self.xml_version == '2':
-            # Version 2 of packet
-            self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s" % self.xml_version)
-            self.valid = True
-                
-            # Firmware 2.6 introduces support for multiple zones
-            # this version only handles a single zone
-        
-            # step through each of the zones
-            for elem in root.getiterator('zone'):
-                zone = elem.get('id')
-                # get the signal characteristics & battery level      
-                sig = elem.find('signal')
-                self.signal_strength = sig.get('rssi')
-                self.signal_quality = sig.get('lqi')
-                self.battery_level = elem.find('battery').get('level')
-            
-                # get the current & required temperatures                
-                currTemp = elem.find('temperature')
-                self.temperature = currTemp.find('current').text
-                self.temp_set_point = currTemp.find('required').text
-            
-        else:
-            # unknown XML format - log error
-            self.plugin.mylogger.logError(u"unrecognised hot water packet received")
+    def extract(self, fields):
+        """Initialise hot water instance variables from the fields extracted by OwlParser.
+        
+        Firmware 2.6 introduces support for multiple zones: the parser only hands
+        us a single zone, ignoring zone & valid_until for now.
+        
+        """
+        self.plugin.mylogger.log(4, "NetworkOwl: XML version: %s", self.xml_version)
+       
+        # get the signal characteristics & battery level      
+        self.signal_strength = decodeInt(fields['signal_strength'])
+        self.signal_quality = decodeInt(fields['signal_quality'])
+        self.battery_level = decodeInt(fields['battery_level'])
 
+        # get the current & required temperatures
+        self.temperature = decodeFloat(fields['temperature'])
+        self.temp_set_point = decodeFloat(fields['temp_set_point'])
+      
 
     ########################################
-    def associate(self):
+    def logReadings(self):
         """
-        Update Indigo with hot water packet data
+        Log hot water packet data
         Ignore zones in this version
         """
-        NetworkOwlPacket.associate(self)
-        self.device.updateStateOnServer("hotWaterTemp", self.temperature)
-        self.device.updateStateOnServer("hotWaterTempSetPoint", self.temp_set_point)
         
-        self.plugin.mylogger.log(3, "NetworkOwl: hot water at %s, desired %s" % (self.temperature, self.temp_set_point))
+        self.plugin.mylogger.log(3, "NetworkOwl: hot water at %s, desired %s", self.temperature, self.temp_set_point)
         
-        NetworkOwlPacket.splunk(self, "water_temp", self.temperature)
+        self.splunk("water_temp", self.temperature)
+
+
+########################################
+########################################
+# (tag, ver) -> PacketType registry used by OwlParser & parseDataPacket
+# support a new firmware version by registering its packet shape here
+
+PACKET_TYPES = {}
+
+def registerPacketType(tag, ver, packetClass, extractTree, pattern=None):
+    """Register how to read & publish the packet with root element tag & version ver."""
+    PACKET_TYPES[(tag, ver)] = PacketType(tag, ver, packetClass, extractTree, pattern)
+
+registerPacketType('solar', None, SolarPacket, packetShapes.treeSolar, packetShapes.SOLAR)
+registerPacketType('electricity', None, ElectricityPacket, packetShapes.treeElectricity, packetShapes.ELECTRICITY_V1)
+registerPacketType('electricity', '2.0', ElectricityPacket, packetShapes.treeElectricity, packetShapes.ELECTRICITY_V2)
+registerPacketType('weather', None, WeatherPacket, packetShapes.treeWeather, packetShapes.WEATHER)
+registerPacketType('heating', None, HeatingPacket, packetShapes.treeZoneV1, packetShapes.HEATING_V1)
+registerPacketType('heating', '2', HeatingPacket, packetShapes.treeZoneV2, packetShapes.HEATING_V2)
+registerPacketType('hot_water', None, HotWaterPacket, packetShapes.treeZoneV1, packetShapes.HOT_WATER_V1)
+registerPacketType('hot_water', '2', HotWaterPacket, packetShapes.treeZoneV2, packetShapes.HOT_WATER_V2)
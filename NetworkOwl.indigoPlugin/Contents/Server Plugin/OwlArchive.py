@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Binary history of every NetworkOwl reading
+# One append-only file per Owl of fixed size, struct packed records - one per
+# packet - buffered in memory & written on a timer. Readers map the file &
+# find time ranges by binary search over the records, which are in time order.
+# https://smudger4.github.io
+#
+
+import os
+import mmap
+import math
+import struct
+import threading
+import collections
+
+
+########################################
+# record layout: every field the packet classes extract, unused ones MISSING
+# (electricity channels are 6 values each)
+
+FIELDS = (('time', 'd'), ('packetType', 'B'),
+          ('signal_strength', 'h'), ('signal_quality', 'h'), ('battery_level', 'i'),
+          ('curr_watts', '6i'), ('watts_today', '6d'),
+          ('gen_watts', 'i'), ('exp_watts', 'i'), ('gen_watts_today', 'd'), ('exp_watts_today', 'd'),
+          ('weather_code', 'h'), ('temperature', 'd'), ('temp_set_point', 'd'))
+
+RECORD_FORMAT = '<' + ''.join(code for name, code in FIELDS)
+RECORD = struct.Struct(RECORD_FORMAT)
+
+# file header: magic, layout version, record size & the record format for readers to check
+HEADER = struct.Struct('<4sHH64s')
+MAGIC = 'OWLH'
+VERSION = 1
+
+MISSING = {'h': -0x8000, 'i': -0x80000000, 'd': float('nan')}
+
+# integer field ranges, short of MISSING
+LIMITS = {'h': (-0x7fff, 0x7fff), 'i': (-0x7fffffff, 0x7fffffff)}
+
+PACKET_TYPES = ('solar', 'electricity', 'weather', 'heating', 'hot_water')
+TYPE_CODES = dict((packetType, code) for code, packetType in enumerate(PACKET_TYPES, 1))
+
+Reading = collections.namedtuple('Reading', [name for name, code in FIELDS])
+
+
+########################################
+
+def packRecord(now, packet):
+    """The archive record for a packet received at time now.
+
+    Integer readings too big for their field are clamped to its range.
+    Raises struct.error if a reading can't be packed at all.
+
+    """
+    values = [now, TYPE_CODES.get(packet.packet_type, 0)]
+    for name, code in FIELDS[2:]:
+        value = getattr(packet, name, None)
+        if code[0] == '6':
+            missing = MISSING[code[1]]
+            if value == None:
+                values.extend([missing] * 6)
+            else:
+                values.extend(missing if v == None else _clamp(v, code[1]) for v in value)
+        else:
+            values.append(MISSING[code] if value == None else _clamp(value, code))
+    return RECORD.pack(*values)
+
+def _clamp(value, code):
+    limits = LIMITS.get(code)
+    if limits == None or not isinstance(value, (int, long, float)):
+        return value
+    return min(max(value, limits[0]), limits[1])
+
+def unpackRecord(buf, offset):
+    """Reading held in the record at offset, with MISSING values as None."""
+    values = RECORD.unpack_from(buf, offset)
+    fields = []
+    index = 0
+    for name, code in FIELDS:
+        if code[0] == '6':
+            fields.append(tuple(_present(v, code[1]) for v in values[index:index + 6]))
+            index += 6
+        else:
+            fields.append(_present(values[index], code))
+            index += 1
+    return Reading(*fields)
+
+def _present(value, code):
+    if code == 'd':
+        return None if math.isnan(value) else value
+    return None if value == MISSING.get(code) else value
+
+
+########################################
+########################################
+
+
+class HistoryArchive(object):
+    """Writes the history file of each Owl, <directory>/<MAC address>.owlh.
+
+    Records are queued by append() - from whichever thread associates packets -
+    & written by flush(), called every FLUSH_INTERVAL seconds from the plugin's
+    writer thread. When MAX_PENDING records are waiting, onFull is called to
+    have the writer thread flush them, or if it's None they're written by the
+    thread appending.
+
+    Instance variables:
+        directory       - folder holding the history files.
+        pending         - MAC address / packed records not yet written.
+        lastTime        - MAC address / time of the last record queued.
+        recordCount     - number of records written.
+        errorCount      - number of flushes that failed to write.
+        skippedCount    - number of packets with readings that couldn't be recorded.
+        onFull          - called when MAX_PENDING records are waiting, or None.
+
+    """
+    FLUSH_INTERVAL = 10.0
+    MAX_PENDING = 1000
+    DEFAULT_DIRECTORY = "~/Library/Application Support/NetworkOwl/history"
+
+    ########################################
+    def __init__(self, directory, logger=None):
+        self.directory = directory
+        self.logger = logger
+        self.pending = {}
+        self.pendingCount = 0
+        self.lastTime = {}
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.recordCount = 0
+        self.errorCount = 0
+        self.skippedCount = 0
+        self.onFull = None
+        self.flushRequested = False
+
+    ########################################
+    def path(self, mac):
+        return os.path.join(self.directory, "%s.owlh" % mac)
+
+    ########################################
+    def append(self, packet, now):
+        """Queue the record of a packet received at time now - or log & skip it
+        if its readings can't be packed, as this runs while associating it."""
+        with self.lock:
+            # keep each file in time order for the readers' binary search,
+            # even if the clock is put back
+            now = max(now, self.lastTime.get(packet.mac_address, now))
+            try:
+                record = packRecord(now, packet)
+            except struct.error, e:
+                self.skippedCount += 1
+                if self.logger != None:
+                    self.logger.logError("NetworkOwl: %s packet from %s not recorded in the history: %s" %
+                                         (packet.packet_type, packet.mac_address, e))
+                return
+            self.lastTime[packet.mac_address] = now
+            self.pending.setdefault(packet.mac_address, []).append(record)
+            self.pendingCount += 1
+            full = self.pendingCount >= HistoryArchive.MAX_PENDING and not self.flushRequested
+            if full and self.onFull != None:
+                self.flushRequested = True
+        if full:
+            if self.onFull != None:
+                self.onFull()
+            else:
+                self.flush()
+
+    ########################################
+    def flush(self):
+        """Append the queued records to each Owl's file, creating it if need be."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.pendingCount = 0
+            self.flushRequested = False
+        if not pending:
+            return 0
+
+        count = 0
+        with self.writeLock:
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                for mac, records in pending.iteritems():
+                    path = self.path(mac)
+                    size = os.path.getsize(path) if os.path.exists(path) else 0
+                    with open(path, 'ab') as historyFile:
+                        if size < HEADER.size:
+                            historyFile.truncate(0)
+                            historyFile.write(HEADER.pack(MAGIC, VERSION, RECORD.size, RECORD_FORMAT))
+                        else:
+                            # drop any partial record left by an interrupted write
+                            whole = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+                            if whole != size:
+                                historyFile.truncate(whole)
+                        historyFile.write(''.join(records))
+                    count += len(records)
+            except (IOError, OSError):
+                self.errorCount += 1
+                raise
+            finally:
+                self.recordCount += count
+        return count
+
+    ########################################
+    def close(self):
+        """Write out anything still queued."""
+        self.flush()
+
+
+########################################
+########################################
+
+
+class HistoryReader(object):
+    """Read-only view of one Owl's history file, mapped into memory.
+
+    Records written after the reader was opened aren't seen: open a new one.
+
+    Instance variables:
+        path    - the history file.
+        count   - number of whole records in the file.
+
+    """
+    ########################################
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.count = 0
+        with open(path, 'rb') as historyFile:
+            header = historyFile.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("%s is not a NetworkOwl history file" % path)
+            magic, version, recordSize, recordFormat = HEADER.unpack(header)
+            if magic != MAGIC or recordSize != RECORD.size or recordFormat.rstrip('\0') != RECORD_FORMAT:
+                raise ValueError("%s is not a version %d NetworkOwl history file" % (path, VERSION))
+            size = os.fstat(historyFile.fileno()).st_size
+            self.count = (size - HEADER.size) // RECORD.size
+            if self.count:
+                self.map = mmap.mmap(historyFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    ########################################
+    def __len__(self):
+        return self.count
+
+    ########################################
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("history record out of range")
+        return unpackRecord(self.map, HEADER.size + index * RECORD.size)
+
+    ########################################
+    def timeAt(self, index):
+        """Time of a record, without unpacking the rest of it."""
+        return struct.unpack_from('<d', self.map, HEADER.size + index * RECORD.size)[0]
+
+    ########################################
+    def bisect(self, when):
+        """Index of the first record at or after time when."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timeAt(middle) < when:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    ########################################
+    def between(self, start, end, packetType=None):
+        """Readings from time start up to but not including time end, optionally
+        only those from one kind of packet."""
+        code = TYPE_CODES.get(packetType)
+        for index in xrange(self.bisect(start), self.bisect(end)):
+            reading = self[index]
+            if code == None or reading.packetType == code:
+                yield reading
+
+    ########################################
+    def close(self):
+        if self.map != None:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Raw datagram capture for NetworkOwl
+# Records every datagram received - arrival time, source address & the raw
+# bytes - so production traffic can be replayed through the plugin later by
+# tests/replayCapture.py.
+# https://smudger4.github.io
+#
+
+import os
+import socket
+import struct
+import threading
+
+
+# file header: magic & format version
+HEADER = struct.Struct('<4sH')
+MAGIC = 'OWLC'
+VERSION = 1
+
+# each datagram: arrival time, IPv4 source address & port, size - then the bytes
+RECORD = struct.Struct('<d4sHI')
+
+
+########################################
+########################################
+
+
+class CaptureWriter(object):
+    """Appends received datagrams to a capture file.
+
+    write() only buffers - it is called on the socket thread for every
+    datagram - & flush() writes the buffer out, from the plugin's writer thread.
+
+    Instance variables:
+        path            - the capture file.
+        datagramCount   - number of datagrams written.
+        errorCount      - number of flushes that failed to write.
+
+    """
+    FLUSH_INTERVAL = 5.0
+    DEFAULT_PATH = "~/Library/Application Support/NetworkOwl/capture.owlc"
+
+    ########################################
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.lock = threading.Lock()
+        self.datagramCount = 0
+        self.errorCount = 0
+
+    ########################################
+    def write(self, now, address, datagram):
+        """Buffer a datagram received from address at time now."""
+        data = bytes(datagram)
+        record = RECORD.pack(now, socket.inet_aton(address[0]), address[1], len(data)) + data
+        with self.lock:
+            self.pending.append(record)
+
+    ########################################
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            with open(self.path, 'ab') as captureFile:
+                if size == 0:
+                    captureFile.write(HEADER.pack(MAGIC, VERSION))
+                captureFile.write(''.join(pending))
+        except (IOError, OSError):
+            self.errorCount += 1
+            raise
+        self.datagramCount += len(pending)
+        return len(pending)
+
+    ########################################
+    def close(self):
+        self.flush()
+
+
+########################################
+
+def readCapture(path):
+    """Generate (time, (host, port), datagram) for each datagram in a capture file.
+
+    Stops at a datagram cut short by an interrupted write.
+    Raises ValueError if the file isn't a capture file.
+
+    """
+    with open(path, 'rb') as captureFile:
+        header = captureFile.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION):
+            raise ValueError("%s is not a version %d NetworkOwl capture file" % (path, VERSION))
+        while True:
+            record = captureFile.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            when, host, port, size = RECORD.unpack(record)
+            datagram = captureFile.read(size)
+            if len(datagram) < size:
+                return
+            yield (when, (socket.inet_ntoa(host), port), datagram)
+
+def writeCapture(path, datagrams):
+    """Write a capture file of (time, (host, port), datagram) tuples - for making
+    test captures. Replaces any file already at path, where the plugin's own
+    capture appends."""
+    if os.path.exists(path):
+        os.remove(path)
+    writer = CaptureWriter(path)
+    for when, address, datagram in datagrams:
+        writer.write(when, address, datagram)
+    return writer.flush()
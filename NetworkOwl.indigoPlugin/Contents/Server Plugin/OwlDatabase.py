@@ -0,0 +1,252 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# SQLite history of NetworkOwl readings, for ad-hoc reporting
+# Packets queue their readings; a writer thread owns the database connection
+# & inserts them in batched transactions, so neither the socket nor the
+# publishing thread ever waits on the disk.
+# https://smudger4.github.io
+#
+
+import os
+import time
+import Queue
+import sqlite3
+import threading
+
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS readings (mac TEXT NOT NULL, metric TEXT NOT NULL, ts REAL NOT NULL, value REAL)",
+    "CREATE INDEX IF NOT EXISTS readings_mac_metric_ts ON readings (mac, metric, ts)",
+    "CREATE TABLE IF NOT EXISTS rollups (mac TEXT NOT NULL, metric TEXT NOT NULL, period INTEGER NOT NULL, "
+    "start REAL NOT NULL, count INTEGER, sum REAL, min REAL, max REAL, last REAL, increase REAL, resets INTEGER)",
+    "CREATE INDEX IF NOT EXISTS rollups_mac_metric_period_start ON rollups (mac, metric, period, start)",
+)
+
+INSERT_READING = "INSERT INTO readings (mac, metric, ts, value) VALUES (?, ?, ?, ?)"
+INSERT_ROLLUP = ("INSERT INTO rollups (mac, metric, period, start, count, sum, min, max, last, increase, resets) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def connect(path):
+    """Open the database in WAL mode, so readers don't block the writer."""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+########################################
+########################################
+
+
+class SQLiteSink(object):
+    """Writes packet readings to the readings table, & closed rollup buckets to
+    the rollups table, from its own thread.
+
+    append() & appendRollups() queue the rows; the writer thread commits them in one transaction
+    once batchRows are waiting or batchSeconds have passed since the last commit.
+
+    Instance variables:
+        path            - the database file.
+        batchRows       - rows inserted per transaction, at most.
+        batchSeconds    - longest a row waits to be committed.
+        rowCount        - number of rows committed.
+        droppedCount    - number of rows dropped because the queue was full or
+                          the writer thread had stopped.
+        errorCount      - number of batches that failed to commit.
+        stopped         - True once the writer thread has exited, e.g. because
+                          the database couldn't be opened.
+
+    """
+    MAX_QUEUED = 20000
+    CLOSE_TIMEOUT = 10.0
+    DEFAULT_PATH = "~/Library/Application Support/NetworkOwl/history.sqlite"
+
+    ########################################
+    def __init__(self, path, batchRows=500, batchSeconds=5.0, logger=None):
+        self.path = path
+        self.batchRows = max(1, batchRows)
+        self.batchSeconds = max(0.1, batchSeconds)
+        self.logger = logger
+        self.queue = Queue.Queue(SQLiteSink.MAX_QUEUED)
+        self.thread = None
+        self.stopped = False
+        self.rowCount = 0
+        self.droppedCount = 0
+        self.errorCount = 0
+
+    ########################################
+    def settings(self):
+        """The settings the sink was built from - to tell if the config has changed."""
+        return (self.path, self.batchRows, self.batchSeconds)
+
+    ########################################
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="NetworkOwl-sqlite")
+        self.thread.daemon = True
+        self.thread.start()
+
+    ########################################
+    def append(self, mac, now, readings):
+        """Queue the (metric, value) readings of a packet received at time now."""
+        for metric, value in readings:
+            self._put(INSERT_READING, (mac, metric, now, value))
+
+    ########################################
+    def appendRollups(self, buckets):
+        """Queue closed rollup buckets."""
+        for bucket in buckets:
+            self._put(INSERT_ROLLUP, (bucket.mac, bucket.metric, bucket.period, bucket.start, bucket.count,
+                                      bucket.total, bucket.min, bucket.max, bucket.last, bucket.increase, bucket.resets))
+
+    ########################################
+    def _put(self, statement, row):
+        if self.stopped:
+            # nothing will ever take it off the queue
+            self.droppedCount += 1
+            return
+        try:
+            self.queue.put_nowait((statement, row))
+        except Queue.Full:
+            self.droppedCount += 1
+
+    ########################################
+    def close(self):
+        """Commit everything queued & stop the writer thread.
+
+        Never waits more than CLOSE_TIMEOUT for room on the queue, & not at all
+        if the writer thread has already exited.
+
+        """
+        if self.thread != None:
+            if self.thread.is_alive():
+                try:
+                    self.queue.put(None, True, SQLiteSink.CLOSE_TIMEOUT)
+                except Queue.Full:
+                    pass
+                self.thread.join(SQLiteSink.CLOSE_TIMEOUT)
+            self.thread = None
+
+    ########################################
+    def run(self):
+        """Writer thread: insert queued rows in batches until close() is called."""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = connect(self.path)
+        except (sqlite3.Error, OSError), e:
+            self.stopped = True
+            if self.logger != None:
+                self.logger.logError("NetworkOwl: failed to open %s: %s" % (self.path, e))
+            return
+        batch = []
+        deadline = time.time() + self.batchSeconds
+        running = True
+        try:
+            while running:
+                try:
+                    item = self.queue.get(True, max(0.0, deadline - time.time()))
+                    if item == None:
+                        running = False
+                    else:
+                        batch.append(item)
+                except Queue.Empty:
+                    pass
+
+                if batch and (not running or len(batch) >= self.batchRows or time.time() >= deadline):
+                    self.commit(connection, batch)
+                    batch = []
+                if time.time() >= deadline:
+                    deadline = time.time() + self.batchSeconds
+        finally:
+            self.stopped = True
+            connection.close()
+
+    ########################################
+    def commit(self, connection, batch):
+        """Insert a batch of (statement, row) items in one transaction."""
+        rows = {}
+        for statement, row in batch:
+            rows.setdefault(statement, []).append(row)
+        try:
+            with connection:
+                for statement, statementRows in rows.iteritems():
+                    connection.executemany(statement, statementRows)
+            self.rowCount += len(batch)
+        except sqlite3.Error, e:
+            self.errorCount += 1
+            if self.logger != None:
+                self.logger.logError("NetworkOwl: failed to write %d readings to %s: %s" % (len(batch), self.path, e))
+
+
+########################################
+########################################
+
+
+class HistoryQueries(object):
+    """Reporting queries on the readings table, all answered from the
+    (mac, metric, ts) index.
+
+    Uses its own connection, so may be used from any one thread while the
+    sink is writing.
+
+    Metric names are those in the packet classes' READINGS, e.g.
+    elec_watts_ch0, elec_wh_ch0, solar_exp_wh, heat_temp.
+
+    """
+    ########################################
+    def __init__(self, path):
+        self.connection = connect(path)
+
+    ########################################
+    def series(self, mac, metric, start, end=None):
+        """(time, value) readings of a metric from time start up to end (default now)."""
+        if end == None:
+            end = time.time()
+        return self.connection.execute(
+            "SELECT ts, value FROM readings WHERE mac = ? AND metric = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (mac, metric, start, end)).fetchall()
+
+    ########################################
+    def lastHours(self, mac, metric, hours=24):
+        """(time, value) readings of a metric over the last few hours - e.g.
+        lastHours(mac, 'elec_watts_ch0') for the last 24h of channel 0."""
+        return self.series(mac, metric, time.time() - hours * 3600)
+
+    ########################################
+    def latest(self, mac, metric, start=None):
+        """(time, value) of the most recent reading of a metric, at or after
+        time start if given, or None."""
+        return self.connection.execute(
+            "SELECT ts, value FROM readings WHERE mac = ? AND metric = ? AND ts >= ? ORDER BY ts DESC LIMIT 1",
+            (mac, metric, start if start != None else 0)).fetchone()
+
+    ########################################
+    def today(self, mac, metric):
+        """Latest reading of a metric since local midnight, or None - e.g.
+        today(mac, 'solar_exp_wh') for today's solar export in Wh."""
+        now = time.localtime()
+        midnight = time.mktime((now.tm_year, now.tm_mon, now.tm_mday, 0, 0, 0, 0, 0, -1))
+        result = self.latest(mac, metric, midnight)
+        return result[1] if result != None else None
+
+    ########################################
+    def rollups(self, mac, metric, period, start, end=None):
+        """Closed rollup buckets of a period (minutes) starting from time start up
+        to end (default now), as (start, count, sum, min, max, last, increase) -
+        e.g. rollups(mac, 'elec_wh_ch0', 1440, monthStart) for daily energy use."""
+        if end == None:
+            end = time.time()
+        return self.connection.execute(
+            "SELECT start, count, sum, min, max, last, increase FROM rollups "
+            "WHERE mac = ? AND metric = ? AND period = ? AND start >= ? AND start < ? ORDER BY start",
+            (mac, metric, period, start, end)).fetchall()
+
+    ########################################
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Rolling statistics over recent NetworkOwl readings
+# Keeps the last few minutes of each power & temperature reading in fixed-size
+# ring buffers so rolling mean, min, max & rate of change can be published as
+# extra device states, in constant time per reading & bounded memory.
+# https://smudger4.github.io
+#
+
+import re
+import array
+import collections
+
+
+########################################
+########################################
+
+
+class RollingWindow(object):
+    """The readings of one metric received over the last few seconds.
+
+    Readings are held in preallocated arrays used as a ring buffer: a reading
+    leaves the window when it is older than seconds, or when capacity newer
+    readings have arrived. The sum is kept as readings come & go, and the
+    candidates for min & max in monotonic queues, so every statistic is O(1).
+
+    Instance variables:
+        seconds     - length of the window.
+        capacity    - most readings held, however short the gap between them.
+        count       - number of readings in the window.
+
+    """
+    ########################################
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+        self.capacity = max(2, capacity)
+        self.times = array.array('d', [0.0]) * self.capacity
+        self.values = array.array('d', [0.0]) * self.capacity
+        self.start = 0
+        self.count = 0
+        self.seq = 0
+        self.total = 0.0
+        # (sequence number, value) of readings that may yet be the min / max
+        self.mins = collections.deque()
+        self.maxs = collections.deque()
+
+    ########################################
+    def add(self, now, value):
+        """Add a reading taken at time now, dropping any that have left the window."""
+        if self.count == self.capacity:
+            self._evict()
+
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = now
+        self.values[index] = value
+        self.count += 1
+        self.total += value
+
+        seq = self.seq
+        self.seq += 1
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((seq, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((seq, value))
+
+        horizon = now - self.seconds
+        while self.times[self.start] < horizon:
+            self._evict()
+
+        if seq % self.capacity == 0:
+            # stop rounding errors in the running sum building up over the uptime
+            self.total = sum(self.values[(self.start + i) % self.capacity] for i in xrange(self.count))
+
+    ########################################
+    def _evict(self):
+        """Drop the oldest reading."""
+        oldest = self.seq - self.count
+        self.total -= self.values[self.start]
+        if self.mins[0][0] == oldest:
+            self.mins.popleft()
+        if self.maxs[0][0] == oldest:
+            self.maxs.popleft()
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+
+    ########################################
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def min(self):
+        return self.mins[0][1] if self.count else None
+
+    def max(self):
+        return self.maxs[0][1] if self.count else None
+
+    def rate(self):
+        """Change per minute between the oldest & newest readings in the window."""
+        if self.count < 2:
+            return 0.0
+        last = (self.start + self.count - 1) % self.capacity
+        elapsed = self.times[last] - self.times[self.start]
+        if elapsed <= 0:
+            return 0.0
+        return (self.values[last] - self.values[self.start]) * 60.0 / elapsed
+
+
+########################################
+########################################
+
+
+class DeviceHistory(object):
+    """Rolling windows over the readings of one NetworkOwl, & the states derived from them.
+
+    For a reading published as state id usedWattsNow & a 5 minute window, the
+    derived states are usedWattsNowMean5m, usedWattsNowMin5m, usedWattsNowMax5m
+    & usedWattsNowRate5m (change per minute).
+
+    Instance variables:
+        windows     - window lengths in minutes.
+        capacity    - most readings held per metric & window.
+        tracked     - state id / (RollingWindow, derived state ids) list for each tracked reading.
+
+    Class variables:
+        STATES      - the readings rolling statistics are kept for, when the Owl sends them.
+        STATISTICS  - the statistics derived for each reading & window.
+        DERIVED     - matches the end of a derived state id, e.g. Mean5m.
+
+    """
+    STATES = ("usedWattsNow", "usedWattsNowPh1", "usedWattsNowPh2", "usedWattsNowPh3",
+              "genWattsNow", "expWattsNow", "temperature", "heatingTemp", "hotWaterTemp")
+    STATISTICS = ("Mean", "Min", "Max", "Rate")
+    DERIVED = re.compile(r"(?:%s)\d+m$" % "|".join(STATISTICS))
+
+    ########################################
+    def __init__(self, stateIds, windows, capacity):
+        """Keep windows of each length for the tracked states among stateIds."""
+        self.windows = windows
+        self.capacity = capacity
+        self.tracked = {}
+        for stateId in stateIds:
+            if stateId in DeviceHistory.STATES:
+                self.tracked[stateId] = [(RollingWindow(minutes * 60, capacity),
+                                          tuple("%s%s%dm" % (stateId, statistic, minutes) for statistic in DeviceHistory.STATISTICS))
+                                         for minutes in windows]
+
+    ########################################
+    @staticmethod
+    def parseWindows(text):
+        """Window lengths in minutes from a comma separated list such as '5, 60'.
+
+        Raises ValueError unless each is a whole number greater than 0.
+
+        """
+        windows = []
+        for item in (text or "").split(","):
+            if item.strip():
+                minutes = int(item)
+                if minutes < 1:
+                    raise ValueError("window must be at least 1 minute")
+                if minutes not in windows:
+                    windows.append(minutes)
+        return windows
+
+    ########################################
+    @staticmethod
+    def isDerived(stateId):
+        """Is this one of the derived statistics states rather than a reading?"""
+        return DeviceHistory.DERIVED.search(stateId) != None
+
+    ########################################
+    @staticmethod
+    def derivedStateIds(stateIds, windows):
+        """(state id, label) of each derived state, for getDeviceStateList - named
+        as add() names them."""
+        result = []
+        for stateId in DeviceHistory.STATES:
+            if stateId in stateIds:
+                for minutes in windows:
+                    for statistic in DeviceHistory.STATISTICS:
+                        result.append(("%s%s%dm" % (stateId, statistic, minutes),
+                                       "%s %s over %d min" % (stateId, statistic.lower(), minutes)))
+        return result
+
+    ########################################
+    def add(self, states, now):
+        """Add the tracked readings among the (state id, value) pairs.
+
+        Returns the (state id, value) pairs of the derived states they update.
+
+        """
+        derived = []
+        for stateId, value in states:
+            windows = self.tracked.get(stateId)
+            if windows == None:
+                continue
+            for window, (meanId, minId, maxId, rateId) in windows:
+                window.add(now, value)
+                derived.append((meanId, round(window.mean(), 2)))
+                derived.append((minId, window.min()))
+                derived.append((maxId, window.max()))
+                derived.append((rateId, round(window.rate(), 2)))
+        return derived
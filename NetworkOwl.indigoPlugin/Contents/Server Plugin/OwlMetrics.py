@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Structured metrics export for NetworkOwl readings
+# Each packet's readings become a single record - key=value or JSON - buffered
+# in memory & appended to a rotating local file on a timer, so Splunk-style
+# ingestion can tail a file rather than loading the Indigo log.
+# https://smudger4.github.io
+#
+
+import os
+import time
+import json
+import threading
+
+
+########################################
+########################################
+
+
+class MetricsSink(object):
+    """Buffered, rotating file of one metrics record per packet.
+
+    Records are held in memory until flush() - called every FLUSH_INTERVAL
+    seconds from the plugin's writer thread - or until MAX_PENDING build up,
+    when onFull is called to have the writer thread flush them, or if it's
+    None they're written by the thread recording.
+    When the file grows past maxBytes it is renamed to path.1 (path.1 to path.2
+    & so on, keeping backupCount old files) & a new one started.
+
+    Instance variables:
+        path            - file the records are appended to.
+        format          - 'kv' for key=value lines, 'json' for JSON lines.
+        sampleEvery     - record 1 packet in every sampleEvery from each Owl & packet type.
+        maxBytes        - size the file may reach before it is rotated.
+        backupCount     - number of rotated files kept.
+        recordCount     - number of records written.
+        sampledOutCount - number of packets skipped by sampling.
+        errorCount      - number of flushes that failed to write.
+        onFull          - called when MAX_PENDING records are waiting, or None.
+
+    """
+    FORMATS = ('kv', 'json')
+    DEFAULT_PATH = "~/Library/Logs/NetworkOwl/metrics.log"
+    FLUSH_INTERVAL = 10.0
+    MAX_PENDING = 500
+    MAX_BYTES = 5 * 1024 * 1024
+    BACKUP_COUNT = 5
+
+    ########################################
+    def __init__(self, path, format='kv', sampleEvery=1, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT):
+        if format not in MetricsSink.FORMATS:
+            format = 'kv'
+        self.path = path
+        self.format = format
+        self.sampleEvery = max(1, int(sampleEvery))
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.pending = []
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.recordCount = 0
+        self.sampledOutCount = 0
+        self.errorCount = 0
+        self.onFull = None
+        self.flushRequested = False
+
+    ########################################
+    def settings(self):
+        """The settings the sink was built from - to tell if the config has changed."""
+        return (self.path, self.format, self.sampleEvery)
+
+    ########################################
+    def record(self, mac, packetType, readings, sample=True):
+        """Queue one record of (field, value) readings for a packet.
+
+        Returns False if the packet was skipped by sampling.
+
+        """
+        key = (mac, packetType)
+        with self.lock:
+            count = self.seen.get(key, 0)
+            self.seen[key] = count + 1
+            if sample and count % self.sampleEvery:
+                self.sampledOutCount += 1
+                return False
+
+        line = self.formatRecord(time.time(), mac, packetType, readings)
+        with self.lock:
+            self.pending.append(line)
+            full = len(self.pending) >= MetricsSink.MAX_PENDING and not self.flushRequested
+            if full and self.onFull != None:
+                self.flushRequested = True
+        if full:
+            if self.onFull != None:
+                self.onFull()
+            else:
+                self.flush()
+        return True
+
+    ########################################
+    def recordRollups(self, buckets):
+        """Queue one record for each closed rollup bucket - never sampled."""
+        for bucket in buckets:
+            self.record(bucket.mac, "rollup", bucket.fields(), sample=False)
+
+    ########################################
+    def formatRecord(self, now, mac, packetType, readings):
+        """One line for the file, without the line ending."""
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now))
+        if self.format == 'json':
+            fields = dict(readings)
+            fields.update({"ts": ts, "mac": mac, "type": packetType})
+            return json.dumps(fields, sort_keys=True)
+        return formatKeyValues([("ts", ts), ("mac", mac), ("type", packetType)] + list(readings))
+
+    ########################################
+    def flush(self):
+        """Append the queued records to the file, rotating it first if it's full."""
+        with self.lock:
+            lines, self.pending = self.pending, []
+            self.flushRequested = False
+        if not lines:
+            return 0
+
+        with self.writeLock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                if self.maxBytes > 0 and os.path.exists(self.path) and os.path.getsize(self.path) >= self.maxBytes:
+                    self.rotate()
+                with open(self.path, 'a') as metricsFile:
+                    metricsFile.write("\n".join(lines) + "\n")
+            except (IOError, OSError):
+                self.errorCount += 1
+                raise
+            self.recordCount += len(lines)
+        return len(lines)
+
+    ########################################
+    def rotate(self):
+        """Shift path.N-1 to path.N ... path to path.1, dropping the oldest."""
+        for index in range(self.backupCount - 1, 0, -1):
+            source = "%s.%d" % (self.path, index)
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self.path, index + 1))
+        if self.backupCount > 0:
+            os.rename(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+    ########################################
+    def close(self):
+        """Write out anything still queued."""
+        self.flush()
+
+
+########################################
+
+def formatKeyValues(readings):
+    """field=value pairs separated by spaces, quoting values that contain spaces."""
+    result = []
+    for field, value in readings:
+        value = "%s" % (value,)
+        if " " in value or '"' in value:
+            value = '"%s"' % value.replace('"', '\\"')
+        result.append("%s=%s" % (field, value))
+    return " ".join(result)
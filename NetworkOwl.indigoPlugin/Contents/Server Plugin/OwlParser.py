@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Field extraction for NetworkOwl datagrams
+# A single-pass regular expression per known packet shape pulls out just the
+# fields the packet classes use; anything that doesn't match exactly falls back
+# to a full ElementTree parse.
+# The patterns & ElementTree extractors are registered against each (tag, ver)
+# by registerPacketType in NetworkOwl.py.
+# https://smudger4.github.io
+#
+
+import re
+import operator
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+
+########################################
+# fast path: one compiled pattern per packet shape
+# shapes are as documented in the packet class docstrings in NetworkOwl.py
+
+_Q = r"""['"]"""
+_V = r"""([^'"]*)"""
+
+_HEADER = re.compile(r"""\s*<(\w+)((?:\s+\w+=%s[^'"]*%s)*)\s*>""" % (_Q, _Q))
+_ATTR = re.compile(r"""(\w+)=%s%s%s""" % (_Q, _V, _Q))
+
+_SIGNAL = r"""\s*<signal rssi=%s(?P<signal_strength>[^'"]*)%s lqi=%s(?P<signal_quality>[^'"]*)%s\s*/>""" % (_Q, _Q, _Q, _Q)
+_BATTERY = r"""\s*<battery level=%s(?P<battery_level>[^'"]*)%s\s*/>""" % (_Q, _Q)
+_TIMESTAMP = r"""\s*<timestamp>(?P<timestamp>[^<]*)</timestamp>"""
+_CHANS = r"""(?P<chans>(?:\s*<chan id=%s[^'"]*%s>\s*<curr[^>]*>[^<]*</curr>\s*<day[^>]*>[^<]*</day>\s*</chan>)*)""" % (_Q, _Q)
+_CHAN = re.compile(r"""<chan id=%s(\d+)%s>\s*<curr[^>]*>([^<]*)</curr>\s*<day[^>]*>([^<]*)</day>""" % (_Q, _Q))
+_TEMPERATURE = r"""\s*<temperature[^>]*>\s*<current>(?P<temperature>[^<]*)</current>\s*<required>(?P<temp_set_point>[^<]*)</required>(?:\s*<ambient>[^<]*</ambient>)?\s*</temperature>"""
+_ZONE = r"""\s*<zones>\s*<zone[^>]*>""" + _SIGNAL + _BATTERY + r"""(?:\s*<conf[^>]*/>)?""" + _TEMPERATURE + r"""\s*</zone>\s*</zones>"""
+
+SOLAR = re.compile(
+    r"""\s*<current>\s*<generating[^>]*>(?P<gen_watts>[^<]*)</generating>\s*<exporting[^>]*>(?P<exp_watts>[^<]*)</exporting>\s*</current>"""
+    r"""\s*<day>\s*<generated[^>]*>(?P<gen_watts_today>[^<]*)</generated>\s*<exported[^>]*>(?P<exp_watts_today>[^<]*)</exported>\s*</day>"""
+    r"""\s*</solar>\s*$""")
+ELECTRICITY_V1 = re.compile(_SIGNAL + _BATTERY + _CHANS + r"""\s*</electricity>\s*$""")
+# the property & tariff block that follows the channels isn't used
+ELECTRICITY_V2 = re.compile(_TIMESTAMP + _SIGNAL + _BATTERY + r"""\s*<channels>""" + _CHANS + r"""\s*</channels>[\s\S]*</electricity>\s*$""")
+WEATHER = re.compile(r"""\s*<temperature>(?P<temperature>[^<]*)</temperature>\s*<text>(?P<weather_text>[^<]*)</text>\s*</weather>\s*$""")
+HEATING_V1 = re.compile(_SIGNAL + _BATTERY + _TEMPERATURE + r"""\s*</heating>\s*$""")
+HEATING_V2 = re.compile(_TIMESTAMP + _ZONE + r"""\s*</heating>\s*$""")
+HOT_WATER_V1 = re.compile(_SIGNAL + _BATTERY + _TEMPERATURE + r"""\s*</hot_water>\s*$""")
+HOT_WATER_V2 = re.compile(_TIMESTAMP + _ZONE + r"""\s*</hot_water>\s*$""")
+
+
+########################################
+# fallback: ElementTree extractors, one per packet shape
+
+def _treeSignal(elem, fields):
+    sig = elem.find('signal')
+    fields['signal_strength'] = sig.get('rssi')
+    fields['signal_quality'] = sig.get('lqi')
+    fields['battery_level'] = elem.find('battery').get('level')
+
+def treeSolar(root):
+    currSolar = root.find('current')
+    daySolar = root.find('day')
+    return {'gen_watts': currSolar.find('generating').text,
+            'exp_watts': currSolar.find('exporting').text,
+            'gen_watts_today': daySolar.find('generated').text,
+            'exp_watts_today': daySolar.find('exported').text}
+
+def treeElectricity(root):
+    fields = {'timestamp': root.findtext('timestamp')}
+    _treeSignal(root, fields)
+    # step through each of the channels - repeats the data for each of the
+    # channels supported by the transmitter
+    fields['chans'] = [(elem.get('id'), elem.find('curr').text, elem.find('day').text)
+                       for elem in root.getiterator('chan')]
+    return fields
+
+def treeWeather(root):
+    return {'weather_code': root.get('code'),
+            'temperature': root.find('temperature').text,
+            'weather_text': root.find('text').text}
+
+def _treeTemperature(elem, fields):
+    currTemp = elem.find('temperature')
+    fields['temperature'] = currTemp.find('current').text
+    fields['temp_set_point'] = currTemp.find('required').text
+    return fields
+
+def treeZoneV1(root):
+    fields = {}
+    _treeSignal(root, fields)
+    return _treeTemperature(root, fields)
+
+def treeZoneV2(root):
+    # Firmware 2.6 introduces support for multiple zones
+    # this version only handles a single zone: the last one wins
+    fields = {'timestamp': root.findtext('timestamp')}
+    for elem in root.getiterator('zone'):
+        _treeSignal(elem, fields)
+        _treeTemperature(elem, fields)
+    return fields
+
+########################################
+# typed decoding of the extracted text
+# each returns None for a missing or unreadable value, so it isn't published
+
+def decodeWatts(text):
+    """Instantaneous power: '661.00' -> 661"""
+    try:
+        return int(round(float(text)))
+    except (TypeError, ValueError):
+        return None
+
+def decodeFloat(text):
+    """Energy (Wh) or temperature (C): '16456.46' -> 16456.46"""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+def decodeInt(text):
+    """Signal, code or battery level, dropping any units: '-66', '100%', '2990mV' -> int"""
+    try:
+        return int(text.rstrip('%mV '))
+    except (AttributeError, ValueError):
+        return None
+
+########################################
+########################################
+
+
+class PacketType(object):
+    """How to read & publish one (tag, ver) packet shape.
+    
+    Instance variables:
+        tag         - root element of the datagram.
+        ver         - value of the root's ver attribute, None if it has none.
+        packetClass - NetworkOwlPacket subclass built from the extracted fields.
+        extractTree - function extracting the fields from an ElementTree root.
+        pattern     - compiled fast path pattern, or None to always use extractTree.
+        stateMaps   - compiled state mapping for each owlType, built from the
+                      packet class STATE_MAP as (state id, value getter) tuples.
+        readings    - (metric, value getter) tuples for the history sinks, built
+                      from the packet class READINGS.
+    
+    """
+    ########################################
+    def __init__(self, tag, ver, packetClass, extractTree, pattern=None):
+        self.tag = tag
+        self.ver = ver
+        self.packetClass = packetClass
+        self.extractTree = extractTree
+        self.pattern = pattern
+        self.stateMaps = {}
+        
+        common = tuple(_compileStates(packetClass.STATE_MAP.get(None, ())))
+        for owlType, states in packetClass.STATE_MAP.items():
+            if owlType != None:
+                self.stateMaps[owlType] = common + tuple(_compileStates(states))
+        self.defaultStateMap = common
+        self.readings = tuple(_compileStates(packetClass.READINGS))
+        
+    ########################################
+    def stateMap(self, owlType):
+        """(state id, value getter) tuples to publish for this kind of Owl."""
+        return self.stateMaps.get(owlType, self.defaultStateMap)
+
+
+def _compileStates(states):
+    for state in states:
+        if len(state) == 2:
+            stateId, attr = state
+            yield (stateId, operator.attrgetter(attr))
+        else:
+            stateId, attr, index = state
+            yield (stateId, lambda packet, attr=attr, index=index: getattr(packet, attr)[index])
+
+
+########################################
+########################################
+
+
+class OwlParser(object):
+    """Extracts the fields used by the packet classes from a NetworkOwl datagram.
+
+    parse() returns (tag, mac address, packet type, fields). fields is a dict of
+    the text values named after the packet instance variables they feed.
+    Electricity channels are returned as a list of (id, curr, day) tuples in 'chans'.
+    packet type & fields are None if the (tag, ver) combination isn't registered.
+
+    Instance variables:
+        registry        - PacketType for each registered (tag, ver).
+        fastCount       - datagrams read by the fast path.
+        fallbackCount   - datagrams that needed a full ElementTree parse.
+
+    """
+    ########################################
+    def __init__(self, registry):
+        self.registry = registry
+        self.fastCount = 0
+        self.fallbackCount = 0
+
+    ########################################
+    def parse(self, datagram):
+        """Extract the fields from a datagram, falling back to ElementTree if necessary.
+
+        Raises the ElementTree parse error if the datagram isn't well-formed XML.
+
+        """
+        result = self.fastParse(datagram)
+        if result != None:
+            self.fastCount += 1
+            return result
+
+        self.fallbackCount += 1
+        return self.treeParse(datagram)
+
+    ########################################
+    def header(self, datagram):
+        """(tag, mac address) from the root element, without parsing the rest.
+        
+        Both are None if the datagram doesn't start with an element.
+        
+        """
+        header = _HEADER.match(datagram)
+        if header == None:
+            return (None, None)
+        return (header.group(1), dict(_ATTR.findall(header.group(2))).get('id'))
+
+    ########################################
+    def fastParse(self, datagram):
+        """Single pass extraction for the known packet shapes; None for anything else."""
+        header = _HEADER.match(datagram)
+        if header == None:
+            return None
+
+        tag = header.group(1)
+        attrs = dict(_ATTR.findall(header.group(2)))
+        ver = attrs.get('ver')
+
+        packetType = self.registry.get((tag, ver))
+        if packetType == None or packetType.pattern == None:
+            return None
+        body = packetType.pattern.match(datagram, header.end())
+        if body == None:
+            return None
+
+        fields = body.groupdict()
+        for value in fields.itervalues():
+            if value != None and '&' in value:
+                # entity references need decoding: leave that to ElementTree
+                return None
+
+        if 'chans' in fields:
+            fields['chans'] = _CHAN.findall(fields['chans'])
+        if tag == 'weather':
+            fields['weather_code'] = attrs.get('code')
+
+        return (tag, attrs.get('id'), packetType, fields)
+
+    ########################################
+    def treeParse(self, datagram):
+        """Full ElementTree parse, for anything the fast path doesn't recognise."""
+        root = ET.fromstring(datagram)
+
+        packetType = self.registry.get((root.tag, root.get('ver')))
+        fields = None
+        if packetType != None:
+            fields = packetType.extractTree(root)
+
+        return (root.tag, root.get('id'), packetType, fields)
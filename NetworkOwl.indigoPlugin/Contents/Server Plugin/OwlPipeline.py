@@ -0,0 +1,451 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Staged receive -> parse -> publish pipeline for NetworkOwl datagrams
+# The socket thread only receives & acks; parsing & updating the Indigo server
+# happen on their own threads so a slow server call can't stall the socket -
+# either one parser & one publisher thread, or a pool of worker threads each
+# parsing & publishing for its own share of the Owls.
+# https://smudger4.github.io
+#
+
+import zlib
+import threading
+import collections
+
+
+########################################
+########################################
+
+
+class BoundedQueue(object):
+    """Bounded FIFO between two pipeline stages.
+
+    What happens when a put finds the queue full is set by the overflow policy:
+        block       - wait for the next stage to make space.
+        dropOldest  - discard the packet at the head of the queue to make space.
+        dropNewest  - discard the packet being put.
+
+    Instance variables:
+        name        - stage name used in stats & log messages.
+        maxDepth    - most items held before the overflow policy applies.
+        policy      - one of POLICIES.
+        putCount    - number of items accepted.
+        dropCount   - number of items discarded by the overflow policy.
+        highWater   - deepest the queue has been.
+        onDrop      - called with each item put but never got from the queue -
+                      discarded by the overflow policy or put after close - or None.
+
+    """
+    POLICIES = ('block', 'dropOldest', 'dropNewest')
+
+    ########################################
+    def __init__(self, name, maxDepth, policy):
+        """Create an empty queue."""
+        self.name = name
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.putCount = 0
+        self.dropCount = 0
+        self.highWater = 0
+        self.onDrop = None
+        self.configure(maxDepth, policy)
+
+    ########################################
+    def configure(self, maxDepth, policy):
+        """Change the depth & overflow policy - takes effect on the next put."""
+        if policy not in BoundedQueue.POLICIES:
+            policy = 'dropOldest'
+        with self.cond:
+            self.maxDepth = max(1, int(maxDepth))
+            self.policy = policy
+            self.cond.notify_all()
+
+    ########################################
+    def depth(self):
+        return len(self.items)
+
+    ########################################
+    def put(self, item):
+        """Add item to the tail of the queue, applying the overflow policy if full.
+
+        Returns False if an item was dropped to make this put succeed or fail.
+
+        """
+        with self.cond:
+            dropped = False
+            while len(self.items) >= self.maxDepth and not self.closed:
+                if self.policy == 'dropNewest':
+                    self.dropCount += 1
+                    self._dropped(item)
+                    return False
+                elif self.policy == 'dropOldest':
+                    self._dropped(self.items.popleft())
+                    self.dropCount += 1
+                    dropped = True
+                else:
+                    self.cond.wait(0.5)
+
+            if self.closed:
+                self._dropped(item)
+                return False
+
+            self.items.append(item)
+            self.putCount += 1
+            if len(self.items) > self.highWater:
+                self.highWater = len(self.items)
+            self.cond.notify_all()
+            return not dropped
+
+    ########################################
+    def _dropped(self, item):
+        if self.onDrop != None:
+            self.onDrop(item)
+
+    ########################################
+    def get(self, timeout):
+        """Remove & return the head of the queue, or None if nothing arrives within timeout."""
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    ########################################
+    def close(self):
+        """Release any thread waiting on the queue."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    ########################################
+    def stats(self):
+        return {"depth": len(self.items), "highWater": self.highWater,
+                "put": self.putCount, "dropped": self.dropCount}
+
+
+########################################
+########################################
+
+
+class OwlPipeline(object):
+    """Three stage pipeline: socket reader -> XML parser -> Indigo publisher.
+
+    The reader stage is the thread calling submit (runProtocol's thread);
+    the parser & publisher stages each run on their own thread.
+
+    Instance variables:
+        owl             - NetworkOwl instance providing parseDataPacket.
+        parseQueue      - datagrams waiting to be parsed.
+        publishQueue    - packets waiting to be associated with the server.
+        parsedCount     - number of datagrams parsed.
+        publishedCount  - number of packets associated with the server.
+
+    """
+    GET_TIMEOUT = 0.5
+
+    ########################################
+    def __init__(self, owl, depth, policy):
+        """Create the queues between the stages."""
+        self.owl = owl
+        self.parseQueue = BoundedQueue("parse", depth, policy)
+        self.publishQueue = BoundedQueue("publish", depth, policy)
+        self.parsedCount = 0
+        self.publishedCount = 0
+        self.running = False
+        self.threads = []
+
+    ########################################
+    def configure(self, depth, policy):
+        self.parseQueue.configure(depth, policy)
+        self.publishQueue.configure(depth, policy)
+
+    ########################################
+    def start(self):
+        """Start the parser & publisher threads."""
+        self.running = True
+        self.threads = [threading.Thread(target=self.runParser, name="NetworkOwl-parser"),
+                        threading.Thread(target=self.runPublisher, name="NetworkOwl-publisher")]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    ########################################
+    def stop(self):
+        """Stop the stage threads, abandoning anything still queued."""
+        self.running = False
+        self.parseQueue.close()
+        self.publishQueue.close()
+        for thread in self.threads:
+            thread.join(2 * OwlPipeline.GET_TIMEOUT)
+        self.threads = []
+        self.owl.plugin.mylogger.log(3, "NetworkOwl: pipeline stopped: %s", self.summary())
+
+    ########################################
+    def submit(self, datagram, tag, mac):
+        """Reader stage: queue a datagram for parsing - its root tag & MAC
+        address, already read from its header, aren't needed.
+
+        The datagram is copied here because a ring slot view is only valid until
+        the ring wraps, which may happen before the parser gets to it.
+
+        """
+        if not self.parseQueue.put(bytes(datagram)):
+            self.owl.plugin.mylogger.log(3, "NetworkOwl: parse queue full, datagram dropped")
+
+    ########################################
+    def runParser(self):
+        """Parser stage: turn datagrams into packets."""
+        while self.running:
+            datagram = self.parseQueue.get(OwlPipeline.GET_TIMEOUT)
+            if datagram == None:
+                continue
+            try:
+                packet = self.owl.parseDataPacket(datagram)
+            except Exception, e:
+                self.owl.plugin.mylogger.logError("NetworkOwl: failed to parse datagram: %s" % (e,))
+                continue
+            self.parsedCount += 1
+            if packet != None:
+                if not self.publishQueue.put(packet):
+                    self.owl.plugin.mylogger.log(3, "NetworkOwl: publish queue full, packet dropped")
+
+    ########################################
+    def runPublisher(self):
+        """Publisher stage: update the Indigo server from each packet."""
+        while self.running:
+            packet = self.publishQueue.get(OwlPipeline.GET_TIMEOUT)
+            if packet == None:
+                continue
+            try:
+                packet.associate()
+            except Exception, e:
+                self.owl.plugin.mylogger.logError("NetworkOwl: failed to update %s packet: %s" % (packet.packet_type, e))
+                continue
+            self.publishedCount += 1
+
+    ########################################
+    def depth(self):
+        """Items waiting in both queues."""
+        return self.parseQueue.depth() + self.publishQueue.depth()
+
+    ########################################
+    def depthFor(self, mac):
+        """Items waiting ahead of the next packet from an Owl - all of them, as
+        every Owl shares the queues."""
+        return self.depth()
+
+    ########################################
+    def rebalance(self, macs):
+        """Nothing to do: every Owl shares the one parser & publisher."""
+        pass
+
+    ########################################
+    def stats(self):
+        """Per-stage queue counters."""
+        return {"parse": self.parseQueue.stats(), "publish": self.publishQueue.stats(),
+                "parsed": self.parsedCount, "published": self.publishedCount}
+
+    ########################################
+    def summary(self):
+        """One line description of the stage counters, for the log."""
+        result = []
+        for queue in (self.parseQueue, self.publishQueue):
+            qs = queue.stats()
+            result.append("%s queue depth %d (max %d), %d queued, %d dropped" %
+                          (queue.name, qs["depth"], qs["highWater"], qs["put"], qs["dropped"]))
+        result.append("%d parsed, %d published" % (self.parsedCount, self.publishedCount))
+        return "; ".join(result)
+
+
+########################################
+########################################
+
+
+class ShardedPipeline(object):
+    """Pool of worker threads, each parsing & publishing the packets of its own
+    share of the Owls.
+
+    The socket thread puts each datagram on the queue of the shard its MAC
+    address is assigned to, so each Owl's packets are handled in order by one
+    thread while different Owls' are parsed & published in parallel.
+
+    rebalance(), called as devices start & stop, deals the known Owls round
+    robin across the shards so each gets an even share however their MAC
+    addresses hash; unknown MAC addresses are hashed. An Owl only moves to its
+    new shard once the packets it already has queued on the old one are done,
+    so its packets are never handled out of order.
+
+    Instance variables:
+        owl             - NetworkOwl instance providing the parser & parseDataPacket.
+        shards          - BoundedQueue of datagrams for each worker.
+        assignment      - MAC address / index of the shard its packets go to.
+        target          - MAC address / index of the shard rebalance() wants it on.
+        inFlight        - MAC address / number of its packets queued or being handled.
+        parsedCount     - number of datagrams parsed by each worker.
+        publishedCount  - number of packets associated with the server by each worker.
+        movedCount      - number of times an Owl has moved to another shard.
+
+    """
+    GET_TIMEOUT = 0.5
+
+    ########################################
+    def __init__(self, owl, count, depth, policy):
+        """Create the shard queues."""
+        self.owl = owl
+        self.shards = []
+        for index in range(max(1, count)):
+            queue = BoundedQueue("shard %d" % index, depth, policy)
+            queue.onDrop = self.dropped
+            self.shards.append(queue)
+        self.lock = threading.Lock()
+        self.assignment = {}
+        self.target = {}
+        self.inFlight = {}
+        self.parsedCount = [0] * len(self.shards)
+        self.publishedCount = [0] * len(self.shards)
+        self.movedCount = 0
+        self.running = False
+        self.threads = []
+
+    ########################################
+    def configure(self, depth, policy):
+        for queue in self.shards:
+            queue.configure(depth, policy)
+
+    ########################################
+    def start(self):
+        """Start a worker thread per shard."""
+        self.running = True
+        self.threads = [threading.Thread(target=self.runShard, args=(index,), name="NetworkOwl-shard%d" % index)
+                        for index in range(len(self.shards))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    ########################################
+    def stop(self):
+        """Stop the worker threads, abandoning anything still queued."""
+        self.running = False
+        for queue in self.shards:
+            queue.close()
+        for thread in self.threads:
+            thread.join(2 * ShardedPipeline.GET_TIMEOUT)
+        self.threads = []
+        self.owl.plugin.mylogger.log(3, "NetworkOwl: pipeline stopped: %s", self.summary())
+
+    ########################################
+    def rebalance(self, macs):
+        """Deal the Owls with these MAC addresses round robin across the shards."""
+        with self.lock:
+            self.target = dict((mac, index % len(self.shards)) for index, mac in enumerate(sorted(macs)))
+            # forget Owls that have gone & have nothing left queued
+            for mac in [mac for mac in self.assignment if mac not in self.target and not self.inFlight.get(mac)]:
+                del self.assignment[mac]
+
+    ########################################
+    def shardFor(self, mac):
+        """Index of the shard an Owl's packets should go to."""
+        index = self.target.get(mac)
+        if index == None:
+            index = zlib.crc32(mac or "") % len(self.shards)
+        return index
+
+    ########################################
+    def submit(self, datagram, tag, mac):
+        """Socket thread: queue a datagram on the shard of the Owl that sent it,
+        from the root tag & MAC address already read from its header.
+
+        The datagram is copied here because a ring slot view is only valid until
+        the ring wraps, which may happen before the worker gets to it.
+
+        """
+        with self.lock:
+            index = self.assignment.get(mac)
+            wanted = self.shardFor(mac)
+            if index != wanted and not self.inFlight.get(mac):
+                if index != None:
+                    self.movedCount += 1
+                index = wanted
+                self.assignment[mac] = index
+            self.inFlight[mac] = self.inFlight.get(mac, 0) + 1
+        if not self.shards[index].put((mac, bytes(datagram))):
+            self.owl.plugin.mylogger.log(3, "NetworkOwl: %s queue full, datagram dropped", self.shards[index].name)
+
+    ########################################
+    def dropped(self, item):
+        """A queued datagram was discarded: it's no longer in flight."""
+        self.done(item[0])
+
+    ########################################
+    def done(self, mac):
+        with self.lock:
+            count = self.inFlight.get(mac, 0) - 1
+            if count > 0:
+                self.inFlight[mac] = count
+            else:
+                self.inFlight.pop(mac, None)
+
+    ########################################
+    def runShard(self, index):
+        """Worker: parse & publish the datagrams on one shard's queue."""
+        queue = self.shards[index]
+        while self.running:
+            item = queue.get(ShardedPipeline.GET_TIMEOUT)
+            if item == None:
+                continue
+            mac, datagram = item
+            try:
+                packet = self.owl.parseDataPacket(datagram)
+                self.parsedCount[index] += 1
+                if packet != None:
+                    packet.associate()
+                    self.publishedCount[index] += 1
+            except Exception, e:
+                self.owl.plugin.mylogger.logError("NetworkOwl: failed to handle datagram from %s: %s" % (mac, e))
+            finally:
+                self.done(mac)
+
+    ########################################
+    def depth(self):
+        """Datagrams waiting on every shard."""
+        return sum(queue.depth() for queue in self.shards)
+
+    ########################################
+    def depthFor(self, mac):
+        """Datagrams waiting ahead of the next packet from an Owl, on its shard."""
+        with self.lock:
+            index = self.assignment.get(mac)
+        return self.shards[index].depth() if index != None else 0
+
+    ########################################
+    def stats(self):
+        """Per-shard queue counters, with the number of Owls on each."""
+        with self.lock:
+            owls = [0] * len(self.shards)
+            for index in self.assignment.itervalues():
+                owls[index] += 1
+        shards = []
+        for index, queue in enumerate(self.shards):
+            shardStats = queue.stats()
+            shardStats.update({"owls": owls[index], "parsed": self.parsedCount[index],
+                               "published": self.publishedCount[index]})
+            shards.append(shardStats)
+        return {"shards": shards, "parsed": sum(self.parsedCount),
+                "published": sum(self.publishedCount), "moved": self.movedCount}
+
+    ########################################
+    def summary(self):
+        """One line description of the shard counters, for the log."""
+        stats = self.stats()
+        result = []
+        for queue, shardStats in zip(self.shards, stats["shards"]):
+            result.append("%s: %d Owls, depth %d (max %d), %d queued, %d dropped" %
+                          (queue.name, shardStats["owls"], shardStats["depth"], shardStats["highWater"],
+                           shardStats["put"], shardStats["dropped"]))
+        result.append("%d parsed, %d published, %d Owls moved" % (stats["parsed"], stats["published"], stats["moved"]))
+        return "; ".join(result)
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Change-only, batched publishing of NetworkOwl device states to Indigo
+# Keeps a shadow of the values last sent for each device so a packet only
+# sends the states that have changed, all in one server call.
+# Readings can also be held back until they move by more than a deadband or
+# a minimum interval has passed, set per device in Devices.xml.
+# https://smudger4.github.io
+#
+
+import time
+
+from OwlHistory import DeviceHistory
+
+
+########################################
+########################################
+
+
+class PublishPolicy(object):
+    """Deadband & rate limits applied to the metered readings of one device.
+
+    Readings are grouped into classes by state id: instantaneous power (the
+    ...WattsNow states), daily energy (the ...WattsToday states) & measured
+    temperatures. States outside these classes are published whenever they change -
+    including the rolling statistics derived from those readings, which are
+    already smoothed, so holding them back too would only make them lag further.
+
+    A changed reading is held back while it is within the deadband of the value
+    last published, or if it was last published less than minInterval seconds ago -
+    unless it was last published more than maxStaleness seconds ago (0 = never).
+
+    Instance variables:
+        deadbands       - deadband for each state class.
+        minInterval     - seconds between publishes of the same reading.
+        maxStaleness    - seconds after which a changed reading is always published.
+        heldCount       - number of changed readings held back.
+
+    """
+    TEMPERATURE_STATES = ("temperature", "heatingTemp", "hotWaterTemp")
+
+    ########################################
+    def __init__(self, powerDeadband=0.0, energyDeadband=0.0, tempDeadband=0.0, minInterval=0.0, maxStaleness=0.0):
+        self.deadbands = {"power": powerDeadband, "energy": energyDeadband, "temperature": tempDeadband}
+        self.minInterval = minInterval
+        self.maxStaleness = maxStaleness
+        self.heldCount = 0
+        self.classes = {}
+
+    ########################################
+    @staticmethod
+    def fromProps(props):
+        """Build the policy from the device's ConfigUI settings."""
+        def number(key):
+            try:
+                return max(0.0, float(props.get(key, 0) or 0))
+            except ValueError:
+                return 0.0
+        return PublishPolicy(number("powerDeadband"), number("energyDeadband"), number("tempDeadband"),
+                             number("minPublishInterval"), number("maxStaleness"))
+
+    ########################################
+    def isActive(self):
+        return self.minInterval > 0 or any(self.deadbands.values())
+
+    ########################################
+    def stateClass(self, stateId):
+        """power, energy, temperature or None - cached per state id."""
+        stateClass = self.classes.get(stateId, False)
+        if stateClass is False:
+            stateClass = None
+            if DeviceHistory.isDerived(stateId):
+                # usedWattsNowMean5m & co. are statistics, not readings
+                pass
+            elif "WattsNow" in stateId:
+                stateClass = "power"
+            elif "WattsToday" in stateId:
+                stateClass = "energy"
+            elif stateId in PublishPolicy.TEMPERATURE_STATES:
+                stateClass = "temperature"
+            self.classes[stateId] = stateClass
+        return stateClass
+
+    ########################################
+    def allows(self, stateId, value, lastValue, lastPublished, now):
+        """Should a reading that differs from the value last published be sent now?"""
+        stateClass = self.stateClass(stateId)
+        if stateClass == None or lastPublished == None:
+            return True
+
+        age = now - lastPublished
+        if self.maxStaleness > 0 and age >= self.maxStaleness:
+            return True
+
+        if age < self.minInterval:
+            self.heldCount += 1
+            return False
+
+        deadband = self.deadbands[stateClass]
+        if deadband > 0:
+            try:
+                if abs(float(value) - float(lastValue)) < deadband:
+                    self.heldCount += 1
+                    return False
+            except (TypeError, ValueError):
+                pass
+
+        return True
+
+
+########################################
+########################################
+
+
+class StatePublisher(object):
+    """Publishes state changes for one NetworkOwl device.
+
+    Instance variables:
+        device          - the Indigo device the states belong to.
+        policy          - PublishPolicy holding back small or frequent changes, or None.
+        shadow          - state id / value last sent to the server.
+        publishedAt     - state id / time the value was last sent to the server.
+        bulk            - True if the server supports updateStatesOnServer.
+        sentCount       - number of state values sent to the server.
+        suppressedCount - number of unchanged state values not sent.
+        callCount       - number of server calls made.
+
+    """
+    ########################################
+    def __init__(self, device, policy=None):
+        self.device = device
+        self.policy = policy
+        if policy != None and not policy.isActive():
+            self.policy = None
+        self.shadow = {}
+        self.publishedAt = {}
+        # updateStatesOnServer arrived with Indigo 7: fall back to one call per state
+        self.bulk = hasattr(device, "updateStatesOnServer")
+        self.sentCount = 0
+        self.suppressedCount = 0
+        self.callCount = 0
+
+    ########################################
+    def publish(self, states, force=False):
+        """Send the (state id, value) pairs that differ from the last values sent.
+
+        force sends every pair whether changed or not, bypassing the policy.
+        Returns the number sent.
+
+        """
+        changes = []
+        shadow = self.shadow
+        policy = self.policy
+        now = time.time()
+        for stateId, value in states:
+            lastValue = shadow.get(stateId)
+            if force or lastValue != value:
+                if not force and policy != None and not policy.allows(stateId, value, lastValue, self.publishedAt.get(stateId), now):
+                    continue
+                shadow[stateId] = value
+                if force:
+                    # forced values (the reset in deviceStartComm) mustn't hold back the first reading
+                    self.publishedAt.pop(stateId, None)
+                else:
+                    self.publishedAt[stateId] = now
+                changes.append((stateId, value))
+
+        self.suppressedCount += len(states) - len(changes)
+        if not changes:
+            return 0
+
+        if self.bulk:
+            self.device.updateStatesOnServer([{"key": stateId, "value": value} for stateId, value in changes])
+            self.callCount += 1
+        else:
+            for stateId, value in changes:
+                self.device.updateStateOnServer(stateId, value)
+            self.callCount += len(changes)
+
+        self.sentCount += len(changes)
+        return len(changes)
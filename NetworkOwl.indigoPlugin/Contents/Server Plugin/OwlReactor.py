@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Single-threaded event loop for NetworkOwl listeners
+# Serves any number of multicast sockets plus housekeeping timers from one
+# thread, with each datagram's ack, parse & publish steps run as a generator
+# based coroutine scheduled on the loop.
+# https://smudger4.github.io
+#
+
+import time
+import heapq
+import errno
+import select
+import threading
+import collections
+
+
+########################################
+########################################
+
+
+class TimerQueue(object):
+    """Housekeeping timers (flushes, watchdogs) run from whichever loop owns the queue.
+
+    Timers may be added from any thread; they only ever run on the loop's thread,
+    from runDue().
+
+    Instance variables:
+        logger  - logger for errors raised by timer callbacks, or None.
+
+    """
+    ########################################
+    def __init__(self, logger=None):
+        """Create an empty queue."""
+        self.logger = logger
+        self.heap = []
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    ########################################
+    def callLater(self, delay, fn, *args):
+        """Run fn(*args) once, delay seconds from now. Returns a handle for cancel()."""
+        return self._schedule(time.time() + delay, None, fn, args)
+
+    ########################################
+    def callEvery(self, interval, fn, *args):
+        """Run fn(*args) every interval seconds. Returns a handle for cancel()."""
+        return self._schedule(time.time() + interval, interval, fn, args)
+
+    ########################################
+    def cancel(self, timer):
+        timer[4] = True
+
+    ########################################
+    def _schedule(self, when, interval, fn, args):
+        with self.lock:
+            self.seq += 1
+            timer = [when, self.seq, interval, (fn, args), False]
+            heapq.heappush(self.heap, timer)
+            return timer
+
+    ########################################
+    def timeout(self, maximum):
+        """Seconds until the next timer is due, capped at maximum."""
+        with self.lock:
+            if not self.heap:
+                return maximum
+            return max(0.0, min(maximum, self.heap[0][0] - time.time()))
+
+    ########################################
+    def runDue(self):
+        """Run every timer that has come due."""
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] > now:
+                    return
+                timer = heapq.heappop(self.heap)
+                if timer[4]:
+                    continue
+                if timer[2] != None:
+                    # repeating timer: schedule the next run before this one
+                    timer[0] = max(timer[0] + timer[2], now)
+                    heapq.heappush(self.heap, timer)
+
+            fn, args = timer[3]
+            try:
+                fn(*args)
+            except Exception, e:
+                if self.logger != None:
+                    self.logger.logError("NetworkOwl: timer %s failed: %s" % (getattr(fn, "__name__", fn), e))
+
+
+########################################
+########################################
+
+
+class TimerThread(object):
+    """A TimerQueue run by a thread of its own, for housekeeping that mustn't hold
+    up the receive loop - the writes of the buffered file sinks.
+
+    Instance variables:
+        timers  - TimerQueue the thread runs.
+        thread  - the thread, None unless started.
+
+    """
+    MAX_WAIT = 1.0
+
+    ########################################
+    def __init__(self, logger=None, name="NetworkOwl-timers"):
+        self.timers = TimerQueue(logger)
+        self.name = name
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+
+    ########################################
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    ########################################
+    def stop(self):
+        """Stop the thread once it has run any timer already due."""
+        self.running = False
+        self.wakeup.set()
+        if self.thread != None:
+            self.thread.join(10.0)
+            self.thread = None
+
+    ########################################
+    def callSoon(self, fn, *args):
+        """Run fn(*args) on the thread as soon as it's free."""
+        self.timers.callLater(0, fn, *args)
+        self.wakeup.set()
+
+    ########################################
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.timers.timeout(TimerThread.MAX_WAIT))
+            self.wakeup.clear()
+            self.timers.runDue()
+        # anything handed over just before stop()
+        self.timers.runDue()
+
+
+########################################
+########################################
+
+
+class OwlReactor(object):
+    """select() based event loop shared by every NetworkOwl listening socket.
+
+    Instance variables:
+        plugin      - the containing plugin, for the stop flag, config & logger.
+        timers      - TimerQueue serviced by the loop.
+        protocols   - OwlDatagramProtocol per listening socket.
+        ready       - callbacks to run before the loop next waits on the sockets.
+
+    """
+    ########################################
+    def __init__(self, plugin, timers):
+        self.plugin = plugin
+        self.timers = timers
+        self.protocols = []
+        self.ready = collections.deque()
+
+    ########################################
+    def addProtocol(self, protocol):
+        """Start serving a protocol's socket from the loop."""
+        protocol.sock.setblocking(0)
+        protocol.reactor = self
+        self.protocols.append(protocol)
+
+    ########################################
+    def callSoon(self, fn, *args):
+        """Run fn(*args) on the loop before it next waits on the sockets."""
+        self.ready.append((fn, args))
+
+    ########################################
+    def spawn(self, coroutine):
+        """Run a generator on the loop, one step (up to the next yield) per callback."""
+        self.callSoon(self._step, coroutine)
+
+    ########################################
+    def _step(self, coroutine):
+        try:
+            coroutine.next()
+        except StopIteration:
+            return
+        self.callSoon(self._step, coroutine)
+
+    ########################################
+    def runReady(self):
+        """Run callbacks until none are left, including any they schedule."""
+        while self.ready:
+            fn, args = self.ready.popleft()
+            try:
+                fn(*args)
+            except Exception, e:
+                self.plugin.mylogger.logError("NetworkOwl: event loop callback failed: %s" % (e,))
+
+    ########################################
+    def run(self, maxTimeout):
+        """Serve the sockets & timers until the main Indigo plugin thread variable is reset."""
+        socks = dict((protocol.sock, protocol) for protocol in self.protocols)
+
+        try:
+            while self.plugin.stopThread == False:
+
+                # pick up any config change flagged since the last wakeup
+                self.plugin.checkConfig()
+
+                self.timers.runDue()
+                self.runReady()
+
+                try:
+                    readable, writable, errored = select.select(socks.keys(), [], [], self.timers.timeout(maxTimeout))
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                # every socket drains into the one ring, so finish with the
+                # datagrams drained from each before the next can reuse their
+                # ring slots
+                for sock in readable:
+                    socks[sock].readReady()
+                    self.runReady()
+        finally:
+            for sock in socks:
+                sock.close()
+
+
+########################################
+########################################
+
+
+class OwlDatagramProtocol(object):
+    """Handles the datagrams arriving on one multicast socket.
+
+    Instance variables:
+        owl     - NetworkOwl instance doing the receive, ack & parse.
+        sock    - the socket joined to the multicast group.
+        reactor - the OwlReactor serving the socket, set by addProtocol.
+
+    """
+    ########################################
+    def __init__(self, owl, sock):
+        self.owl = owl
+        self.sock = sock
+        self.reactor = None
+
+    ########################################
+    def readReady(self):
+        """Socket is readable: drain it, scheduling a coroutine for each datagram."""
+        self.owl.drainSocket(self.sock, self.datagramReceived)
+
+    ########################################
+    def datagramReceived(self, sock, view, address):
+        self.reactor.spawn(self.handleDatagram(sock, view, address))
+
+    ########################################
+    def handleDatagram(self, sock, view, address):
+        """Coroutine: ack, parse & publish the datagram as separate loop steps.
+        Repeats of a recent datagram are acked but go no further."""
+        self.owl.sendAck(sock, address)
+        yield
+
+        tag, mac = self.owl.parser.header(view)
+        self.owl.countArrival(sock, mac)
+        if self.owl.isDuplicate(view, tag, mac):
+            self.owl.plugin.mylogger.log(4, "NetworkOwl: duplicate %s packet skipped", tag)
+            return
+
+        packet = self.owl.parseDataPacket(view)
+        yield
+
+        if packet != None:
+            packet.associate()
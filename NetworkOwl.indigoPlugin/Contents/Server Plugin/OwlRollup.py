@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Incremental rollups of NetworkOwl readings
+# Keeps count, sum, min, max & last of every reading over 1 minute, 15 minute,
+# hourly & daily buckets, updated as each packet arrives, & hands each bucket
+# to the history sinks when its period ends - so tariff periods & daily
+# summaries never need the raw readings rescanned.
+# https://smudger4.github.io
+#
+
+import time
+import threading
+
+
+# minutes in a daily bucket - which runs midnight to midnight by the calendar,
+# so is 23 or 25 hours long on the days the clocks change
+DAY = 1440
+
+
+def localMidnight(now, days=0):
+    """Time of the local midnight starting the day containing time now, or the
+    day that many days later."""
+    local = time.localtime(now)
+    return time.mktime((local.tm_year, local.tm_mon, local.tm_mday + days, 0, 0, 0, 0, 0, -1))
+
+
+########################################
+########################################
+
+
+class Bucket(object):
+    """Aggregate of one metric from one Owl over one period.
+
+    Instance variables:
+        mac         - MAC address of the Owl.
+        metric      - reading name, as in the packet classes' READINGS.
+        period      - bucket length in minutes.
+        start       - time the bucket starts, aligned to local time.
+        count       - number of readings.
+        total       - sum of the readings.
+        min, max    - smallest & largest readings.
+        last        - most recent reading.
+        increase    - for cumulative (Wh today) readings: energy used within the
+                      bucket, allowing for the Owl's midnight reset; None otherwise.
+        resets      - number of midnight resets seen within the bucket.
+
+    """
+    __slots__ = ('mac', 'metric', 'period', 'start', 'count', 'total', 'min', 'max', 'last', 'increase', 'resets')
+
+    ########################################
+    def __init__(self, mac, metric, period, start, cumulative):
+        self.mac = mac
+        self.metric = metric
+        self.period = period
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.increase = 0.0 if cumulative else None
+        self.resets = 0
+
+    ########################################
+    def add(self, value, delta, reset):
+        self.count += 1
+        self.total += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+        self.last = value
+        if self.increase != None:
+            self.increase += delta
+            if reset:
+                self.resets += 1
+
+    ########################################
+    def end(self):
+        if self.period == DAY:
+            return localMidnight(self.start, 1)
+        return self.start + self.period * 60
+
+    ########################################
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    ########################################
+    def fields(self):
+        """(field, value) pairs describing the bucket, for the metrics file."""
+        result = [("metric", self.metric), ("period", self.period),
+                  ("start", time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start))),
+                  ("count", self.count), ("sum", round(self.total, 3)), ("min", self.min),
+                  ("max", self.max), ("last", self.last)]
+        if self.increase != None:
+            result.extend([("increase", round(self.increase, 3)), ("resets", self.resets)])
+        return result
+
+
+########################################
+########################################
+
+
+class RollupEngine(object):
+    """Buckets for every (MAC address, metric, period), updated in O(1) per reading.
+
+    A bucket closes when a reading arrives for a later period, or when
+    closeDue() - run every minute from the receive loop's timers - finds its
+    period has ended. Closed buckets are passed to emit(buckets); buckets still
+    open when the plugin stops are discarded.
+
+    Cumulative readings (the Wh today counters) reset to 0 at the Owl's midnight.
+    A reading lower than the last one is taken as a reset: the energy since the
+    reset is the new reading itself, so each bucket's increase - & so the daily
+    total - counts the energy either side of midnight correctly.
+
+    Instance variables:
+        periods         - bucket lengths in minutes.
+        emit            - called with each list of closed buckets.
+        buckets         - (MAC address, metric) / open bucket for each period.
+        lastValues      - (MAC address, metric) / last cumulative reading.
+        closedCount     - number of buckets emitted.
+        resetCount      - number of midnight resets seen.
+
+    """
+    PERIODS = (1, 15, 60, DAY)
+    CLOSE_INTERVAL = 60.0
+
+    ########################################
+    def __init__(self, emit, periods=PERIODS):
+        self.emit = emit
+        self.periods = periods
+        self.buckets = {}
+        self.lastValues = {}
+        self.lock = threading.Lock()
+        self.closedCount = 0
+        self.resetCount = 0
+
+    ########################################
+    @staticmethod
+    def isCumulative(metric):
+        return metric.endswith("_wh") or "_wh_" in metric
+
+    ########################################
+    @staticmethod
+    def bucketStart(now, period):
+        """Start of the period containing time now, aligned to local time so
+        daily buckets start at midnight."""
+        if period == DAY:
+            return localMidnight(now)
+        local = time.localtime(now)
+        offset = -(time.altzone if local.tm_isdst > 0 else time.timezone)
+        length = period * 60
+        return now - (now + offset) % length
+
+    ########################################
+    def add(self, mac, now, readings):
+        """Add a packet's (metric, value) readings, received at time now."""
+        starts = [RollupEngine.bucketStart(now, period) for period in self.periods]
+        closed = []
+        with self.lock:
+            for metric, value in readings:
+                key = (mac, metric)
+                cumulative = RollupEngine.isCumulative(metric)
+                delta, reset = 0.0, False
+                if cumulative:
+                    last = self.lastValues.get(key)
+                    if last != None:
+                        if value < last:
+                            delta, reset = value, True
+                            self.resetCount += 1
+                        else:
+                            delta = value - last
+                    self.lastValues[key] = value
+
+                buckets = self.buckets.get(key)
+                if buckets == None:
+                    buckets = [None] * len(self.periods)
+                    self.buckets[key] = buckets
+                for index, period in enumerate(self.periods):
+                    bucket = buckets[index]
+                    if bucket == None or bucket.start != starts[index]:
+                        if bucket != None:
+                            closed.append(bucket)
+                        bucket = Bucket(mac, metric, period, starts[index], cumulative)
+                        buckets[index] = bucket
+                    bucket.add(value, delta, reset)
+        self._emit(closed)
+
+    ########################################
+    def closeDue(self, now=None):
+        """Close & emit every bucket whose period has ended."""
+        if now == None:
+            now = time.time()
+        closed = []
+        with self.lock:
+            for buckets in self.buckets.itervalues():
+                for index, bucket in enumerate(buckets):
+                    if bucket != None and bucket.end() <= now:
+                        closed.append(bucket)
+                        buckets[index] = None
+        self._emit(closed)
+
+    ########################################
+    def forget(self, mac):
+        """Drop the open buckets of an Owl that is no longer used."""
+        with self.lock:
+            for key in [key for key in self.buckets if key[0] == mac]:
+                del self.buckets[key]
+                self.lastValues.pop(key, None)
+
+    ########################################
+    def _emit(self, closed):
+        if closed:
+            self.closedCount += len(closed)
+            self.emit(closed)
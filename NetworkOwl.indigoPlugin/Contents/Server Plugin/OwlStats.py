@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Per-stage timing of NetworkOwl packet handling
+# Counts, cumulative time & a latency histogram for each stage of each packet
+# type - receive, parse, construct & associate, split into publish, history &
+# log - so when the plugin falls behind the stage at fault can be seen.
+# https://smudger4.github.io
+#
+
+import time
+import array
+import bisect
+import threading
+
+
+# histogram bucket upper bounds in seconds, each 25% above the last: 1us to
+# about 1s, then everything slower - so percentiles are good to 25%
+BOUNDS = tuple(0.000001 * 1.25 ** index for index in range(63))
+
+
+########################################
+########################################
+
+
+class StageStats(object):
+    """Timings of one stage for one packet type.
+
+    Instance variables:
+        count       - number of times the stage ran.
+        total       - seconds spent in the stage.
+        max         - longest time the stage took.
+        histogram   - count of timings up to each of BOUNDS, then of longer ones.
+
+    """
+    __slots__ = ('count', 'total', 'max', 'histogram')
+
+    ########################################
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = array.array('l', [0]) * (len(BOUNDS) + 1)
+
+    ########################################
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.histogram[bisect.bisect_left(BOUNDS, elapsed)] += 1
+
+    ########################################
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    ########################################
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the timing fraction (0 - 1) of the
+        way up - the max if that's in the last bucket."""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[index], self.max) if index < len(BOUNDS) else self.max
+        return self.max
+
+
+########################################
+########################################
+
+
+class StageTimer(object):
+    """StageStats for every (stage, packet type) timed.
+
+    Stages are recorded from the socket, parser & publisher threads, so
+    record() takes a lock - held only for the additions.
+
+    Instance variables:
+        stats       - (stage, packet type) / StageStats.
+        started     - time the timings were started or last reset.
+
+    Class variables:
+        STAGES      - stages in the order a datagram passes through them:
+                      receive   - recvfrom into the ring, before the type is known;
+                      parse     - the parser pulling out the fields;
+                      construct - building the packet & decoding its fields;
+                      publish   - mapping states & rolling statistics, & the server call;
+                      history   - the history archive, database & rollups;
+                      log       - logging the readings & exporting the metrics;
+                      associate - publish, history & log together.
+        ANY         - packet type the receive stage is recorded under.
+
+    """
+    STAGES = ('receive', 'parse', 'construct', 'publish', 'history', 'log', 'associate')
+    ANY = '*'
+    PUBLISH_INTERVAL = 60.0
+
+    ########################################
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    ########################################
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started = time.time()
+
+    ########################################
+    def record(self, stage, packetType, elapsed):
+        """Add the time one stage took for one packet."""
+        key = (stage, packetType)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats == None:
+                stats = StageStats()
+                self.stats[key] = stats
+            stats.add(elapsed)
+
+    ########################################
+    def recordAssociate(self, packetType, began, published, stored, ended):
+        """Add the times of the stages of associating one packet, from the
+        time each ended."""
+        self.record('publish', packetType, published - began)
+        self.record('history', packetType, stored - published)
+        self.record('log', packetType, ended - stored)
+        self.record('associate', packetType, ended - began)
+
+    ########################################
+    def totals(self, stage):
+        """StageStats of a stage over every packet type."""
+        result = StageStats()
+        with self.lock:
+            for (statsStage, packetType), stats in self.stats.iteritems():
+                if statsStage == stage:
+                    result.count += stats.count
+                    result.total += stats.total
+                    result.max = max(result.max, stats.max)
+                    for index, count in enumerate(stats.histogram):
+                        result.histogram[index] += count
+        return result
+
+    ########################################
+    def table(self):
+        """Lines of a table of every stage & packet type timed, for the log."""
+        elapsed = max(time.time() - self.started, 1.0)
+        lines = ["%-10s %-12s %9s %8s %10s %10s %10s %10s %10s" %
+                 ("stage", "packet", "count", "per sec", "total s", "mean us", "p50 us", "p99 us", "max us")]
+        with self.lock:
+            keys = sorted(self.stats, key=lambda key: (StageTimer.STAGES.index(key[0]), key[1]))
+            for stage, packetType in keys:
+                stats = self.stats[(stage, packetType)]
+                lines.append("%-10s %-12s %9d %8.1f %10.3f %10.1f %10.1f %10.1f %10.1f" %
+                             (stage, packetType, stats.count, stats.count / elapsed, stats.total,
+                              stats.mean() * 1e6, stats.percentile(0.5) * 1e6,
+                              stats.percentile(0.99) * 1e6, stats.max * 1e6))
+        return lines
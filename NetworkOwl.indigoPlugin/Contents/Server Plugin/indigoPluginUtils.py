@@ -2,6 +2,8 @@
 # Filename: indigoPluginUtils.py
 
 import indigo
+import threading
+import Queue
 
 ##########################################################################################
 # logger class for Indigo Plugins.  Originally written by berkinet, modified by Travis
@@ -17,12 +19,26 @@ import indigo
 #		It will only log the message if the message's log level is <= logLevel.
 #		self.mylogger.log(1, "Bla bla")
 #
+#		Any further arguments are formatted into the log with the % operator,
+#		but only if the message will actually be logged:
+#		self.mylogger.log(3, "received %s bytes from %s", numBytes, address)
+#
+#		To avoid building an expensive argument at all, check the level first:
+#		if self.mylogger.isEnabledFor(4):
+#			self.mylogger.log(4, str(data))
+#
 #	3.  To log errors:
 #		self.mylogger.logError("Oops, error")
 #
 #	4.  To read the loggers log level in the plugin:
 #		logLevel = self.mylogger.logLevel
 #
+#	5.	To send the logs to Indigo from a background thread, so a slow
+#		indigo.server.log call never holds up the caller, start the writer
+#		in startup() & stop it (writing anything still queued) in shutdown():
+#		self.mylogger.startWriter()
+#		self.mylogger.stopWriter()
+#
 
 
 class logger(object):
@@ -30,6 +46,8 @@ class logger(object):
 	def __init__(self, plugin):
 		self.plugin = plugin
 		self.logLevel = None
+		self.queue = None
+		self.writer = None
 		self.readConfig()
 
 	def readConfig(self):
@@ -57,12 +75,53 @@ class logger(object):
 		elif oldLevel != self.logLevel:
 			self.log(1, "Log level preferences changed to \"%s\"." % kLogLevelList[self.logLevel])
 
-	def log(self, level, logMsg):
+	def isEnabledFor(self, level):
+		return level <= self.logLevel
+
+	def log(self, level, logMsg, *args):
 		if level <= self.logLevel:
-			if level < 3:
-				indigo.server.log(logMsg)
+			if self.writer is not None:
+				self.queue.put((level, logMsg, args))
 			else:
-				self.plugin.debugLog(logMsg)
+				self.write(level, logMsg, args)
+
+	def logError(self, logMsg, *args):
+		if self.writer is not None:
+			self.queue.put((-1, logMsg, args))
+		else:
+			self.write(-1, logMsg, args)
+
+	def write(self, level, logMsg, args):
+		if args:
+			logMsg = logMsg % args
+		if level < 0:
+			indigo.server.log(logMsg, isError=True)
+		elif level < 3:
+			indigo.server.log(logMsg)
+		else:
+			self.plugin.debugLog(logMsg)
+
+	def startWriter(self):
+		if self.writer is None:
+			self.queue = Queue.Queue()
+			self.writer = threading.Thread(target=self.runWriter, name="logWriter")
+			self.writer.daemon = True
+			self.writer.start()
+
+	def stopWriter(self):
+		if self.writer is not None:
+			writer = self.writer
+			self.writer = None
+			self.queue.put(None)
+			writer.join(5.0)
 
-	def logError(self, logMsg):
-		indigo.server.log(logMsg, isError=True)
+	def runWriter(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			try:
+				self.write(*item)
+			except Exception:
+				# never let a bad log message kill the writer
+				pass
@@ -24,10 +24,21 @@
 import os
 import sys
 import struct
+import time
+import functools
 
 import indigoPluginUtils
 
-from NetworkOwl import NetworkOwl
+from NetworkOwl import NetworkOwl, DeviceContext
+from OwlPublisher import StatePublisher, PublishPolicy
+from OwlMetrics import MetricsSink, formatKeyValues
+from OwlHistory import DeviceHistory
+from OwlArchive import HistoryArchive
+from OwlCapture import CaptureWriter
+from OwlDatabase import SQLiteSink
+from OwlRollup import RollupEngine
+from OwlStats import StageTimer
+from OwlReactor import TimerThread
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -39,10 +50,22 @@ class Plugin(indigo.PluginBase):
     Class variables:
         listeningPort   - multicast port we're listening to
         deviceDict      - dictionary of MAC address / Device tuples
+        contextDict     - dictionary of MAC address / DeviceContext tuples, holding
+                          the device, Owl type & StatePublisher packets need
+        DIAGNOSTIC_STATES - (state id, label) of the states added to devices showing
+                          diagnostic states
         
     """
     listeningPort = None
     deviceDict = {}
+    contextDict = {}
+    DIAGNOSTIC_STATES = (("diagPackets", "Packets received"),
+                         ("diagParseMicros", "Mean parse time (us)"),
+                         ("diagAssociateMicros", "Mean associate time (us)"),
+                         ("diagAssociateP99Micros", "99th percentile associate time (us)"),
+                         ("diagQueueDepth", "Packets waiting ahead of this Owl's in the pipeline"),
+                         ("diagLostPackets", "V2 packets lost, from timestamp gaps"),
+                         ("diagKernelDrops", "Datagrams dropped by the kernel"))
     
     ########################################
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
@@ -51,6 +74,23 @@ class Plugin(indigo.PluginBase):
         self.deviceList = []
         self.configRead = False
         self.mylogger = indigoPluginUtils.logger(self)
+        self.owl = None
+        self.engine = "threads"
+        self.queueDepth = 100
+        self.queueOverflowPolicy = "dropOldest"
+        self.shardCount = 4
+        self.metricsSink = None
+        self.archive = None
+        self.database = None
+        self.rollups = None
+        self.capture = None
+        self.stageTimer = None
+        self.receiveBuffer = 0
+        self.interfaces = []
+        self.writer = None
+        self.duplicateWindow = 10.0
+        self.ackMode = "packet"
+        self.ackWindow = 0.5
 
     def __del__(self):
         indigo.PluginBase.__del__(self)
@@ -58,11 +98,27 @@ class Plugin(indigo.PluginBase):
     ########################################
     def startup(self):
         self.mylogger.log(4, u"startup called")
+        # send log messages to Indigo from a background thread from now on
+        self.mylogger.startWriter()
+        # & write the file sinks from another, so their writes never hold up the receive loop
+        self.writer = TimerThread(self.mylogger, "NetworkOwl-writer")
+        self.writer.timers.callEvery(MetricsSink.FLUSH_INTERVAL, self.flushMetrics)
+        self.writer.timers.callEvery(HistoryArchive.FLUSH_INTERVAL, self.flushArchive)
+        self.writer.timers.callEvery(CaptureWriter.FLUSH_INTERVAL, self.flushCapture)
+        self.writer.start()
         self.configRead = self.getConfiguration(self.pluginPrefs)
 
     ########################################
     def shutdown(self):                     # called after runConcurrentThread() exits
         self.mylogger.log(4, u"shutdown called")
+        if self.writer != None:
+            self.writer.stop()
+            self.writer = None
+        self.setMetricsSink(None)
+        self.setArchive(None)
+        self.setDatabase(None)
+        self.setCapture(None)
+        self.mylogger.stopWriter()
              
     ########################################
     def getConfiguration(self, valuesDict):
@@ -72,8 +128,241 @@ class Plugin(indigo.PluginBase):
 
         self.mylogger.log(3, u"getConfiguration start")
 
+        # listener engine: threaded pipeline, worker shards or single-threaded event loop
+        self.engine = valuesDict.get("engine", "threads")
+        
+        # pipeline queue settings
+        try:
+            self.queueDepth = int(valuesDict.get("queueDepth", 100))
+        except ValueError:
+            self.queueDepth = 100
+        self.queueOverflowPolicy = valuesDict.get("queueOverflowPolicy", "dropOldest")
+
+        # worker threads for the shards engine - read when the listener starts
+        try:
+            self.shardCount = int(valuesDict.get("shardCount", 4))
+        except ValueError:
+            self.shardCount = 4
+        
+        if self.owl != None and self.owl.pipeline != None:
+            self.owl.pipeline.configure(self.queueDepth, self.queueOverflowPolicy)
+
+        # interfaces to listen on, all if none - read when the listener starts
+        try:
+            self.interfaces = NetworkOwl.parseInterfaces(valuesDict.get("interfaces", ""))
+        except ValueError:
+            self.interfaces = []
+
+        # socket receive buffer, 0 for the system default
+        try:
+            receiveBuffer = max(0, int(valuesDict.get("receiveBuffer", 0))) * 1024
+        except ValueError:
+            receiveBuffer = 0
+        if receiveBuffer != self.receiveBuffer:
+            self.receiveBuffer = receiveBuffer
+            if self.owl != None:
+                self.owl.configureReceiveBuffer(receiveBuffer)
+
+        # repeats of a recent datagram within this many seconds are skipped
+        try:
+            self.duplicateWindow = max(0.0, float(valuesDict.get("duplicateWindow", 10)))
+        except ValueError:
+            self.duplicateWindow = 10.0
+
+        # when to acknowledge datagrams
+        self.ackMode = valuesDict.get("ackMode", "packet")
+        try:
+            self.ackWindow = max(0.0, float(valuesDict.get("ackWindow", 0.5)))
+        except ValueError:
+            self.ackWindow = 0.5
+
+        if self.owl != None:
+            self.owl.duplicates.configure(self.duplicateWindow)
+            self.owl.acks.configure(self.ackMode, self.ackWindow)
+
+        # packet metrics: one record per packet to a file, or to the log
+        sink = None
+        if valuesDict.get("metricsOutput", "log") == "file":
+            path = valuesDict.get("metricsFile", "") or MetricsSink.DEFAULT_PATH
+            try:
+                sampleEvery = int(valuesDict.get("metricsSampleEvery", 1))
+            except ValueError:
+                sampleEvery = 1
+            sink = MetricsSink(os.path.expanduser(path), valuesDict.get("metricsFormat", "kv"), sampleEvery)
+        if sink == None or self.metricsSink == None or sink.settings() != self.metricsSink.settings():
+            self.setMetricsSink(sink)
+
+        # binary history of every reading, one file per Owl
+        directory = None
+        if valuesDict.get("archiveHistory", False):
+            directory = os.path.expanduser(valuesDict.get("archiveDirectory", "") or HistoryArchive.DEFAULT_DIRECTORY)
+        if directory == None or self.archive == None or directory != self.archive.directory:
+            self.setArchive(HistoryArchive(directory, self.mylogger) if directory != None else None)
+
+        # SQLite history, written in batches from its own thread
+        database = None
+        if valuesDict.get("databaseHistory", False):
+            path = os.path.expanduser(valuesDict.get("databaseFile", "") or SQLiteSink.DEFAULT_PATH)
+            try:
+                batchRows = int(valuesDict.get("databaseBatchRows", 500))
+                batchSeconds = float(valuesDict.get("databaseBatchSeconds", 5))
+            except ValueError:
+                batchRows, batchSeconds = 500, 5.0
+            database = SQLiteSink(path, batchRows, batchSeconds, self.mylogger)
+        if database == None or self.database == None or database.settings() != self.database.settings():
+            if database != None:
+                database.start()
+            self.setDatabase(database)
+
+        # 1 min, 15 min, hourly & daily rollups, sent to the sinks above as each closes
+        if valuesDict.get("rollupHistory", False):
+            if self.rollups == None:
+                self.rollups = RollupEngine(self.emitRollups)
+        else:
+            self.rollups = None
+
+        # raw datagrams, for replaying through the plugin later
+        path = None
+        if valuesDict.get("captureDatagrams", False):
+            path = os.path.expanduser(valuesDict.get("captureFile", "") or CaptureWriter.DEFAULT_PATH)
+        if path == None or self.capture == None or path != self.capture.path:
+            self.setCapture(CaptureWriter(path) if path != None else None)
+
+        # per-stage timings, for the Log Performance Statistics menu item & diagnostic states
+        if valuesDict.get("stageTiming", False):
+            if self.stageTimer == None:
+                self.stageTimer = StageTimer()
+        else:
+            self.stageTimer = None
+
         return True
 
+    ########################################
+    def inBackground(self, fn, *args):
+        """Run fn(*args) on the writer thread if it's running, otherwise now - so
+        file writes never hold up the receive loop, which reads the config."""
+        if self.writer != None:
+            self.writer.callSoon(fn, *args)
+        else:
+            fn(*args)
+
+    ########################################
+    def setMetricsSink(self, sink):
+        """Replace the metrics sink, writing out anything the old one still holds."""
+        if sink != None and self.writer != None:
+            sink.onFull = functools.partial(self.writer.callSoon, self.flushMetrics)
+        oldSink, self.metricsSink = self.metricsSink, sink
+        if oldSink != None:
+            self.inBackground(self.closeMetricsSink, oldSink)
+
+    ########################################
+    def closeMetricsSink(self, sink):
+        try:
+            sink.close()
+        except (IOError, OSError), e:
+            self.mylogger.logError(u"NetworkOwl: failed to write metrics to %s: %s" % (sink.path, e))
+
+    ########################################
+    def setArchive(self, archive):
+        """Replace the history archive, writing out anything the old one still holds."""
+        if archive != None and self.writer != None:
+            archive.onFull = functools.partial(self.writer.callSoon, self.flushArchive)
+        oldArchive, self.archive = self.archive, archive
+        if oldArchive != None:
+            self.inBackground(self.closeArchive, oldArchive)
+
+    ########################################
+    def closeArchive(self, archive):
+        try:
+            archive.close()
+        except (IOError, OSError), e:
+            self.mylogger.logError(u"NetworkOwl: failed to write history to %s: %s" % (archive.directory, e))
+
+    ########################################
+    def setDatabase(self, database):
+        """Replace the SQLite sink, committing anything the old one still holds."""
+        oldDatabase, self.database = self.database, database
+        if oldDatabase != None:
+            self.inBackground(oldDatabase.close)
+
+    ########################################
+    def setCapture(self, capture):
+        """Replace the datagram capture, writing out anything the old one still holds."""
+        oldCapture, self.capture = self.capture, capture
+        if oldCapture != None:
+            self.inBackground(self.closeCapture, oldCapture)
+
+    ########################################
+    def closeCapture(self, capture):
+        try:
+            capture.close()
+        except (IOError, OSError), e:
+            self.mylogger.logError(u"NetworkOwl: failed to write capture to %s: %s" % (capture.path, e))
+
+    ########################################
+    def emitRollups(self, buckets):
+        """Send closed rollup buckets to the history sinks configured."""
+        database = self.database
+        if database != None:
+            database.appendRollups(buckets)
+        sink = self.metricsSink
+        if sink != None:
+            sink.recordRollups(buckets)
+        elif database == None and self.mylogger.isEnabledFor(3):
+            for bucket in buckets:
+                self.mylogger.log(3, "NetworkOwl: rollup %s", formatKeyValues([("mac", bucket.mac)] + bucket.fields()))
+
+    ########################################
+    def closeRollups(self):
+        """Timer callback: close the rollup buckets whose period has ended."""
+        if self.rollups != None:
+            self.rollups.closeDue()
+
+    ########################################
+    def flushArchive(self):
+        """Timer callback: write the buffered history records to each Owl's history file."""
+        if self.archive != None:
+            self.archive.flush()
+
+    ########################################
+    def flushCapture(self):
+        """Timer callback: write the buffered datagrams to the capture file."""
+        if self.capture != None:
+            self.capture.flush()
+
+    ########################################
+    def publishDiagnostics(self):
+        """Timer callback: publish the stage timings to the devices showing diagnostic states."""
+        timer = self.stageTimer
+        if timer == None:
+            return
+        parse = timer.totals('parse')
+        associate = timer.totals('associate')
+        owl = self.owl
+        pipeline = None
+        drops = None
+        lost = {}
+        if owl != None:
+            pipeline = owl.pipeline
+            drops = owl.kernelDropCount()
+            lost = owl.gaps.missed
+        for context in self.contextDict.values():
+            if context.device.pluginProps.get("diagnosticStates", False):
+                context.publisher.publish([
+                    ("diagPackets", context.packetCount),
+                    ("diagParseMicros", round(parse.mean() * 1e6, 1)),
+                    ("diagAssociateMicros", round(associate.mean() * 1e6, 1)),
+                    ("diagAssociateP99Micros", round(associate.percentile(0.99) * 1e6, 1)),
+                    ("diagQueueDepth", pipeline.depthFor(context.mac_address) if pipeline != None else 0),
+                    ("diagLostPackets", lost.get(context.mac_address, 0)),
+                    ("diagKernelDrops", drops if drops != None else 0)])
+
+    ########################################
+    def flushMetrics(self):
+        """Timer callback: write the buffered metrics records to the metrics file."""
+        if self.metricsSink != None:
+            self.metricsSink.flush()
+
         
     ########################################
     def deviceStartComm(self, dev):
@@ -97,38 +386,73 @@ class Plugin(indigo.PluginBase):
         if macAddress not in self.deviceDict:
             self.deviceDict[macAddress] = dev
             
-        # get OWL type from props
+        # get OWL type from props & stash it with everything else packets need
+        # from the device, so they don't have to look any of it up
         owlType = dev.pluginProps["owlType"]
         self.mylogger.log(3, "Owl Type: %s" % owlType)
-        
+        publisher = StatePublisher(dev, PublishPolicy.fromProps(dev.pluginProps))
+        self.contextDict[macAddress] = DeviceContext(macAddress, dev, owlType, publisher, self.deviceHistory(dev))
           
-        # reset device states
-        dev.updateStateOnServer("networkOwlId", macAddress)
-        dev.updateStateOnServer("genWattsNow", '0')
-        dev.updateStateOnServer("expWattsNow", '0')
-        dev.updateStateOnServer("genWattsToday", '0')
-        dev.updateStateOnServer("expWattsToday", '0')
-        dev.updateStateOnServer("signalStrength", '0')
-        dev.updateStateOnServer("signalQuality", '0')
-        dev.updateStateOnServer("batteryLevel", '0')
-        dev.updateStateOnServer("usedWattsNow", '0')
-        dev.updateStateOnServer("usedWattsToday", '0')
-        dev.updateStateOnServer("weatherCode", '0')
-        dev.updateStateOnServer("temperature", '0')
-        dev.updateStateOnServer("weatherText", '')
-        dev.updateStateOnServer("lastUpdated", '')
-        dev.updateStateOnServer("usedWattsNowPh1", '0')
-        dev.updateStateOnServer("usedWattsTodayPh1", '0')
-        dev.updateStateOnServer("usedWattsNowPh2", '0')
-        dev.updateStateOnServer("usedWattsTodayPh2", '0')
-        dev.updateStateOnServer("usedWattsNowPh3", '0')
-        dev.updateStateOnServer("usedWattsTodayPh3", '0')
-        dev.updateStateOnServer("networkOwlType", owlType)
-        dev.updateStateOnServer("hotWaterTemp", "0")
-        dev.updateStateOnServer("hotWaterTempSetPoint", "0")
-        dev.updateStateOnServer("heatingTemp", "0")
-        dev.updateStateOnServer("heatingTempSetPoint", "0")
-            
+        # reset device states in a single server call & record them as the
+        # values last published, so packets only send states that change
+        publisher.publish([
+            ("networkOwlId", macAddress),
+            ("genWattsNow", 0),
+            ("expWattsNow", 0),
+            ("genWattsToday", 0.0),
+            ("expWattsToday", 0.0),
+            ("signalStrength", 0),
+            ("signalQuality", 0),
+            ("batteryLevel", 0),
+            ("usedWattsNow", 0),
+            ("usedWattsToday", 0.0),
+            ("weatherCode", 0),
+            ("temperature", 0.0),
+            ("weatherText", ''),
+            ("lastUpdated", ''),
+            ("usedWattsNowPh1", 0),
+            ("usedWattsTodayPh1", 0.0),
+            ("usedWattsNowPh2", 0),
+            ("usedWattsTodayPh2", 0.0),
+            ("usedWattsNowPh3", 0),
+            ("usedWattsTodayPh3", 0.0),
+            ("networkOwlType", owlType),
+            ("hotWaterTemp", 0.0),
+            ("hotWaterTempSetPoint", 0.0),
+            ("heatingTemp", 0.0),
+            ("heatingTempSetPoint", 0.0)], force=True)
+        self.rebalancePipeline()
+
+    ########################################
+    def deviceHistory(self, dev):
+        """DeviceHistory for the rolling statistics windows set in the device's props, or None."""
+        try:
+            windows = DeviceHistory.parseWindows(dev.pluginProps.get("statsWindows", ""))
+            capacity = int(dev.pluginProps.get("statsSamples", 360) or 360)
+        except ValueError:
+            self.mylogger.logError(u"NetworkOwl: ignoring bad rolling statistics settings for %s" % dev.name)
+            return None
+        if not windows:
+            return None
+        return DeviceHistory(DeviceContext.stateIds(dev.pluginProps.get("owlType")), windows, capacity)
+
+    ########################################
+    def getDeviceStateList(self, dev):
+        """States from Devices.xml plus the rolling statistics states for the device's windows."""
+        stateList = indigo.PluginBase.getDeviceStateList(self, dev)
+        try:
+            windows = DeviceHistory.parseWindows(dev.pluginProps.get("statsWindows", ""))
+        except ValueError:
+            windows = []
+        if windows and stateList != None:
+            stateIds = DeviceContext.stateIds(dev.pluginProps.get("owlType"))
+            for stateId, label in DeviceHistory.derivedStateIds(stateIds, windows):
+                stateList.append(self.getDeviceStateDictForNumberType(stateId, label, label))
+        if dev.pluginProps.get("diagnosticStates", False) and stateList != None:
+            for stateId, label in Plugin.DIAGNOSTIC_STATES:
+                stateList.append(self.getDeviceStateDictForNumberType(stateId, label, label))
+        return stateList
+
     ########################################
     def deviceStopComm(self, dev):
         """Device stopping so clean up & remove stored references to it."""
@@ -143,6 +467,20 @@ class Plugin(indigo.PluginBase):
                     
         if macAddress in self.deviceDict:
             del self.deviceDict[macAddress]
+        if macAddress in self.contextDict:
+            del self.contextDict[macAddress]
+        if self.rollups != None:
+            self.rollups.forget(macAddress)
+        if self.owl != None:
+            self.owl.gaps.forget(macAddress)
+        self.rebalancePipeline()
+
+    ########################################
+    def rebalancePipeline(self):
+        """Share the Owls with devices out across the pipeline's worker shards."""
+        owl = self.owl
+        if owl != None and owl.pipeline != None:
+            owl.pipeline.rebalance(self.contextDict.keys())
 
     
     ########################################
@@ -166,19 +504,41 @@ class Plugin(indigo.PluginBase):
             indigo.server.log("NetworkOwl: starting listener on port %d" % (NetworkOwl.MULTICAST_PORT,))
 
             owl = NetworkOwl(self)
+            self.owl = owl
+            owl.timers.callEvery(RollupEngine.CLOSE_INTERVAL, self.closeRollups)
+            owl.timers.callEvery(StageTimer.PUBLISH_INTERVAL, self.publishDiagnostics)
+            owl.timers.callEvery(NetworkOwl.DROP_CHECK_INTERVAL, owl.checkDrops)
+            owl.duplicates.configure(self.duplicateWindow)
+            owl.acks.configure(self.ackMode, self.ackWindow)
             
             self.checkConfig()
             
-            sock = owl.startProtocol()
-            if sock != None:
-                # successfully joined multicast group, now listen for messages
-                owl.runProtocol(sock)
+            if self.engine == "eventLoop":
+                # receive, ack, parse & publish all from an event loop on this thread
+                if not owl.runEventLoop(self.interfaces):
+                    self.mylogger.logError(u"NetworkOwl plugin failed to join multicast group")
             else:
-                self.mylogger.logError(u"NetworkOwl plugin failed to join multicast group")
+                socks = owl.startProtocols(self.interfaces)
+                if socks:
+                    # successfully joined multicast group, parse & publish on their
+                    # own threads & listen for messages on every interface on this one
+                    owl.startPipeline(self.queueDepth, self.queueOverflowPolicy,
+                                      self.shardCount if self.engine == "shards" else 0)
+                    owl.runProtocol(*socks)
+                else:
+                    self.mylogger.logError(u"NetworkOwl plugin failed to join multicast group")
 
         except self.StopThread:
                 # Optionally catch the StopThread exception and do any needed cleanup.
                 pass
+                
+        finally:
+            if self.owl != None:
+                self.owl.stopPipeline()
+                self.mylogger.log(3, "NetworkOwl: %s", self.owl.duplicates.summary())
+                self.mylogger.log(3, "NetworkOwl: %s", self.owl.acks.summary())
+                self.mylogger.log(3, "NetworkOwl: %s", self.owl.dropSummary())
+                self.owl = None
 
     ########################################
     def stopConcurrentThread(self):
@@ -187,17 +547,65 @@ class Plugin(indigo.PluginBase):
         """ 
         indigo.PluginBase.stopConcurrentThread(self)
 
+    ########################################
+    def dumpStats(self):
+        """Menu item: log the stage timings & the listener's counters."""
+        timer = self.stageTimer
+        if timer == None:
+            indigo.server.log(u"NetworkOwl: stage timing is off: turn on 'Time each stage' in the plugin config")
+        else:
+            indigo.server.log(u"NetworkOwl: stage timings since %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timer.started)))
+            for line in timer.table():
+                indigo.server.log(line)
+        owl = self.owl
+        if owl != None:
+            indigo.server.log(u"NetworkOwl: %d datagrams received, %d truncated" % (owl.packetCount, owl.truncatedCount))
+            for line in owl.interfaceSummary():
+                indigo.server.log(u"NetworkOwl: %s" % line)
+            if owl.pipeline != None:
+                indigo.server.log(u"NetworkOwl: %s" % owl.pipeline.summary())
+            indigo.server.log(u"NetworkOwl: %s" % owl.duplicates.summary())
+            indigo.server.log(u"NetworkOwl: %s" % owl.acks.summary())
+            indigo.server.log(u"NetworkOwl: %s" % owl.dropSummary())
+
+    ########################################
+    def resetStats(self):
+        """Menu item: start the stage timings afresh."""
+        if self.stageTimer != None:
+            self.stageTimer.reset()
+            indigo.server.log(u"NetworkOwl: stage timings reset")
+
     ########################################
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
-        """Validate MAC address provided by user - at present only checks if right length."""
+        """Validate MAC address provided by user - at present only checks if right length.
+        Also checks the publishing deadbands & intervals are numbers."""
         networkOwlID = str(valuesDict["address"])
         if len(networkOwlID)!= 12:
             self.mylogger.logError(u"NetworkOWL ID \"%s\" must be 12 digits long" % networkOwlID)
             errorDict = indigo.Dict()
             errorDict["address"] = "The value of this field must be 12 digits long"
             return (False, valuesDict, errorDict)
-        else:
-            return True
+            
+        errorDict = indigo.Dict()
+        for key in ("powerDeadband", "energyDeadband", "tempDeadband", "minPublishInterval", "maxStaleness"):
+            try:
+                if float(valuesDict.get(key, "0") or "0") < 0:
+                    raise ValueError
+            except ValueError:
+                errorDict[key] = "The value of this field must be a number, 0 or more"
+        try:
+            DeviceHistory.parseWindows(valuesDict.get("statsWindows", ""))
+        except ValueError:
+            errorDict["statsWindows"] = "The windows must be whole numbers of minutes separated by commas"
+        try:
+            if int(valuesDict.get("statsSamples", "360") or "360") < 2:
+                raise ValueError
+        except ValueError:
+            errorDict["statsSamples"] = "The value of this field must be a whole number, 2 or more"
+        if len(errorDict) > 0:
+            return (False, valuesDict, errorDict)
+            
+        return True
 
 ########################################
     # Validate the pluginConfig window after user hits OK
@@ -206,6 +614,67 @@ class Plugin(indigo.PluginBase):
     def validatePrefsConfigUi(self, valuesDict):
         self.mylogger.log(3, u"validating Prefs called")
         errorMsgDict = indigo.Dict()
+        
+        try:
+            queueDepth = int(valuesDict.get("queueDepth", 100))
+        except ValueError:
+            queueDepth = 0
+        if queueDepth < 1:
+            errorMsgDict["queueDepth"] = "The queue depth must be a whole number greater than 0"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            shardCount = int(valuesDict.get("shardCount", 4))
+        except ValueError:
+            shardCount = 0
+        if shardCount < 1:
+            errorMsgDict["shardCount"] = "The number of worker threads must be a whole number greater than 0"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            NetworkOwl.parseInterfaces(valuesDict.get("interfaces", ""))
+        except ValueError:
+            errorMsgDict["interfaces"] = "List the IPv4 addresses of the interfaces separated by commas, or leave blank for all"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            receiveBuffer = int(valuesDict.get("receiveBuffer", 0))
+        except ValueError:
+            receiveBuffer = -1
+        if receiveBuffer < 0:
+            errorMsgDict["receiveBuffer"] = "The receive buffer must be a whole number of KB, 0 or more"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            duplicateWindow = float(valuesDict.get("duplicateWindow", 10))
+        except ValueError:
+            duplicateWindow = -1
+        if duplicateWindow < 0:
+            errorMsgDict["duplicateWindow"] = "The duplicate window must be a number of seconds, 0 or more"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            ackWindow = float(valuesDict.get("ackWindow", 0.5))
+        except ValueError:
+            ackWindow = -1
+        if ackWindow < 0:
+            errorMsgDict["ackWindow"] = "The ack window must be a number of seconds, 0 or more"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            if int(valuesDict.get("databaseBatchRows", 500)) < 1 or float(valuesDict.get("databaseBatchSeconds", 5)) <= 0:
+                raise ValueError
+        except ValueError:
+            errorMsgDict["databaseBatchRows"] = "Rows & seconds per transaction must both be more than 0"
+            return (False, valuesDict, errorMsgDict)
+
+        try:
+            sampleEvery = int(valuesDict.get("metricsSampleEvery", 1))
+        except ValueError:
+            sampleEvery = 0
+        if sampleEvery < 1:
+            errorMsgDict["metricsSampleEvery"] = "Record 1 packet in every N: N must be a whole number greater than 0"
+            return (False, valuesDict, errorMsgDict)
 
         # Tell plugin to reread it's config
         self.configRead = False
@@ -215,8 +684,14 @@ class Plugin(indigo.PluginBase):
         
     ########################################
     def checkConfig(self):
-        self.mylogger.log(4, u"checkConfig called")
+        """Re-read the config if validatePrefsConfigUi has flagged a change.
+        
+        Cheap enough to call on every wakeup of the receive loop - the config
+        is only re-read when the configRead flag has been cleared.
+        
+        """
         if self.configRead is False:
+            self.mylogger.log(4, u"checkConfig: config changed, re-reading")
             if self.getConfiguration(self.pluginPrefs) is True:
                 self.configRead = True
 
@@ -3,7 +3,8 @@
 #
 # v0.2 Nick 28 March 2016
 
-from NetworkOwl import NetworkOwl
+from NetworkOwl import NetworkOwl, DeviceContext
+from OwlPublisher import StatePublisher
 
 # constants
 # set DEBUG to True to see debugging messages in the log
@@ -47,24 +48,40 @@ class logger(object):
 		elif oldLevel != self.logLevel:
 			self.log(1, "Log level preferences changed to \"%s\"." % kLogLevelList[self.logLevel])
 
-	def log(self, level, logMsg):
+	def isEnabledFor(self, level):
+		return level <= self.logLevel
+
+	def log(self, level, logMsg, *args):
 		if level <= self.logLevel:
+			if args:
+				logMsg = logMsg % args
 			if level < 3:
 				print logMsg
 			else:
 				print "debug: %s" % logMsg
 
-	def logError(self, logMsg):
+	def logError(self, logMsg, *args):
+		if args:
+			logMsg = logMsg % args
 		print "error: %s" % logMsg
 
 
 class testHarness:
     deviceDict = {}
+    contextDict = {}
+    metricsSink = None
+    archive = None
+    database = None
+    rollups = None
+    capture = None
+    stageTimer = None
+    receiveBuffer = 0
     stopThread = False;
 
     def __init__(self, address, owlType):
         dev = dummyDevice(address, owlType)
         self.deviceDict[address] = dev
+        self.contextDict[address] = DeviceContext(address, dev, owlType, StatePublisher(dev))
         self.mylogger = logger(self)
         
     def checkConfig(self):
@@ -0,0 +1,274 @@
+# synthetic NetworkOwl load generator, for stress testing the listener
+# sends Owl datagrams for many simulated MAC addresses to the multicast group
+# (or any host:port, e.g. loopback), counting the acks the plugin sends back
+# as a real gateway would receive them
+#
+# with --local it also runs the plugin's listener - socket thread, parser &
+# publisher, worker shards with --shards, or the event loop with --engine
+# eventLoop - in this process against the stub plugin, & reports how many
+# datagrams were received, dropped & published, so drop rates can be measured
+# with no Owl & no Indigo
+#
+# --sockets N sends to N consecutive ports from host:port, each with its own
+# listening socket, so the listener serves several sockets at once; each Owl's
+# packets handled are checked against those sent, so any mixed up between
+# sockets show as mismatched Owls
+#
+#   python loadGenerator.py --local --macs 300 --rate 2000 --duration 10
+#   python loadGenerator.py --local --macs 300 --rate 2000 --shards 4
+#   python loadGenerator.py --local --target 127.0.0.1:22600 --sockets 2 --engine eventLoop --burst 200
+#   python loadGenerator.py --target 127.0.0.1:22600 --rate 500 --burst 50
+#   python loadGenerator.py --mix electricity_v2=3,solar=1 --rate 100 --ramp-to 5000
+#
+# packet values are jittered & V2 timestamps kept current, so the plugin's
+# duplicate filter doesn't skip them
+
+import re
+import time
+import random
+import select
+import socket
+import argparse
+import threading
+import collections
+
+from owlStubs import StubPlugin, NetworkOwl
+from OwlReactor import OwlReactor, OwlDatagramProtocol
+from samplePackets import SAMPLE_PACKETS, SAMPLE_ORDER
+
+DEFAULT_MIX = "electricity_v2=3,solar=1,weather=1,heating_v2=1,hot_water_v2=1"
+MAC_PREFIX = 0x443719000000
+
+READING = re.compile(r">(\d+)\.(\d\d)<")
+TIMESTAMP = re.compile(r"<timestamp>\d+</timestamp>")
+
+
+def parseMix(text):
+    """(shape, weight) pairs from a list such as 'electricity_v2=3,solar=1'."""
+    mix = []
+    for item in text.split(","):
+        name, sep, weight = item.strip().partition("=")
+        if name not in SAMPLE_PACKETS:
+            raise argparse.ArgumentTypeError("unknown packet shape %s: use one of %s" % (name, ", ".join(SAMPLE_ORDER)))
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def parseTarget(text):
+    """(host, port) from 'multicast', 'host' or 'host:port'."""
+    if text == "multicast":
+        return (NetworkOwl.MULTICAST_GROUP, NetworkOwl.MULTICAST_PORT)
+    host, sep, port = text.partition(":")
+    return (host, int(port or NetworkOwl.MULTICAST_PORT))
+
+
+class Gateways(object):
+    """The sending sockets, each standing in for a gateway, & a thread
+    receiving the plugin's unicast acks on them."""
+
+    def __init__(self, count, targets):
+        self.targets = targets
+        self.sockets = []
+        for index in xrange(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            sock.bind(('', 0))
+            sock.setblocking(0)
+            self.sockets.append(sock)
+        self.sentCount = 0
+        self.failedCount = 0
+        self.macCounts = collections.Counter()
+        self.ackCount = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.receiveAcks, name="loadGenerator-acks")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, index, mac, datagram):
+        """Send a datagram from mac, to each target in turn."""
+        try:
+            self.sockets[index % len(self.sockets)].sendto(datagram, self.targets[self.sentCount % len(self.targets)])
+            self.sentCount += 1
+            self.macCounts[mac] += 1
+        except socket.error:
+            # e.g. ENOBUFS when sending faster than the interface can take
+            self.failedCount += 1
+
+    def receiveAcks(self):
+        while self.running:
+            readable, writable, errored = select.select(self.sockets, [], [], 0.2)
+            for sock in readable:
+                while True:
+                    try:
+                        sock.recvfrom(64)
+                    except socket.error:
+                        break
+                    self.ackCount += 1
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+class LocalListener(object):
+    """The plugin's threaded listener or event loop, run in this process on the
+    stub plugin."""
+
+    def __init__(self, targets, macs, engine, depth, policy, receiveBuffer, interfaces, shards):
+        self.plugin = StubPlugin(quiet=True)
+        self.plugin.receiveBuffer = receiveBuffer
+        for mac in macs:
+            self.plugin.addDevice(mac, "pv")
+        self.owl = NetworkOwl(self.plugin)
+        self.owl.duplicates.configure(10.0)
+        if targets[0][0] == NetworkOwl.MULTICAST_GROUP:
+            self.socks = self.owl.startProtocols(interfaces)
+        else:
+            self.socks = []
+            for target in targets:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.owl.setReceiveBuffer(sock, receiveBuffer)
+                sock.bind(target)
+                sock.setblocking(0)
+                self.owl.addListener(sock, "%s:%d" % target)
+                self.socks.append(sock)
+        if not self.socks:
+            raise SystemExit("failed to join the multicast group")
+        if engine == "eventLoop":
+            reactor = OwlReactor(self.plugin, self.owl.timers)
+            for sock in self.socks:
+                reactor.addProtocol(OwlDatagramProtocol(self.owl, sock))
+            self.thread = threading.Thread(target=reactor.run, args=(NetworkOwl.SELECT_TIMEOUT,), name="loadGenerator-listener")
+        else:
+            self.owl.startPipeline(depth, policy, shards)
+            self.thread = threading.Thread(target=self.owl.runProtocol, args=self.socks, name="loadGenerator-listener")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, settle):
+        """Give the pipeline settle seconds to catch up, then stop the listener."""
+        pipeline = self.owl.pipeline
+        deadline = time.time() + settle
+        while time.time() < deadline and pipeline != None and pipeline.depth():
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.plugin.stopThread = True
+        self.thread.join()
+        stats = {"summary": pipeline.summary() if pipeline != None else "event loop: no queues"}
+        stats["handled"] = dict((mac, context.packetCount) for mac, context in self.plugin.contextDict.iteritems())
+        stats["drops"] = self.owl.dropSummary()
+        stats["interfaces"] = self.owl.interfaceSummary()
+        self.owl.stopPipeline()
+        for sock in self.socks:
+            sock.close()
+        return stats
+
+
+def makeDatagram(rng, name, mac):
+    """A sample packet of the given shape from mac, with its readings jittered."""
+    datagram = SAMPLE_PACKETS[name] % mac
+    datagram = READING.sub(lambda match: ">%.2f<" % (float(match.group(1) + "." + match.group(2)) * rng.uniform(0.9, 1.1)), datagram)
+    return TIMESTAMP.sub("<timestamp>%d</timestamp>" % time.time(), datagram)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    macs = ["%012X" % (MAC_PREFIX + index) for index in xrange(args.macs)]
+    names = [name for name, weight in args.mix]
+    weights = [weight for name, weight in args.mix]
+    total = sum(weights)
+
+    def pickShape():
+        point = rng.uniform(0, total)
+        for name, weight in zip(names, weights):
+            point -= weight
+            if point <= 0:
+                return name
+        return names[-1]
+
+    host, port = args.target
+    targets = [(host, port + index) for index in xrange(args.sockets)]
+    listener = LocalListener(targets, macs, args.engine, args.queue_depth, args.policy, args.receive_buffer * 1024,
+                             NetworkOwl.parseInterfaces(args.interfaces), args.shards) if args.local else None
+    gateways = Gateways(args.gateways, targets)
+
+    print "sending %s to %s:%d%s from %d MACs through %d gateway sockets" % (
+        ", ".join("%s %g" % item for item in args.mix), host, port,
+        " - %d" % (port + args.sockets - 1) if args.sockets > 1 else "", args.macs, args.gateways)
+
+    start = time.time()
+    due = start
+    while True:
+        now = time.time()
+        elapsed = now - start
+        if elapsed >= args.duration:
+            break
+        # ramp linearly from rate to ramp-to over the run, if asked
+        rate = args.rate + (args.ramp_to - args.rate) * elapsed / args.duration if args.ramp_to else args.rate
+        if now < due:
+            time.sleep(due - now)
+        for index in xrange(args.burst):
+            macIndex = rng.randrange(len(macs))
+            gateways.send(macIndex, macs[macIndex], makeDatagram(rng, pickShape(), macs[macIndex]))
+        due += args.burst / rate
+    sendTime = time.time() - start
+
+    stats = listener.stop(args.settle) if listener != None else None
+    time.sleep(0.2)
+    gateways.close()
+
+    sent = gateways.sentCount
+    print "sent %d datagrams in %.1fs (%.0f/s), %d failed to send" % (sent, sendTime, sent / sendTime, gateways.failedCount)
+    print "acks received %d (%.1f%%)" % (gateways.ackCount, 100.0 * gateways.ackCount / sent if sent else 0.0)
+    if listener != None:
+        owl = listener.owl
+        received = owl.packetCount
+        published = sum(stats["handled"].itervalues())
+        print "listener received %d, lost before the socket %d (%.1f%%), truncated %d" % (
+            received, sent - received, 100.0 * (sent - received) / sent if sent else 0.0, owl.truncatedCount)
+        print owl.duplicates.summary()
+        print stats["drops"]
+        for line in stats["interfaces"]:
+            print line[:160]
+        print stats["summary"]
+        if published == sent:
+            # nothing lost or dropped, so every Owl should have had exactly its own packets handled
+            mismatched = [mac for mac in macs if stats["handled"].get(mac, 0) != gateways.macCounts[mac]]
+            print "%d Owls had a different number of packets handled than were sent" % len(mismatched)
+        print "processed %d of %d sent (%.1f%% dropped), %d states published, %d errors" % (
+            published, sent, 100.0 * (sent - published) / sent if sent else 0.0,
+            listener.plugin.publishedCount(), listener.plugin.mylogger.errorCount)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send synthetic NetworkOwl traffic")
+    parser.add_argument("--target", type=parseTarget, default="multicast", help="'multicast' (the default) or host[:port]")
+    parser.add_argument("--macs", type=int, default=200, help="number of simulated Owls")
+    parser.add_argument("--gateways", type=int, default=1, help="sending sockets the Owls are spread across")
+    parser.add_argument("--mix", type=parseMix, default=DEFAULT_MIX, help="packet shapes & weights, e.g. %s" % DEFAULT_MIX)
+    parser.add_argument("--rate", type=float, default=200, help="datagrams per second")
+    parser.add_argument("--ramp-to", type=float, default=0, help="rate to ramp up to by the end of the run")
+    parser.add_argument("--burst", type=int, default=1, help="datagrams sent back to back each time")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send for")
+    parser.add_argument("--seed", type=int, default=1, help="random seed, for repeatable runs")
+    parser.add_argument("--local", action="store_true", help="run the plugin's listener in this process")
+    parser.add_argument("--queue-depth", type=int, default=100, help="pipeline queue depth of the local listener")
+    parser.add_argument("--engine", default="threads", choices=("threads", "eventLoop"), help="listener engine of the local listener")
+    parser.add_argument("--sockets", type=int, default=1, help="consecutive ports from the target port to send to, each with its own local listening socket")
+    parser.add_argument("--shards", type=int, default=0, help="worker shards of the local listener, 0 for a parser & a publisher")
+    parser.add_argument("--policy", default="dropOldest", help="pipeline overflow policy of the local listener")
+    parser.add_argument("--interfaces", default="", help="interface addresses the local listener joins the group on")
+    parser.add_argument("--receive-buffer", type=int, default=0, help="receive buffer of the local listener in KB, 0 for the default")
+    parser.add_argument("--settle", type=float, default=5, help="seconds the local listener has to catch up")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.burst < 1 or args.macs < 1 or args.gateways < 1 or args.sockets < 1:
+        parser.error("rate, burst, macs, gateways & sockets must be greater than 0")
+    if args.sockets > 1 and args.target[0] == NetworkOwl.MULTICAST_GROUP:
+        parser.error("--sockets needs a unicast target: use --interfaces to listen on several sockets for multicast")
+    run(args)
+
+if __name__ == "__main__":
+    main()
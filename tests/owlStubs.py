@@ -0,0 +1,95 @@
+# stub Indigo plugin & devices for driving NetworkOwl outside Indigo
+# shared by the capture replay, benchmark & load generator scripts
+#
+# the stub plugin carries every attribute the packet classes touch, with all
+# the history sinks off, & a device per Owl that just records its states
+
+import os
+import sys
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'NetworkOwl.indigoPlugin', 'Contents', 'Server Plugin')
+sys.path.insert(0, PLUGIN_DIR)
+
+from NetworkOwl import NetworkOwl, DeviceContext
+from OwlPublisher import StatePublisher
+
+
+class StubLogger(object):
+    """The plugin logger's interface, printing messages up to logLevel."""
+
+    def __init__(self, logLevel=0, quiet=False):
+        self.logLevel = logLevel
+        self.quiet = quiet
+        self.errorCount = 0
+
+    def isEnabledFor(self, level):
+        return level <= self.logLevel
+
+    def log(self, level, logMsg, *args):
+        if level <= self.logLevel:
+            print logMsg % args if args else logMsg
+
+    def logError(self, logMsg, *args):
+        self.errorCount += 1
+        if not self.quiet:
+            print "error: " + (logMsg % args if args else logMsg)
+
+
+class StubDevice(object):
+    """An Indigo device that keeps the states published to it."""
+
+    def __init__(self, address, owlType):
+        self.address = address
+        self.states = {"networkOwlType": owlType}
+        self.pluginProps = {"address": address}
+        self.updateCount = 0
+
+    def updateStatesOnServer(self, changes):
+        for change in changes:
+            self.states[change["key"]] = change["value"]
+        self.updateCount += 1
+
+    def updateStateOnServer(self, key, value):
+        self.states[key] = value
+        self.updateCount += 1
+
+
+class StubPlugin(object):
+    """The plugin attributes NetworkOwl & the packet classes use, with no
+    history sinks & no config to check."""
+
+    def __init__(self, logLevel=0, quiet=False):
+        self.deviceDict = {}
+        self.contextDict = {}
+        self.metricsSink = None
+        self.archive = None
+        self.database = None
+        self.rollups = None
+        self.capture = None
+        self.stageTimer = None
+        self.receiveBuffer = 0
+        self.stopThread = False
+        self.debug = False
+        self.mylogger = StubLogger(logLevel, quiet)
+
+    def addDevice(self, address, owlType):
+        """Create the device & context for the Owl with this MAC address."""
+        dev = StubDevice(address, owlType)
+        self.deviceDict[address] = dev
+        self.contextDict[address] = DeviceContext(address, dev, owlType, StatePublisher(dev))
+        return dev
+
+    def checkConfig(self):
+        pass
+
+    def publishedCount(self):
+        """Number of state values sent to the devices."""
+        return sum(context.publisher.sentCount for context in self.contextDict.itervalues())
+
+
+def percentile(ordered, fraction):
+    """Value at fraction (0 - 1) of the way through a sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
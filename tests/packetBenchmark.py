@@ -0,0 +1,145 @@
+# benchmark for NetworkOwl packet handling, parse & associate
+# runs each packet shape in samplePackets through the same steps as
+# NetworkOwl.processDataPacket against the stub plugin & device, & reports
+# throughput, p50 / p99 latency & objects left allocated per packet
+#
+# Python 2 keeps no count of allocations, so objs/pkt is the number of GC
+# tracked objects still alive per packet after it has been associated &
+# dropped - anything but 0 means packets are leaking into some cache
+#
+# every state is published for every packet (the publisher's record of the
+# values last sent is cleared between packets, outside the timings), so the
+# figures are for the worst case of all readings changing
+#
+# run from the tests directory:
+#   python packetBenchmark.py [--iterations N] [--owl-type pv|lc]
+#   python packetBenchmark.py --save              # record a baseline
+#   python packetBenchmark.py --tolerance 20      # compare with it
+#
+# exits 1 if any shape's p50 is more than tolerance % slower than the baseline
+#
+# the baseline is only meaningful on the machine that recorded it, so it's
+# kept out of git in packetBenchmark.baseline.json - or wherever --baseline says
+
+import os
+import gc
+import sys
+import json
+import argparse
+import timeit
+
+from owlStubs import StubPlugin, NetworkOwl, percentile
+from samplePackets import SAMPLE_PACKETS, SAMPLE_ORDER
+
+OWLADDR = '443719000492'
+ITERATIONS = 5000
+WARMUP = 200
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'packetBenchmark.baseline.json')
+
+clock = timeit.default_timer
+
+
+def benchmark(name, owlType, iterations):
+    """Time parse & associate of one packet shape.
+
+    Returns a dict of packets/sec, the parse, associate & total p50 and the
+    total p99 in microseconds, & GC tracked objects left per packet.
+
+    """
+    plugin = StubPlugin()
+    plugin.addDevice(OWLADDR, owlType)
+    owl = NetworkOwl(plugin)
+    shadow = plugin.contextDict[OWLADDR].publisher.shadow
+    datagram = SAMPLE_PACKETS[name] % OWLADDR
+
+    for index in xrange(WARMUP):
+        owl.processDataPacket(datagram)
+        shadow.clear()
+
+    parses = []
+    totals = []
+    gc.collect()
+    gc.disable()
+    try:
+        start = len(gc.get_objects())
+        for index in xrange(iterations):
+            began = clock()
+            packet = owl.parseDataPacket(datagram)
+            parsed = clock()
+            if packet != None:
+                packet.associate()
+            ended = clock()
+            parses.append(parsed - began)
+            totals.append(ended - began)
+            shadow.clear()
+        del packet
+        retained = len(gc.get_objects()) - start
+    finally:
+        gc.enable()
+
+    associates = sorted(total - parse for total, parse in zip(totals, parses))
+    parses.sort()
+    elapsed = sum(totals)
+    totals.sort()
+    return {
+        'rate': iterations / elapsed if elapsed > 0 else 0.0,
+        'parse_p50': percentile(parses, 0.5) * 1e6,
+        'associate_p50': percentile(associates, 0.5) * 1e6,
+        'p50': percentile(totals, 0.5) * 1e6,
+        'p99': percentile(totals, 0.99) * 1e6,
+        'objects': float(retained) / iterations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NetworkOwl packet handling")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS, help="packets timed per shape")
+    parser.add_argument("--owl-type", default="pv", choices=("pv", "lc"), help="type of the stub device")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="p50 slowdown allowed, in %%")
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        if baseline.get('owlType') != args.owl_type:
+            print "baseline was recorded for %s Owls, not compared" % baseline.get('owlType')
+            baseline = {}
+
+    print "%-16s %9s %9s %9s %9s %9s %8s %8s" % (
+        "packet", "pkts/s", "parse p50", "assoc p50", "p50 us", "p99 us", "objs/pkt", "vs base")
+
+    results = {}
+    regressions = []
+    for name in SAMPLE_ORDER:
+        result = benchmark(name, args.owl_type, args.iterations)
+        results[name] = result
+
+        change = ""
+        previous = baseline.get('results', {}).get(name)
+        if previous:
+            slower = 100.0 * (result['p50'] - previous['p50']) / previous['p50']
+            change = "%+7.0f%%" % slower
+            if slower > args.tolerance:
+                regressions.append(name)
+                change += " !"
+
+        print "%-16s %9.0f %9.1f %9.1f %9.1f %9.1f %8.2f %8s" % (
+            name, result['rate'], result['parse_p50'], result['associate_p50'],
+            result['p50'], result['p99'], result['objects'], change)
+
+    if args.save:
+        with open(args.baseline, 'w') as baselineFile:
+            json.dump({'owlType': args.owl_type, 'python': sys.version.split()[0], 'results': results},
+                      baselineFile, indent=1, sort_keys=True)
+        print "baseline saved to %s" % args.baseline
+    elif not baseline:
+        print "no baseline to compare with: record one with --save"
+    elif regressions:
+        print "slower than the baseline by more than %.0f%%: %s" % (args.tolerance, ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# benchmark for the NetworkOwl packet parser
+# times the single-pass fast path against the full ElementTree parse
+# for each packet shape
+#
+# run from the tests directory: python parserBenchmark.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'NetworkOwl.indigoPlugin', 'Contents', 'Server Plugin'))
+
+from OwlParser import OwlParser
+from NetworkOwl import PACKET_TYPES
+from samplePackets import SAMPLE_PACKETS, SAMPLE_ORDER
+
+OWLADDR = '443719000492'
+ITERATIONS = 20000
+
+
+def timePerPacket(fn, datagram, iterations):
+    """Best of 3 runs, in microseconds per packet."""
+    timer = timeit.Timer(lambda: fn(datagram))
+    return min(timer.repeat(3, iterations)) / iterations * 1e6
+
+
+def main():
+    iterations = ITERATIONS
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    parser = OwlParser(PACKET_TYPES)
+    print "%-16s %10s %10s %8s" % ("packet", "tree us", "fast us", "saving")
+
+    for name in SAMPLE_ORDER:
+        datagram = SAMPLE_PACKETS[name] % OWLADDR
+        if parser.fastParse(datagram) == None:
+            print "%-16s fast path does not recognise this packet" % name
+            continue
+
+        tree = timePerPacket(parser.treeParse, datagram, iterations)
+        fast = timePerPacket(parser.fastParse, datagram, iterations)
+        print "%-16s %10.2f %10.2f %7.0f%%" % (name, tree, fast, 100.0 * (tree - fast) / tree)
+
+if __name__ == "__main__":
+    main()
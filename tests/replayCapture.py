@@ -0,0 +1,112 @@
+# replay a NetworkOwl datagram capture through the plugin's packet handling
+# feeds each datagram to NetworkOwl.processDataPacket at the pace it arrived,
+# N times faster, or as fast as possible, against the stub plugin & a stub
+# device for every Owl in the capture, then reports packets/sec & the time
+# taken by each packet
+#
+# capture real traffic with the plugin's 'Capture datagrams' option, or make
+# one from the sample packets:
+#
+#   python replayCapture.py --make sample.owlc [--count 1000]
+#   python replayCapture.py sample.owlc [--speed 10] [--owl-type pv] [--stages]
+#
+# --speed 1 replays in real time, 0 (the default) as fast as possible
+# --stages also prints the plugin's own per-stage timings
+
+import time
+import argparse
+import collections
+
+from owlStubs import StubPlugin, NetworkOwl, percentile
+from OwlCapture import readCapture, writeCapture
+from OwlStats import StageTimer
+from samplePackets import SAMPLE_PACKETS, SAMPLE_ORDER
+
+OWLADDR = '443719000492'
+GATEWAY = ('192.168.1.50', NetworkOwl.MULTICAST_PORT)
+
+
+def makeCapture(path, count, interval):
+    """Write a capture of count sample packets, one every interval seconds."""
+    start = time.time()
+    datagrams = [(start + index * interval, GATEWAY, SAMPLE_PACKETS[SAMPLE_ORDER[index % len(SAMPLE_ORDER)]] % OWLADDR)
+                 for index in xrange(count)]
+    writeCapture(path, datagrams)
+    print "wrote %d datagrams to %s" % (count, path)
+
+
+def replay(path, speed, owlType, verbose, stages=False):
+    """Replay a capture, returning (packets/sec, latencies in seconds, tag counts,
+    most seconds behind the capture's pace, stub plugin)."""
+    datagrams = list(readCapture(path))
+    plugin = StubPlugin(logLevel=3 if verbose else 0, quiet=not verbose)
+    if stages:
+        plugin.stageTimer = StageTimer()
+    owl = NetworkOwl(plugin)
+
+    tags = collections.Counter()
+    for when, address, datagram in datagrams:
+        tag, mac = owl.parser.header(datagram)
+        tags[tag] += 1
+        if mac != None and mac not in plugin.contextDict:
+            plugin.addDevice(mac, owlType)
+
+    latencies = []
+    lag = 0.0
+    if not datagrams:
+        return 0.0, latencies, tags, lag, plugin
+
+    first = datagrams[0][0]
+    start = time.time()
+    for when, address, datagram in datagrams:
+        if speed > 0:
+            due = start + (when - first) / speed
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                lag = max(lag, -wait)
+        began = time.time()
+        owl.processDataPacket(datagram)
+        latencies.append(time.time() - began)
+    elapsed = time.time() - start
+
+    return len(datagrams) / elapsed if elapsed > 0 else 0.0, latencies, tags, lag, plugin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a NetworkOwl datagram capture")
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed: 1 is real time, 0 as fast as possible")
+    parser.add_argument("--owl-type", default="pv", choices=("pv", "lc"), help="type of the stub devices")
+    parser.add_argument("--verbose", action="store_true", help="show the plugin's log messages")
+    parser.add_argument("--stages", action="store_true", help="show the plugin's per-stage timings")
+    parser.add_argument("--make", action="store_true", help="write a capture of sample packets instead")
+    parser.add_argument("--count", type=int, default=1000, help="packets in a sample capture")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between sample packets")
+    args = parser.parse_args()
+
+    if args.make:
+        makeCapture(args.capture, args.count, args.interval)
+        return
+
+    rate, latencies, tags, lag, plugin = replay(args.capture, args.speed, args.owl_type, args.verbose, args.stages)
+    if not latencies:
+        print "%s holds no datagrams" % args.capture
+        return
+
+    ordered = sorted(latencies)
+    print "%d datagrams from %d Owls: %s" % (len(latencies), len(plugin.contextDict),
+                                             ", ".join("%s %d" % item for item in sorted(tags.items())))
+    print "%.0f packets/sec, %d states published, %d errors" % (rate, plugin.publishedCount(), plugin.mylogger.errorCount)
+    print "latency us: mean %.1f  p50 %.1f  p99 %.1f  max %.1f" % (
+        sum(ordered) / len(ordered) * 1e6, percentile(ordered, 0.5) * 1e6,
+        percentile(ordered, 0.99) * 1e6, ordered[-1] * 1e6)
+    if args.speed > 0:
+        print "fell behind the capture's pace by up to %.1f ms" % (lag * 1e3)
+    if plugin.stageTimer != None:
+        print
+        print "\n".join(plugin.stageTimer.table())
+
+if __name__ == "__main__":
+    main()
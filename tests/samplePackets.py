@@ -0,0 +1,26 @@
+# sample NetworkOwl datagrams for the test & benchmark scripts
+# one of each packet shape documented in the packet class docstrings
+#
+# substitute the MAC address with: SAMPLE_PACKETS['solar'] % OWLADDR
+
+SAMPLE_PACKETS = {
+    'solar': "<solar id='%s'><current><generating units='w'>84.00</generating><exporting units='w'>84.00</exporting></current><day><generated units='wh'>145.56</generated><exported units='wh'>145.56</exported></day></solar>",
+
+    'electricity_v1': "<electricity id='%s'><signal rssi='-66' lqi='54'/><battery level='100%%'/><chan id='0'><curr units='w'>661.00</curr><day units='wh'>11860.45</day></chan><chan id='1'><curr units='w'>101.00</curr><day units='wh'>3194.92</day></chan><chan id='2'><curr units='w'>0.00</curr><day units='wh'>0.00</day></chan></electricity>",
+
+    'electricity_v2': "<electricity id='%s' ver='2.0'><timestamp>1458313071</timestamp><signal rssi='-58' lqi='4'/><battery level='100%%'/><channels><chan id='0'><curr units='w'>342.00</curr><day units='wh'>16456.46</day></chan><chan id='1'><curr units='w'>383.00</curr><day units='wh'>13415.39</day></chan><chan id='2'><curr units='w'>0.00</curr><day units='wh'>0.00</day></chan><chan id='3'><curr units='w'>0.00</curr><day units='wh'>0.00</day></chan><chan id='4'><curr units='w'>0.00</curr><day units='wh'>0.00</day></chan><chan id='5'><curr units='w'>0.00</curr><day units='wh'>0.00</day></chan></channels><property><current><watts>342.00</watts><cost>0.00</cost></current><day><wh>16456.46</wh><cost>101.96</cost></day><tariff><curr_price>0.13</curr_price><block_limit>4294967295</block_limit><block_usage>4686</block_usage></tariff></property></electricity>",
+
+    'weather': "<weather id='%s' code='116'><temperature>16.00</temperature><text>Partly Cloudy</text></weather>",
+
+    'heating_v1': "<heating id='%s'><signal rssi='-55' lqi='50'/><battery level='2990mV'/><temperature until='1371022885' zone='0'><current>21.12</current><required>22.05</required></temperature></heating>",
+
+    'heating_v2': "<heating ver='2' id='%s'><timestamp>1459524558</timestamp><zones><zone id='2000217' last='1'><signal rssi='-61' lqi='50'/><battery level='2780'/><conf flags='0'/><temperature state='0' flags='4229' until='1371022885' zone='0'><current>19.75</current><required>22.05</required></temperature></zone></zones></heating>",
+
+    'hot_water_v1': "<hot_water id='%s'><signal rssi='-61' lqi='49'/><battery level='2990mV'/><temperature until='536917880'><current>20.50</current><required>10.00</required></temperature></hot_water>",
+
+    'hot_water_v2': "<hot_water ver='2' id='%s'><timestamp>1459524537</timestamp><zones><zone id='20005DB' last='1'><signal rssi='-61' lqi='49'/><battery level='2630'/><conf flags='0'/><temperature state='0' flags='4096' until='0'><current>28.50</current><required>10.00</required><ambient>26.25</ambient></temperature></zone></zones></hot_water>",
+}
+
+# order to run them in
+SAMPLE_ORDER = ['solar', 'electricity_v1', 'electricity_v2', 'weather',
+                'heating_v1', 'heating_v2', 'hot_water_v1', 'hot_water_v2']